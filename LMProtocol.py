@@ -1,11 +1,202 @@
-from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import bisect
+import functools
+import io
+import itertools
 import math
+import struct
 from bitarray import bitarray
 
 import zlib
-from tqdm import tqdm
+import numpy as np
 
+from arithmetic_coding import (
+    ArithmeticDecoder,
+    ArithmeticEncoder,
+    LiteralModel,
+    RankModel,
+    get_cumulative_frequencies,
+    read_uint,
+    write_uint,
+)
+from bitstream import BitReader, pack_fields
+from compressed_object import CompressedObject
+from container import (
+    get_chunk,
+    is_container,
+    pack_chunks,
+    read_index,
+    split_text,
+    split_words,
+)
+from dictionary import WordDictionary
 from models import ILanguageModel
+from models.cache import CachedLanguageModel
+from models.inference import PRECISIONS
+from models.instrumentation import Metrics
+from priming import PRIMING_ID_FIELDS
+from streaming import ByteReader, ZlibReader, iter_words
+
+
+# Every compressed stream starts with MAGIC and the fields of HEADER_FIELDS:
+# FORMAT_VERSION, the coding id, a byte of flags, the inference precision id,
+# the context window length, the base 2 logarithms of the number of next word
+# possibilities and of the maximum bit size of the initial context, and the
+# length of the name of the language model that produced it. The name follows.
+MAGIC = b"NC"
+FORMAT_VERSION = 5
+HEADER_FIELDS = struct.Struct(">BBBBHBBB")
+# Size of the header up to the model name, whose length is its last byte
+HEADER_FIXED_SIZE = len(MAGIC) + HEADER_FIELDS.size
+
+# Set when the stream was produced by compress_many, whose rankings come from
+# batched predictions and can only be reproduced by decompress_many.
+FLAG_LOCKSTEP = 1
+# Set when the stream codes the model's token ids instead of whitespace-separated
+# words, and decodes to the exact original text.
+FLAG_TOKENS = 2
+# Set when the stream was produced by compress_stream. After the header comes a
+# zlib stream holding the initial context and then frames of coded words, each
+# prefixed with its number of words and its length in bytes. A frame of 0 words
+# ends the stream.
+FLAG_STREAMING = 4
+# Set when each word was coded with the teacher-forced predictions of a span of
+# words, see LMProtocol._compress_spans. The header is followed by the number of
+# words of the spans and the number of model input positions they are padded to.
+FLAG_SPANS = 8
+# Set when the protocol was primed, see priming.PrimingDictionary. The model name
+# in the header is followed by the identifier of the priming dictionary, and no
+# initial context is stored.
+FLAG_PRIMED = 16
+# Set on streams of compress_stream with sync points, from which decoding can
+# start without the words before. The header is followed by the number of words
+# between sync points, and the zlib stream by a seek index: one SEEK_INDEX_ENTRY
+# per sync point, then SEEK_INDEX_TRAILER. The first frame of a sync point starts
+# after a full flush of the zlib stream, and its header is followed by the
+# length and the words of the context window preceding it.
+FLAG_SYNC = 32
+# Index in the document of the first word of a sync point, and offset in bytes
+# of its first frame from the start of the stream.
+SEEK_INDEX_ENTRY = struct.Struct(">QQ")
+# Number of words of the document and number of sync points.
+SEEK_INDEX_TRAILER = struct.Struct(">QI")
+
+# Entropy coding backends, indexed by their id in the stream header:
+#   rank: fixed-width top-k rankings, out of vocabulary words being references to
+#       the words coded before or raw UTF-8, compressed with zlib.
+#   arithmetic: arithmetic coding of the rankings with the model's probabilities,
+#       escaping to an adaptive byte model for out of vocabulary words.
+#   gamma: Elias-gamma codes of the rankings, out of vocabulary words being an
+#       escape symbol after the last ranking, compressed with zlib.
+#   adaptive: arithmetic coding of the rankings with an adaptive model of the
+#       rankings observed so far, see RankModel, escaping to an adaptive byte model
+#       for out of vocabulary words.
+CODINGS = ("rank", "arithmetic", "gamma", "adaptive")
+# Codings whose records are arithmetic coded rather than packed into bit fields
+ARITHMETIC_CODINGS = ("arithmetic", "adaptive")
+
+# Units of text coded by the protocol:
+#   word: whitespace-separated words, whitespace is normalized to single spaces.
+#   token: the language model's own token ids, preserving the text exactly. Every
+#       token is in the model's vocabulary, tokens outside the top-k are escaped
+#       with their id. The model must implement the token methods of ILanguageModel.
+UNITS = ("word", "token")
+
+# Protocol owned by each process pool worker of compress_chunked and decompress_chunked
+_worker_protocol = None
+
+
+def get_stream_parameters(compressed_binary):
+    """
+    Reads the header of a compressed stream, which describes how to decode it.
+    @param compressed_binary: binary string starting with a header.
+    @returns Dict: coding, flags, precision, context_window_length,
+        next_word_possibilities_number, initial_context_max_bit_size, model, the
+        name of the language model, priming, the (name, version, checksum) of the
+        priming dictionary or None, and header_size.
+    @raises ValueError if the header is not one of this version.
+    """
+    if compressed_binary[: len(MAGIC)] != MAGIC:
+        raise ValueError("Not a compressed stream.")
+    if len(compressed_binary) < HEADER_FIXED_SIZE:
+        raise ValueError("Truncated stream header.")
+    (
+        version,
+        coding_id,
+        flags,
+        precision_id,
+        context_window_length,
+        next_word_possibilities_exponent,
+        initial_context_max_bit_exponent,
+        model_name_length,
+    ) = HEADER_FIELDS.unpack(compressed_binary[len(MAGIC) : HEADER_FIXED_SIZE])
+    if version != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported stream version {version} (expected {FORMAT_VERSION})."
+        )
+    if coding_id >= len(CODINGS):
+        raise ValueError(f"Unknown coding id {coding_id}.")
+    if precision_id >= len(PRECISIONS):
+        raise ValueError(f"Unknown precision id {precision_id}.")
+
+    header_size = HEADER_FIXED_SIZE + model_name_length
+    model_name = compressed_binary[HEADER_FIXED_SIZE:header_size]
+    priming = None
+    if flags & FLAG_PRIMED:
+        if len(compressed_binary) <= header_size:
+            raise ValueError("Truncated stream header.")
+        priming_name_length = compressed_binary[header_size]
+        priming_name = compressed_binary[
+            header_size + 1 : header_size + 1 + priming_name_length
+        ]
+        header_size += 1 + priming_name_length
+        priming = (bytes(priming_name).decode("utf-8"),) + PRIMING_ID_FIELDS.unpack(
+            compressed_binary[header_size : header_size + PRIMING_ID_FIELDS.size]
+        )
+        header_size += PRIMING_ID_FIELDS.size
+    if len(compressed_binary) < header_size:
+        raise ValueError("Truncated stream header.")
+    return {
+        "coding": CODINGS[coding_id],
+        "flags": flags,
+        "precision": PRECISIONS[precision_id],
+        "context_window_length": context_window_length,
+        "next_word_possibilities_number": 1 << next_word_possibilities_exponent,
+        "initial_context_max_bit_size": 1 << initial_context_max_bit_exponent,
+        "model": bytes(model_name).decode("utf-8"),
+        "priming": priming,
+        "header_size": header_size,
+    }
+
+
+def _init_worker(protocol_arguments, num_threads):
+    global _worker_protocol
+    if num_threads is not None:
+        import torch
+
+        torch.set_num_threads(num_threads)
+    _worker_protocol = LMProtocol(**protocol_arguments)
+
+
+def _compress_in_worker(text):
+    return _worker_protocol.compress(text)
+
+
+def _decompress_in_worker(compressed_binary):
+    return _worker_protocol.decompress(compressed_binary)
+
+
+def _operation(method):
+    """
+    Records calls to an LMProtocol method as an operation of its metrics.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.metrics.operation(method.__name__):
+            return method(self, *args, **kwargs)
+
+    return wrapper
 
 
 class LMProtocol:
@@ -14,218 +205,1532 @@ class LMProtocol:
         language_model,
         context_window_length=16,
         next_word_possibilities_number=16,
-        out_of_vocabulary_word_max_bit_size=1024,
         initial_context_max_bit_size=16384,
+        language_model_kwargs=None,
+        coding="rank",
+        unit="word",
+        prediction_cache=None,
+        metrics=None,
+        span_words_number=None,
+        priming=None,
+        sync_words_number=None,
     ):
         """
         @param language_model: ILanguageModel
+        @param language_model_kwargs: Dict of extra constructor arguments for the
+            language model, e.g. {"incremental": True}.
+        @param coding: Entropy coding backend used by compress, one of CODINGS.
+        @param unit: Unit of text coded by compress, one of UNITS.
+        @param prediction_cache: PredictionCache answering the model's predictions
+            for contexts already seen, or None. Protocols may share one.
+        @param metrics: models.instrumentation.Metrics recording the stage timers
+            and coding counters of this protocol and its model, or None for new
+            ones. Protocols may share one. Process pool workers record their own.
+        @param span_words_number: Int maximum number of words compress scores per
+            model call, with teacher forcing, or None to score them one at a time.
+            Decompression stays sequential. Not available at int8 precision.
+        @param priming: PrimingDictionary the model is conditioned on before the
+            first word, in place of an initial context stored in each stream, or
+            None. Primed streams can hold any number of words.
+        @param sync_words_number: Int number of words between the sync points of
+            the streams of compress and compress_stream, from which
+            decompress_range resumes decoding, or None for no sync points. Each
+            sync point stores a context window and restarts the adaptive models.
         """
+        assert coding in CODINGS
+        assert unit in UNITS
+        self._protocol_arguments = {
+            "language_model": language_model,
+            "context_window_length": context_window_length,
+            "next_word_possibilities_number": next_word_possibilities_number,
+            "initial_context_max_bit_size": initial_context_max_bit_size,
+            "language_model_kwargs": language_model_kwargs,
+            "coding": coding,
+            "unit": unit,
+            "prediction_cache": prediction_cache,
+            "span_words_number": span_words_number,
+            "priming": priming,
+            "sync_words_number": sync_words_number,
+        }
         assert math.log2(next_word_possibilities_number).is_integer()
-        assert math.log2(out_of_vocabulary_word_max_bit_size).is_integer()
         assert math.log2(initial_context_max_bit_size).is_integer()
+        assert context_window_length < 1 << 16
+        if span_words_number is not None:
+            if unit != "word":
+                raise ValueError("Teacher-forced spans only code words.")
+            assert context_window_length > 0
+            assert 0 < span_words_number < 1 << 16
+        if priming is not None and unit != "word":
+            raise ValueError("Priming dictionaries only apply to words.")
+        if sync_words_number is not None:
+            if unit != "word" or span_words_number is not None:
+                raise ValueError("Sync points only apply to streamed words.")
+            assert 0 < sync_words_number < 1 << 32
         self.lm = language_model(
             context_window_length=context_window_length,
             next_word_possibilities_number=next_word_possibilities_number,
+            **(language_model_kwargs or {}),
         )
+        if span_words_number is not None and self.lm.get_precision() == "int8":
+            # The activation scales of dynamic quantization depend on the padded
+            # positions, which hold words when compressing, see pad_span
+            raise ValueError("Teacher-forced spans do not reproduce at int8 precision.")
+        if prediction_cache is not None:
+            self.lm = CachedLanguageModel(self.lm, prediction_cache)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.lm.set_metrics(self.metrics)
         self._context_window_length = context_window_length
         self._next_word_possibilities_number = next_word_possibilities_number
-        self._out_of_vocabulary_word_max_bit_size = out_of_vocabulary_word_max_bit_size
         self._initial_context_max_bit_size = initial_context_max_bit_size
+        self._coding = coding
+        self._unit = unit
+        self._span_words_number = span_words_number
+        self._priming = priming
+        # Model state after the priming context, computed on first use
+        self._primed_state = None
+        self._sync_words_number = sync_words_number
+
+    def close(self):
+        """
+        Releases the resources of the model, e.g. the threads of a mixture. The
+        protocol is not used after.
+        """
+        self.lm.close()
 
+    @_operation
     def compress(self, text):
         """
         @param text: String to compress
         @returns binary string
         """
+        if self._unit == "token":
+            return self._compress_tokens(text)
+        if self._span_words_number is not None:
+            return self._compress_spans(text)
+        if self._sync_words_number is not None:
+            writer = io.BytesIO()
+            self.compress_stream(io.StringIO(text), writer)
+            return writer.getvalue()
+
+        header = self._get_header()
+
+        if self._coding in ARITHMETIC_CODINGS:
+            return header + self._get_arithmetic_binary(text)
 
         compressed_object = self._get_compressed_object(text)
-        binary = self._get_binary_from_object(compressed_object)
-        zlib_binary = zlib.compress(binary.tobytes())
+        zlib_binary = self._zlib_compress(
+            self._get_binary_from_object(compressed_object)
+        )
 
-        return zlib_binary
+        return header + zlib_binary
 
+    @_operation
     def decompress(self, compressed_binary):
         """
         @param compressed_binary: binary string
         @returns original string
         """
+        if is_container(compressed_binary):
+            return self.decompress_chunked(compressed_binary, workers=1)
+
+        coding, flags, payload = self._read_header(compressed_binary)
+        if flags & FLAG_LOCKSTEP:
+            raise ValueError("Stream was compressed in lockstep, use decompress_many.")
+        if flags & FLAG_TOKENS:
+            return self._decompress_tokens(coding, payload)
+        if flags & FLAG_SPANS:
+            return self._decompress_spans(coding, payload)
+        if flags & FLAG_STREAMING:
+            writer = io.StringIO()
+            self.decompress_stream(io.BytesIO(compressed_binary), writer)
+            return writer.getvalue()
+
+        if coding in ARITHMETIC_CODINGS:
+            return self._get_string_from_arithmetic_binary(payload, coding)
+
         binary = bitarray()
-        binary.frombytes(zlib.decompress(compressed_binary))
-        compressed_object = self._get_object_from_binary(binary)
+        binary.frombytes(self._zlib_decompress(payload))
+        compressed_object = self._get_object_from_binary(binary, coding=coding)
         uncompressed_string = self._get_string_from_compressed_object(compressed_object)
         return uncompressed_string
 
-    def _get_compressed_object(self, text):
+    @_operation
+    def compress_stream(
+        self, reader, writer, frame_words_number=1024, buffer_size=1 << 16
+    ):
+        """
+        Compresses text incrementally. Only one input buffer, one frame of words and
+        the model context are held in memory.
+        @param reader: Text file object, or an iterable of strings.
+        @param writer: Binary file object receiving the compressed stream.
+        @param frame_words_number: Int number of words coded per frame.
+        @param buffer_size: Int number of characters read at a time.
         """
+        if self._unit != "word":
+            raise ValueError("Streaming compression only codes words.")
+
+        words = iter_words(reader, buffer_size)
+        initial_context = []
+        if self._priming is None:
+            initial_context = list(itertools.islice(words, self._context_window_length))
+        compressor = zlib.compressobj()
+        sync_words_number = self._sync_words_number
+
+        header = self._get_header(FLAG_STREAMING)
+        if sync_words_number is not None:
+            header = self._get_header(FLAG_STREAMING | FLAG_SYNC) + struct.pack(
+                ">I", sync_words_number
+            )
+        writer.write(header)
+        # Number of bytes written, the offsets of the sync points
+        stream_size = len(header)
+        initial_context_bytes = " ".join(initial_context).encode("utf-8")
+        data = compressor.compress(
+            struct.pack(">I", len(initial_context_bytes)) + initial_context_bytes
+        )
+        writer.write(data)
+        stream_size += len(data)
+
+        self._reset_lm(initial_context)
+        literal_model = self._get_literal_model()
+        rank_model = self._get_rank_model(self._coding)
+        # Index in the document of the next word, and words preceding it
+        position = len(initial_context)
+        context = list(initial_context)
+        sync_points = []
+        while True:
+            frame_size = frame_words_number
+            if sync_words_number is not None:
+                # Frames end at the sync points
+                frame_size = min(
+                    frame_size, sync_words_number - position % sync_words_number
+                )
+            frame_words = list(itertools.islice(words, frame_size))
+            if len(frame_words) == 0:
+                break
+
+            # Sync points are every sync_words_number words of the document,
+            # after the initial context
+            sync_context = None
+            if (
+                sync_words_number is not None
+                and position > len(initial_context)
+                and position % sync_words_number == 0
+            ):
+                data = compressor.flush(zlib.Z_FULL_FLUSH)
+                writer.write(data)
+                stream_size += len(data)
+                sync_points.append((position, stream_size))
+                sync_context = " ".join(context).encode("utf-8")
+                self.lm.reset(list(context))
+                literal_model = self._get_literal_model()
+                rank_model = self._get_rank_model(self._coding)
+
+            frame = self._get_stream_frame(frame_words, literal_model, rank_model)
+            if sync_context is not None:
+                # The context window of a sync point follows its frame header
+                frame = (
+                    frame[:8]
+                    + struct.pack(">I", len(sync_context))
+                    + sync_context
+                    + frame[8:]
+                )
+            with self.metrics.timer("zlib"):
+                data = compressor.compress(frame)
+            writer.write(data)
+            stream_size += len(data)
+            position += len(frame_words)
+            if sync_words_number is not None:
+                for word in frame_words:
+                    self._add_to_window(context, word)
+
+        writer.write(compressor.compress(struct.pack(">II", 0, 0)))
+        writer.write(compressor.flush())
+        if sync_words_number is not None:
+            for sync_point in sync_points:
+                writer.write(SEEK_INDEX_ENTRY.pack(*sync_point))
+            writer.write(SEEK_INDEX_TRAILER.pack(position, len(sync_points)))
+
+    @_operation
+    def decompress_stream(self, reader, writer, buffer_size=1 << 16):
+        """
+        Decompresses a stream produced by compress_stream incrementally, writing
+        words as they are decoded.
+        @param reader: Binary file object, or an iterable of bytes.
+        @param writer: Text file object receiving the original text.
+        @param buffer_size: Int number of bytes read at a time.
+        """
+        byte_reader = ByteReader(reader, buffer_size)
+        header = byte_reader.read(HEADER_FIXED_SIZE)
+        header += byte_reader.read(header[-1])
+        # The identifier of the priming dictionary follows the model name
+        if HEADER_FIELDS.unpack_from(header, len(MAGIC))[2] & FLAG_PRIMED:
+            header += byte_reader.read(1)
+            header += byte_reader.read(header[-1] + PRIMING_ID_FIELDS.size)
+        coding, flags, _ = self._read_header(header)
+        if not flags & FLAG_STREAMING:
+            raise ValueError("Not a streaming compressed stream.")
+        sync_words_number = None
+        if flags & FLAG_SYNC:
+            (sync_words_number,) = struct.unpack(">I", byte_reader.read(4))
+
+        # The seek index following the zlib stream is left unread
+        zlib_reader = ZlibReader(byte_reader.read_rest())
+        separator = ""
+        for word in self._iter_stream_words(coding, zlib_reader, sync_words_number):
+            writer.write(separator + word)
+            separator = " "
+
+    def _iter_stream_words(
+        self, coding, zlib_reader, sync_words_number=None, position=None
+    ):
+        """
+        Yields the words of a stream of compress_stream.
+        @param zlib_reader: ZlibReader at the start of the zlib stream, or at the
+            first frame of a sync point.
+        @param sync_words_number: Int number of words between sync points, or None.
+        @param position: Int index in the document of the first word of the sync
+            point zlib_reader is at, or None if it is at the start.
+        """
+        sync_point = position is not None
+        if not sync_point:
+            (initial_context_length,) = struct.unpack(">I", zlib_reader.read(4))
+            initial_context = zlib_reader.read(initial_context_length).decode("utf-8")
+            initial_context = initial_context.split()
+            yield from initial_context
+            position = len(initial_context)
+            self._reset_lm(initial_context)
+            literal_model = self._get_literal_model()
+            rank_model = self._get_rank_model(coding)
+
+        while True:
+            words_number, frame_length = struct.unpack(">II", zlib_reader.read(8))
+            if words_number == 0:
+                return
+            if sync_point:
+                (context_length,) = struct.unpack(">I", zlib_reader.read(4))
+                self.lm.reset(zlib_reader.read(context_length).decode("utf-8").split())
+                literal_model = self._get_literal_model()
+                rank_model = self._get_rank_model(coding)
+            frame = zlib_reader.read(frame_length)
+            yield from self._iter_stream_frame(
+                coding, frame, words_number, literal_model, rank_model
+            )
+            position += words_number
+            sync_point = (
+                sync_words_number is not None and position % sync_words_number == 0
+            )
+
+    def _get_stream_frame(self, words, literal_model, rank_model=None):
+        """
+        Codes words following the current model context.
+        @param literal_model: LiteralModel shared by the frames of a stream, whose
+            dictionary holds the out of vocabulary words of the previous frames.
+        @param rank_model: RankModel shared by the frames of an adaptive stream.
+        @returns bytes: frame header and payload.
+        """
+        if self._coding in ARITHMETIC_CODINGS:
+            encoder = ArithmeticEncoder()
+            for word in words:
+                prediction = self._predict()
+                self._write_arithmetic_word(
+                    encoder, literal_model, prediction, word, rank_model
+                )
+                self.lm.add_word_to_context(word)
+            encoder.finish()
+            payload = encoder.tobytes()
+        else:
+            compressed_object = CompressedObject()
+            for word in words:
+                self._add_compressed_word(compressed_object, self._predict(), word)
+                self.lm.add_word_to_context(word)
+            with self.metrics.timer("serialize"):
+                payload, _ = pack_fields(
+                    *self._get_word_fields(
+                        compressed_object, dictionary=literal_model.dictionary
+                    )
+                )
+        return struct.pack(">II", len(words), len(payload)) + payload
+
+    def _iter_stream_frame(
+        self, coding, frame, words_number, literal_model, rank_model=None
+    ):
+        """
+        Yields the words of a frame, following the current model context.
+        """
+        if coding in ARITHMETIC_CODINGS:
+            decoder = ArithmeticDecoder(frame)
+            for _ in range(words_number):
+                prediction = self._predict()
+                word = self._read_arithmetic_word(
+                    decoder, literal_model, prediction, rank_model
+                )
+                self.lm.add_word_to_context(word)
+                yield word
+        else:
+            records = self._iter_words_from_binary(
+                BitReader(frame), coding=coding, dictionary=literal_model.dictionary
+            )
+            for out_of_vocabulary, value in itertools.islice(records, words_number):
+                if out_of_vocabulary:
+                    word = value
+                else:
+                    word = self._get_word_from_compressed_word(
+                        self._predict(), (out_of_vocabulary, value)
+                    )
+                self.lm.add_word_to_context(word)
+                yield word
+
+    @_operation
+    def compress_chunked(
+        self, text, chunk_words_number=4096, workers=None, worker_threads=1
+    ):
+        """
+        Compresses the text as a container of independently decodable chunks.
+        Each chunk carries its own initial context and is compressed by its own
+        process pool worker.
         @param text: String to compress
-        @returns Dict:
-            initial_context: String
-            words: List<Dict:
-                out_of_vocabulary: Bool
-                word: String (only if out_of_vocabulary)
-                ranking: Int (only if not out_of_vocabulary)
-            >
-        """
-        words = text.split()
+        @param chunk_words_number: Int number of words per chunk. Chunks of words
+            hold their initial context, unless primed, so they must be longer than
+            the context window.
+        @param workers: Int number of worker processes, defaults to the number of CPUs.
+            With 1 worker, chunks are compressed in this process.
+        @param worker_threads: Int number of torch threads per worker process, or None.
+        @returns binary string
+        """
+        if chunk_words_number <= 0:
+            raise ValueError("Chunks must hold at least one word.")
+        if (
+            self._unit == "word"
+            and self._priming is None
+            and chunk_words_number <= self._context_window_length
+        ):
+            raise ValueError(
+                f"Chunks of {chunk_words_number} words do not fit the initial "
+                f"context of {self._context_window_length} words and a coded word."
+            )
+
+        if self._unit == "token":
+            chunk_texts = split_text(text, chunk_words_number, 0)
+            words_numbers = [len(chunk_text.split()) for chunk_text in chunk_texts]
+        else:
+            # Primed chunks code every word, without an initial context
+            min_words_number = (
+                self._context_window_length if self._priming is None else 0
+            )
+            chunks = split_words(text.split(), chunk_words_number, min_words_number)
+            chunk_texts = [" ".join(chunk) for chunk in chunks]
+            words_numbers = [len(chunk) for chunk in chunks]
+        compressed_chunks = self._map_chunks(
+            _compress_in_worker, self.compress, chunk_texts, workers, worker_threads
+        )
+        return pack_chunks(compressed_chunks, words_numbers)
+
+    @_operation
+    def decompress_chunked(self, compressed_binary, workers=None, worker_threads=1):
+        """
+        @param compressed_binary: binary string produced by compress_chunked.
+        @param workers: Int number of worker processes, defaults to the number of CPUs.
+        @param worker_threads: Int number of torch threads per worker process, or None.
+        @returns original string
+        """
+        index = read_index(compressed_binary)
+        compressed_chunks = [
+            get_chunk(compressed_binary, i, index) for i in range(len(index))
+        ]
+        chunk_texts = self._map_chunks(
+            _decompress_in_worker,
+            self.decompress,
+            compressed_chunks,
+            workers,
+            worker_threads,
+        )
+        # Token streams keep their whitespace, word streams are joined by a space
+        if (
+            compressed_chunks
+            and self._read_header(compressed_chunks[0])[1] & FLAG_TOKENS
+        ):
+            return "".join(chunk_texts)
+        return " ".join(chunk_texts)
+
+    @_operation
+    def decompress_chunk(self, compressed_binary, chunk_number):
+        """
+        Decompresses a single chunk of a container without decoding the others.
+        @param compressed_binary: binary string produced by compress_chunked.
+        @param chunk_number: Int
+        @returns the chunk's string
+        """
+        return self.decompress(get_chunk(compressed_binary, chunk_number))
+
+    @_operation
+    def decompress_range(self, compressed_binary, start_word, end_word):
+        """
+        Decompresses the words of a document from index start_word to end_word,
+        excluded. Streams with sync points are decoded from the last sync point
+        at or before start_word, and containers of compress_chunked only decode
+        the chunks holding the range, so the time taken depends on the distance
+        between sync points or on the chunk size rather than on the length of
+        the document. Other streams are decoded from their first word.
+        @param compressed_binary: binary string
+        @param start_word: Int index of the first word.
+        @param end_word: Int index following the last word, capped at the number
+            of words of the document.
+        @returns String words of the range, separated by single spaces.
+        """
+        if start_word < 0 or end_word < 0:
+            raise ValueError("Word indices must not be negative.")
+        if end_word <= start_word:
+            return ""
+
+        if is_container(compressed_binary):
+            index = read_index(compressed_binary)
+            ranges = []
+            first_word = 0
+            for i, entry in enumerate(index):
+                last_word = first_word + entry.words_number
+                if first_word < end_word and start_word < last_word:
+                    ranges.append(
+                        self.decompress_range(
+                            get_chunk(compressed_binary, i, index),
+                            max(start_word - first_word, 0),
+                            end_word - first_word,
+                        )
+                    )
+                first_word = last_word
+            return " ".join(ranges)
+
+        coding, flags, payload = self._read_header(compressed_binary)
+        if not flags & FLAG_SYNC:
+            words = self.decompress(compressed_binary).split()
+            return " ".join(words[start_word:end_word])
+
+        (sync_words_number,) = struct.unpack(">I", payload[:4])
+        words_number, sync_points_number = SEEK_INDEX_TRAILER.unpack(
+            compressed_binary[-SEEK_INDEX_TRAILER.size :]
+        )
+        index_start = (
+            len(compressed_binary)
+            - SEEK_INDEX_TRAILER.size
+            - sync_points_number * SEEK_INDEX_ENTRY.size
+        )
+        sync_points = [
+            SEEK_INDEX_ENTRY.unpack_from(
+                compressed_binary, index_start + i * SEEK_INDEX_ENTRY.size
+            )
+            for i in range(sync_points_number)
+        ]
+
+        i = bisect.bisect_right([position for position, _ in sync_points], start_word)
+        if i == 0:
+            first_word = 0
+            words = self._iter_stream_words(
+                coding, ZlibReader([payload[4:]]), sync_words_number
+            )
+        else:
+            first_word, offset = sync_points[i - 1]
+            # The zlib stream was fully flushed before the sync point
+            zlib_reader = ZlibReader(
+                [compressed_binary[offset:index_start]], -zlib.MAX_WBITS
+            )
+            words = self._iter_stream_words(
+                coding, zlib_reader, sync_words_number, first_word
+            )
+        return " ".join(
+            itertools.islice(
+                words,
+                start_word - first_word,
+                max(min(end_word, words_number) - first_word, 0),
+            )
+        )
+
+    def _map_chunks(self, worker_function, function, chunks, workers, worker_threads):
+        if workers == 1 or len(chunks) <= 1:
+            return [function(chunk) for chunk in chunks]
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(self._protocol_arguments, worker_threads),
+        ) as executor:
+            return list(executor.map(worker_function, chunks))
+
+    @_operation
+    def compress_many(self, texts):
+        """
+        Compresses several documents in lockstep: at each step, the next word of
+        every unfinished document is scored in one batched model call.
+        The resulting streams must be decompressed with decompress_many.
+        @param texts: List<String> to compress.
+        @returns List of binary strings.
+        """
+        streams = [self._open_lockstep_compression(text) for text in texts]
+        for step, active_streams, predictions in self._iter_lockstep(streams):
+            for stream, prediction in zip(active_streams, predictions):
+                self._code_lockstep_word(stream, step, prediction)
+        return [self._close_lockstep_compression(stream) for stream in streams]
+
+    @_operation
+    def decompress_many(self, compressed_binaries):
+        """
+        @param compressed_binaries: List of binary strings produced by compress_many.
+        @returns List of original strings.
+        """
+        streams = [
+            self._open_lockstep_decompression(compressed_binary)
+            for compressed_binary in compressed_binaries
+        ]
+        for step, active_streams, predictions in self._iter_lockstep(streams):
+            for stream, prediction in zip(active_streams, predictions):
+                self._decode_lockstep_word(stream, step, prediction)
+        return [self._close_lockstep_decompression(stream) for stream in streams]
+
+    def _open_lockstep_compression(self, text):
+        """
+        The state of a document compressed in lockstep. Its context holds the
+        window of words the next one is predicted from, given to batch_top_k.
+        @param text: String to compress.
+        @returns Dict: context: List<String>, words: List<String> left to code, and
+            the coder's state.
+        """
+        if self._unit != "word":
+            raise ValueError("Lockstep compression only codes words.")
+
+        initial_context, words = self._split_initial_context(text.split())
+        stream = {
+            "context": self._get_context_window(initial_context),
+            "words": words,
+        }
+        if self._coding in ARITHMETIC_CODINGS:
+            stream["encoder"] = ArithmeticEncoder()
+            stream["literal_model"] = self._get_literal_model()
+            stream["rank_model"] = self._get_rank_model(self._coding)
+            stream["literal_model"].write(stream["encoder"], " ".join(initial_context))
+        else:
+            stream["compressed_object"] = CompressedObject(" ".join(initial_context))
+        return stream
+
+    def _code_lockstep_word(self, stream, step, prediction):
+        """
+        Codes the word of the given step with the prediction for the stream's
+        context, then moves the context on.
+        """
+        word = stream["words"][step]
+        if self._coding in ARITHMETIC_CODINGS:
+            self._write_arithmetic_word(
+                stream["encoder"],
+                stream["literal_model"],
+                prediction,
+                word,
+                stream["rank_model"],
+            )
+        else:
+            self._add_compressed_word(stream["compressed_object"], prediction, word)
+        self._add_to_window(stream["context"], word)
+
+    def _close_lockstep_compression(self, stream):
+        """
+        @returns binary string of a stream whose words were all coded.
+        """
+        if self._coding in ARITHMETIC_CODINGS:
+            stream["encoder"].finish()
+            payload = struct.pack(">I", len(stream["words"]))
+            payload += stream["encoder"].tobytes()
+        else:
+            payload = self._zlib_compress(
+                self._get_binary_from_object(stream["compressed_object"])
+            )
+        return self._get_header(FLAG_LOCKSTEP) + payload
+
+    def _open_lockstep_decompression(self, compressed_binary):
+        """
+        @param compressed_binary: binary string produced in lockstep.
+        @returns Dict: context: List<String>, words: records left to decode, and
+            the decoder's state.
+        """
+        coding, flags, payload = self._read_header(compressed_binary)
+        if not flags & FLAG_LOCKSTEP:
+            raise ValueError("Stream was not compressed in lockstep.")
+
+        stream = {"coding": coding, "decoded_words": []}
+        if coding in ARITHMETIC_CODINGS:
+            (words_number,) = struct.unpack(">I", payload[:4])
+            stream["decoder"] = ArithmeticDecoder(payload[4:])
+            stream["literal_model"] = self._get_literal_model()
+            stream["rank_model"] = self._get_rank_model(coding)
+            initial_context = stream["literal_model"].read(stream["decoder"])
+            stream["words"] = [None] * words_number
+        else:
+            binary = bitarray()
+            binary.frombytes(self._zlib_decompress(payload))
+            compressed_object = self._get_object_from_binary(binary, coding=coding)
+            initial_context = compressed_object.initial_context
+            stream["words"] = compressed_object
+        stream["initial_context"] = initial_context.split()
+        stream["context"] = self._get_context_window(stream["initial_context"])
+        return stream
+
+    def _decode_lockstep_word(self, stream, step, prediction):
+        """
+        Decodes the word of the given step with the prediction for the stream's
+        context, then moves the context on.
+        """
+        if stream["coding"] in ARITHMETIC_CODINGS:
+            word = self._read_arithmetic_word(
+                stream["decoder"],
+                stream["literal_model"],
+                prediction,
+                stream["rank_model"],
+            )
+        else:
+            word = self._get_word_from_compressed_word(
+                prediction, stream["words"][step]
+            )
+        stream["decoded_words"].append(word)
+        self._add_to_window(stream["context"], word)
+
+    def _close_lockstep_decompression(self, stream):
+        """
+        @returns String of a stream whose words were all decoded.
+        """
+        return " ".join(stream["initial_context"] + stream["decoded_words"])
+
+    def _iter_lockstep(self, streams):
+        """
+        Yields (step, active streams, predictions) where the predictions for the
+        current context of every stream with more than step words come from one
+        batched model call. The caller must advance each stream's context.
+        Compression and decompression call the model for the same contexts in the
+        same batches, so both see identical predictions.
+        @param streams: List<Dict: context: List<String>, words: List>
+        """
+        steps_number = max([len(stream["words"]) for stream in streams], default=0)
+        for step in range(steps_number):
+            active_streams = [
+                stream for stream in streams if step < len(stream["words"])
+            ]
+            with self.metrics.timer("predict"):
+                predictions = self.lm.batch_top_k(
+                    [stream["context"] for stream in active_streams]
+                )
+            yield step, active_streams, predictions
+
+    def _predict(self):
+        """
+        @returns the model's top_k for the current context, timed.
+        """
+        with self.metrics.timer("predict"):
+            return self.lm.top_k()
+
+    def _zlib_compress(self, data):
+        with self.metrics.timer("zlib"):
+            return zlib.compress(data)
+
+    def _zlib_decompress(self, data):
+        with self.metrics.timer("zlib"):
+            return zlib.decompress(data)
+
+    def _split_initial_context(self, words):
+        """
+        Splits the words of a text into its initial context, stored as is in the
+        stream, and the words coded with the model. Primed protocols store no
+        initial context.
+        @returns (List<String> initial context, List<String> coded words)
+        """
+        if self._priming is not None:
+            return [], words
         assert len(words) > self._context_window_length
-        compressed_object = {}
-        compressed_object["initial_context"] = " ".join(
-            words[: self._context_window_length]
+        return (
+            words[: self._context_window_length],
+            words[self._context_window_length :],
+        )
+
+    def _get_context_window(self, initial_context):
+        """
+        @returns List<String> words the first coded word is predicted from.
+        """
+        if self._priming is not None:
+            return self._priming.get_context(self._context_window_length)
+        return list(initial_context)
+
+    def _reset_lm(self, initial_context):
+        """
+        Resets the model to the context of the first coded word. The model state
+        after the priming context is only computed once, and then restored.
+        """
+        if self._priming is None:
+            self.lm.reset(list(initial_context))
+        elif self._primed_state is None:
+            self.lm.reset(self._get_context_window(initial_context))
+            self._primed_state = self.lm.get_state()
+        else:
+            self.lm.set_state(self._primed_state)
+
+    def _get_dictionary(self):
+        """
+        @returns WordDictionary of the out of vocabulary words known before the
+            first one.
+        """
+        if self._priming is not None:
+            return self._priming.get_dictionary()
+        return WordDictionary()
+
+    def _get_literal_model(self):
+        return LiteralModel(dictionary=self._get_dictionary())
+
+    def _add_to_window(self, context, word):
+        context.append(word)
+        if len(context) > self._context_window_length:
+            del context[0]
+
+    @_operation
+    def get_ranking_checksums(self, text, chunk_words_number=1024):
+        """
+        Runs the model over text the way compress does and checksums the rankings
+        it predicts, to check that they reproduce.
+        @param text: String
+        @param chunk_words_number: Int number of predictions covered by each checksum.
+        @returns List<Int> CRC-32 of the token ids and quantized probabilities of
+            each chunk of chunk_words_number predictions.
+        """
+        checksums = []
+        checksum = 0
+        i = None
+        for i, (token_ids, probabilities) in enumerate(self._iter_predictions(text)):
+            checksum = zlib.crc32(token_ids.numpy().astype(">i8").tobytes(), checksum)
+            checksum = zlib.crc32(
+                probabilities.numpy().astype(">f4").tobytes(), checksum
+            )
+            if (i + 1) % chunk_words_number == 0:
+                checksums.append(checksum)
+                checksum = 0
+        # The last chunk is partial, or there was no prediction at all
+        if i is None or (i + 1) % chunk_words_number != 0:
+            checksums.append(checksum)
+        return checksums
+
+    def verify(self, text, reference=None, chunk_words_number=1024):
+        """
+        Verification mode for changes to the inference: re-runs the predictions
+        and compares their ranking checksums chunk by chunk.
+        @param reference: LMProtocol whose rankings must be reproduced, e.g. a
+            single threaded full precision configuration, or None to compare
+            this protocol with a second run of itself. Neither run goes through
+            the prediction cache.
+        @returns List<Int> numbers of the chunks whose rankings differ, empty when
+            every ranking reproduces.
+        """
+        reference = reference or self
+        checksums = self.get_ranking_checksums(text, chunk_words_number)
+        reference_checksums = reference.get_ranking_checksums(text, chunk_words_number)
+        if len(checksums) != len(reference_checksums):
+            raise ValueError("The protocols do not predict the same number of units.")
+        return [
+            chunk_number
+            for chunk_number, (checksum, reference_checksum) in enumerate(
+                zip(checksums, reference_checksums)
+            )
+            if checksum != reference_checksum
+        ]
+
+    def _iter_predictions(self, text):
+        """
+        Yields the prediction made for each word, or token, compress would code,
+        replaying its spans and sync points. The predictions are computed by the
+        model, never answered by the prediction cache.
+        """
+        lm = self.lm.lm if isinstance(self.lm, CachedLanguageModel) else self.lm
+        if self._unit == "token":
+            lm.reset_tokens([])
+            for token_id in lm.encode_text(text):
+                with self.metrics.timer("predict"):
+                    yield lm.top_k()
+                lm.add_token_to_context(token_id)
+            return
+
+        initial_context, words = self._split_initial_context(text.split())
+        context = self._get_context_window(initial_context)
+        if self._span_words_number is not None:
+            span_words_number, length = self._get_span_layout(context, words)
+            yield from self._iter_span_predictions(
+                context, words, span_words_number, length
+            )
+            return
+
+        # The model state after the priming context is computed again
+        lm.reset(context)
+        sync_words_number = self._sync_words_number
+        # Words preceding each one, that compress_stream resets the model to at
+        # its sync points
+        window = list(initial_context)
+        for position, word in enumerate(words, len(initial_context)):
+            if (
+                sync_words_number is not None
+                and position > len(initial_context)
+                and position % sync_words_number == 0
+            ):
+                lm.reset(list(window))
+            with self.metrics.timer("predict"):
+                yield lm.top_k()
+            lm.add_word_to_context(word)
+            self._add_to_window(window, word)
+
+    def _compress_spans(self, text):
+        """
+        Codes the words following the initial context with teacher forcing: the
+        whole text being known, the predictions for up to span_words_number words
+        come from one model call over the span, see ILanguageModel.span_top_k.
+        Each prediction is conditioned on the context window preceding the span
+        and on the words of the span before it.
+        @param text: String to compress
+        @returns binary string: header, layout of the spans and payload of the coding.
+        """
+        initial_context, words = self._split_initial_context(text.split())
+        context = self._get_context_window(initial_context)
+        span_words_number, length = self._get_span_layout(context, words)
+        predictions = self._iter_span_predictions(
+            context, words, span_words_number, length
+        )
+
+        if self._coding in ARITHMETIC_CODINGS:
+            encoder = ArithmeticEncoder()
+            literal_model = self._get_literal_model()
+            literal_model.write(encoder, " ".join(initial_context))
+            rank_model = self._get_rank_model(self._coding)
+            for word, prediction in zip(words, predictions):
+                self._write_arithmetic_word(
+                    encoder, literal_model, prediction, word, rank_model
+                )
+            encoder.finish()
+            payload = struct.pack(">I", len(words)) + encoder.tobytes()
+        else:
+            compressed_object = CompressedObject(" ".join(initial_context))
+            for word, prediction in zip(words, predictions):
+                self._add_compressed_word(compressed_object, prediction, word)
+            payload = self._zlib_compress(
+                self._get_binary_from_object(compressed_object)
+            )
+
+        return (
+            self._get_header(FLAG_SPANS)
+            + struct.pack(">HI", span_words_number, length)
+            + payload
         )
 
-        self.lm.reset(compressed_object["initial_context"].split())
+    def _get_span_layout(self, context, words):
+        """
+        Every span is padded to the same number of model input positions, the
+        longest input of a span. The spans are made shorter when that input would
+        not fit in the model.
+        @returns (Int number of words of each span but the last,
+            Int number of model input positions)
+        """
+        max_length = self.lm.get_max_span_length()
+        span_words_number = self._span_words_number
+        while True:
+            length = max(
+                [
+                    self.lm.get_span_length(span_context, span[:-1])
+                    for span_context, span in self._iter_spans(
+                        context, words, span_words_number
+                    )
+                ],
+                default=0,
+            )
+            if max_length is None or length <= max_length or span_words_number == 1:
+                return span_words_number, length
+            span_words_number = (span_words_number + 1) // 2
+
+    def _iter_spans(self, context, words, span_words_number):
+        """
+        Yields (context window, words) of each span of span_words_number words.
+        @param context: List<String> window preceding the first word, of at most
+            context_window_length words.
+        """
+        context_words = list(context) + words
+        for start in range(0, len(words), span_words_number):
+            end = len(context) + start
+            yield (
+                context_words[max(0, end - self._context_window_length) : end],
+                words[start : start + span_words_number],
+            )
 
-        compressed_object["words"] = []
-        print("Getting compressed object.")
-        for word in tqdm(words[self._context_window_length :]):
-            word_probabilities = self.lm()
-            if word not in word_probabilities:
-                compressed_object["words"].append(
-                    {"out_of_vocabulary": True, "word": word}
+    def _iter_span_predictions(self, context, words, span_words_number, length):
+        """
+        Yields the prediction for each word, one model call per span.
+        """
+        for context, span in self._iter_spans(context, words, span_words_number):
+            # The last word of a span is predicted without being part of the input
+            with self.metrics.timer("predict"):
+                predictions = self.lm.span_top_k(context, span[:-1], length)
+            yield from predictions
+
+    def _decompress_spans(self, coding, payload):
+        """
+        Decodes a stream of _compress_spans one word at a time, rebuilding the
+        prediction for each word from the span decoded so far, padded to the same
+        number of model input positions as when compressing.
+        """
+        span_words_number, length = struct.unpack(">HI", payload[:6])
+        payload = payload[6:]
+
+        if coding in ARITHMETIC_CODINGS:
+            (words_number,) = struct.unpack(">I", payload[:4])
+            decoder = ArithmeticDecoder(payload[4:])
+            literal_model = self._get_literal_model()
+            initial_context = literal_model.read(decoder)
+            rank_model = self._get_rank_model(coding)
+        else:
+            binary = bitarray()
+            binary.frombytes(self._zlib_decompress(payload))
+            compressed_object = self._get_object_from_binary(binary, coding=coding)
+            initial_context = compressed_object.initial_context
+            words_number = len(compressed_object)
+
+        initial_context = initial_context.split()
+        history = self._get_context_window(initial_context)
+        words = []
+        span = []
+        for i in range(words_number):
+            if i % span_words_number == 0:
+                for word in span:
+                    self._add_to_window(history, word)
+                words.extend(span)
+                context = list(history)
+                span = []
+
+            if coding in ARITHMETIC_CODINGS:
+                word = self._read_arithmetic_word(
+                    decoder,
+                    literal_model,
+                    self._predict_span(context, span, length),
+                    rank_model,
                 )
             else:
-                ranking = self._get_ranking_from_probabilities(word_probabilities, word)
-                compressed_object["words"].append(
-                    {"out_of_vocabulary": False, "ranking": ranking}
-                )
-            self.lm.add_word_to_context(word)
+                out_of_vocabulary, value = compressed_object[i]
+                if out_of_vocabulary:
+                    word = value
+                else:
+                    word = self._get_word_from_compressed_word(
+                        self._predict_span(context, span, length),
+                        (out_of_vocabulary, value),
+                    )
+            span.append(word)
+        words.extend(span)
+        return " ".join(initial_context + words)
+
+    def _predict_span(self, context, span, length):
+        """
+        @returns the prediction following the words of a partially decoded span.
+        """
+        with self.metrics.timer("predict"):
+            return self.lm.span_top_k(context, span, length, last_only=True)[0]
+
+    def _compress_tokens(self, text):
+        """
+        Codes the text as the language model's token ids.
+        @param text: String to compress
+        @returns binary string
+        """
+        token_ids = self.lm.encode_text(text)
+        if self.lm.decode_tokens(token_ids) != text:
+            raise ValueError(
+                f"The tokenizer of {self.lm} does not round-trip the text."
+            )
+
+        header = self._get_header(FLAG_TOKENS)
+
+        if self._coding in ARITHMETIC_CODINGS:
+            return header + self._get_arithmetic_binary_from_tokens(token_ids)
+
+        compressed_object = self._get_compressed_object_from_tokens(token_ids)
+        return header + self._zlib_compress(
+            self._get_binary_from_object(compressed_object, tokens=True)
+        )
+
+    def _decompress_tokens(self, coding, payload):
+        if coding in ARITHMETIC_CODINGS:
+            token_ids = self._get_tokens_from_arithmetic_binary(payload, coding)
+        else:
+            binary = bitarray()
+            binary.frombytes(self._zlib_decompress(payload))
+            compressed_object = self._get_object_from_binary(
+                binary, tokens=True, coding=coding
+            )
+            token_ids = self._get_tokens_from_compressed_object(compressed_object)
+        return self.lm.decode_tokens(token_ids)
+
+    def _get_compressed_object_from_tokens(self, token_ids):
+        """
+        @param token_ids: List<Int> to compress
+        @returns CompressedObject with an empty initial context, whose literals are
+            token ids.
+        """
+        compressed_object = CompressedObject()
+        self.lm.reset_tokens([])
+
+        for token_id in token_ids:
+            candidates, _ = self._predict()
+            ranking = self._get_token_ranking(candidates, token_id)
+            if ranking is None:
+                compressed_object.append_literal(token_id)
+            else:
+                compressed_object.append_ranking(ranking)
+            self.lm.add_token_to_context(token_id)
         return compressed_object
 
-    def _get_binary_from_object(self, compressed_object):
-        binary = bitarray()
-        binary_initial_context = bitarray()
-        initial_context_bytes = compressed_object["initial_context"].encode("utf-8")
-        initial_context_bits = bitarray()
-        initial_context_bits.frombytes(initial_context_bytes)
-        binary_initial_context.extend(
-            (
-                "{0:0" + str(int(math.log2(self._initial_context_max_bit_size))) + "b}"
-            ).format(len(initial_context_bits))
-        )
-        binary_initial_context.frombytes(initial_context_bytes)
-        binary.extend(binary_initial_context)
-
-        print("Getting binary from object.")
-        for word in tqdm(compressed_object["words"]):
-            binary_word = bitarray()
-            # TODO: instead of having a separate flag for out of vocabulary, use ranking 0 to mean o.o.v.
-            if word["out_of_vocabulary"]:
-                binary_word.append(True)
-                uncompressed_word = bitarray()
-                uncompressed_word.frombytes(word["word"].encode("utf-8"))
-                binary_word.extend(
-                    (
-                        "{0:0"
-                        + str(int(math.log2(self._out_of_vocabulary_word_max_bit_size)))
-                        + "b}"
-                    ).format(len(uncompressed_word))
-                )
-                binary_word.extend(uncompressed_word)
+    def _get_tokens_from_compressed_object(self, compressed_object):
+        self.lm.reset_tokens([])
+        token_ids = []
+
+        for out_of_vocabulary, value in compressed_object:
+            if out_of_vocabulary:
+                token_id = value
             else:
-                binary_word.append(False)
-                binary_word.extend(
-                    (
-                        "{0:0"
-                        + str(int(math.log2(self._next_word_possibilities_number)))
-                        + "b}"
-                    ).format(word["ranking"])
+                candidates, _ = self._predict()
+                token_id = int(candidates[value])
+            token_ids.append(token_id)
+            self.lm.add_token_to_context(token_id)
+        return token_ids
+
+    def _get_arithmetic_binary_from_tokens(self, token_ids):
+        """
+        @param token_ids: List<Int> to compress
+        @returns bytes: 32-bit token count followed by the arithmetic coded data.
+        """
+        encoder = ArithmeticEncoder()
+        rank_model = self._get_rank_model(self._coding)
+        token_id_bytes = (self._get_token_id_size() + 7) // 8
+        self.lm.reset_tokens([])
+
+        for token_id in token_ids:
+            candidates, probabilities = self._predict()
+            ranking = self._get_token_ranking(candidates, token_id)
+            with self.metrics.timer("entropy_coding"):
+                self._write_symbol(encoder, probabilities, ranking, rank_model)
+                if ranking is None:
+                    write_uint(encoder, token_id, token_id_bytes)
+            self.lm.add_token_to_context(token_id)
+
+        encoder.finish()
+        return struct.pack(">I", len(token_ids)) + encoder.tobytes()
+
+    def _get_tokens_from_arithmetic_binary(self, binary, coding="arithmetic"):
+        (tokens_number,) = struct.unpack(">I", binary[:4])
+        decoder = ArithmeticDecoder(binary[4:])
+        rank_model = self._get_rank_model(coding)
+        token_id_bytes = (self._get_token_id_size() + 7) // 8
+        self.lm.reset_tokens([])
+        token_ids = []
+
+        for _ in range(tokens_number):
+            candidates, probabilities = self._predict()
+            with self.metrics.timer("entropy_coding"):
+                ranking = self._read_symbol(decoder, probabilities, rank_model)
+                if ranking is None:
+                    token_id = read_uint(decoder, token_id_bytes)
+                else:
+                    token_id = int(candidates[ranking])
+            token_ids.append(token_id)
+            self.lm.add_token_to_context(token_id)
+        return token_ids
+
+    def _get_token_ranking(self, candidates, token_id):
+        """
+        @param candidates: 1-D tensor of token ids, best first.
+        @returns Int position of token_id in candidates, or None.
+        """
+        with self.metrics.timer("rank"):
+            positions = (candidates == token_id).nonzero()
+            ranking = int(positions[0, 0]) if positions.shape[0] > 0 else None
+        self.metrics.count_ranking(ranking)
+        return ranking
+
+    def _get_token_id_size(self):
+        """
+        @returns Int number of bits of an escaped token id.
+        """
+        return (len(self.lm.get_vocabulary()) - 1).bit_length()
+
+    def _get_header(self, flags=0):
+        """
+        @returns bytes: MAGIC, HEADER_FIELDS, the model name and the identifier of
+            the priming dictionary, if any.
+        """
+        model_name = str(self.lm).encode("utf-8")
+        if len(model_name) > 255:
+            raise ValueError(f"Model name {self.lm} longer than 255 bytes.")
+        priming_id = b""
+        if self._priming is not None:
+            flags |= FLAG_PRIMED
+            priming_id = self._priming.pack_id()
+        return (
+            MAGIC
+            + HEADER_FIELDS.pack(
+                FORMAT_VERSION,
+                CODINGS.index(self._coding),
+                flags,
+                PRECISIONS.index(self.lm.get_precision()),
+                self._context_window_length,
+                int(math.log2(self._next_word_possibilities_number)),
+                int(math.log2(self._initial_context_max_bit_size)),
+                len(model_name),
+            )
+            + model_name
+            + priming_id
+        )
+
+    def _read_header(self, compressed_binary):
+        """
+        Validates the stream header against this protocol, whose model and
+        parameters must be those the stream was compressed with.
+        @param compressed_binary: binary string starting with a header.
+        @returns (coding, flags, payload)
+        """
+        parameters = get_stream_parameters(compressed_binary)
+        if parameters["precision"] != self.lm.get_precision():
+            raise ValueError(
+                f"Stream was compressed at {parameters['precision']} precision, "
+                f"not {self.lm.get_precision()}."
+            )
+        if parameters["model"] != str(self.lm):
+            raise ValueError(
+                f"Stream was compressed with {parameters['model']}, not {self.lm}."
+            )
+        for name in [
+            "context_window_length",
+            "next_word_possibilities_number",
+            "initial_context_max_bit_size",
+        ]:
+            if parameters[name] != self._protocol_arguments[name]:
+                raise ValueError(
+                    f"Stream was compressed with {name}={parameters[name]}, "
+                    f"not {self._protocol_arguments[name]}."
                 )
+        priming_id = None if self._priming is None else self._priming.get_id()
+        if parameters["priming"] != priming_id:
+            raise ValueError(
+                f"Stream was primed with {parameters['priming']}, not {priming_id}."
+            )
+        return (
+            parameters["coding"],
+            parameters["flags"],
+            compressed_binary[parameters["header_size"] :],
+        )
 
-            binary.extend(binary_word)
+    def _get_arithmetic_binary(self, text):
+        """
+        Arithmetic codes each word's ranking using the model's probabilities.
+        Out of vocabulary words and the initial context go through an adaptive byte model.
+        @param text: String to compress
+        @returns bytes: 32-bit word count followed by the arithmetic coded data.
+        """
+        initial_context, words = self._split_initial_context(text.split())
+
+        encoder = ArithmeticEncoder()
+        literal_model = self._get_literal_model()
+        literal_model.write(encoder, " ".join(initial_context))
+        rank_model = self._get_rank_model(self._coding)
+
+        self._reset_lm(initial_context)
+
+        for word in words:
+            prediction = self._predict()
+            self._write_arithmetic_word(
+                encoder, literal_model, prediction, word, rank_model
+            )
+            self.lm.add_word_to_context(word)
+
+        encoder.finish()
+        return struct.pack(">I", len(words)) + encoder.tobytes()
+
+    def _get_string_from_arithmetic_binary(self, binary, coding="arithmetic"):
+        """
+        @param binary: bytes produced by _get_arithmetic_binary.
+        @param coding: One of ARITHMETIC_CODINGS, the coding of the stream.
+        @returns uncompressed_string
+        """
+        (words_number,) = struct.unpack(">I", binary[:4])
+        decoder = ArithmeticDecoder(binary[4:])
+        literal_model = self._get_literal_model()
+        initial_context = literal_model.read(decoder).split()
+        rank_model = self._get_rank_model(coding)
+
+        self._reset_lm(initial_context)
+        words = []
+
+        for _ in range(words_number):
+            prediction = self._predict()
+            word = self._read_arithmetic_word(
+                decoder, literal_model, prediction, rank_model
+            )
+            words.append(word)
+            self.lm.add_word_to_context(word)
+        return " ".join(initial_context + words)
+
+    def _write_arithmetic_word(
+        self, encoder, literal_model, prediction, word, rank_model=None
+    ):
+        """
+        @param prediction: (token_ids, probabilities) as returned by the model's top_k.
+        @param rank_model: RankModel of the stream for the adaptive coding, or None.
+        """
+        token_ids, probabilities = prediction
+        ranking = self._get_ranking(token_ids, word)
+        with self.metrics.timer("entropy_coding"):
+            self._write_symbol(encoder, probabilities, ranking, rank_model)
+            if ranking is None:
+                literal_model.write_word(encoder, word)
+
+    def _read_arithmetic_word(self, decoder, literal_model, prediction, rank_model=None):
+        token_ids, probabilities = prediction
+        with self.metrics.timer("entropy_coding"):
+            ranking = self._read_symbol(decoder, probabilities, rank_model)
+            if ranking is None:
+                return literal_model.read_word(decoder)
+        with self.metrics.timer("rank"):
+            return self.lm.get_vocabulary()[token_ids[ranking]]
+
+    def _get_rank_model(self, coding):
+        """
+        @returns a new RankModel for the adaptive coding, None for the others.
+        """
+        if coding != "adaptive":
+            return None
+        return RankModel(self._next_word_possibilities_number)
+
+    def _get_symbol_frequencies(self, probabilities, rank_model):
+        """
+        @param probabilities: 1-D tensor of the predicted probabilities, best first.
+        @param rank_model: RankModel to code with in place of the probabilities, or None.
+        @returns (cumulative frequencies of the rankings and escape symbol, Int escape symbol)
+        """
+        if rank_model is None:
+            return get_cumulative_frequencies(probabilities.tolist()), len(probabilities)
+        return rank_model.get_cumulative_frequencies(), rank_model.escape
+
+    def _write_symbol(self, encoder, probabilities, ranking, rank_model):
+        """
+        Arithmetic codes a ranking, or the escape symbol that precedes out of
+        vocabulary units, see _get_symbol_frequencies.
+        @param ranking: Int, or None to escape.
+        """
+        cumulative_frequencies, escape = self._get_symbol_frequencies(
+            probabilities, rank_model
+        )
+        symbol = escape if ranking is None else ranking
+        encoder.write(cumulative_frequencies, symbol)
+        if rank_model is not None:
+            rank_model.update(symbol)
+
+    def _read_symbol(self, decoder, probabilities, rank_model):
+        """
+        @returns Int ranking decoded by _write_symbol, or None for the escape symbol.
+        """
+        cumulative_frequencies, escape = self._get_symbol_frequencies(
+            probabilities, rank_model
+        )
+        symbol = decoder.read(cumulative_frequencies)
+        if rank_model is not None:
+            rank_model.update(symbol)
+        return None if symbol == escape else symbol
+
+    def _get_compressed_object(self, text):
+        """
+        @param text: String to compress
+        @returns CompressedObject
+        """
+        initial_context, words = self._split_initial_context(text.split())
+        compressed_object = CompressedObject(" ".join(initial_context))
+
+        self._reset_lm(initial_context)
 
-        # Append 1's to the end
-        binary.extend([True for _ in range(8 - len(binary) % 8)])
+        for word in words:
+            prediction = self._predict()
+            self._add_compressed_word(compressed_object, prediction, word)
+            self.lm.add_word_to_context(word)
+        return compressed_object
+
+    def _add_compressed_word(self, compressed_object, prediction, word):
+        """
+        Appends the record of a word to a CompressedObject.
+        @param prediction: (token_ids, probabilities) as returned by the model's top_k.
+        @param word: String
+        """
+        token_ids, _ = prediction
+        ranking = self._get_ranking(token_ids, word)
+        if ranking is None:
+            compressed_object.append_literal(word)
+        else:
+            compressed_object.append_ranking(ranking)
+
+    def _get_word_from_compressed_word(self, prediction, record):
+        """
+        @param record: (out_of_vocabulary, ranking or literal) as stored in a
+            CompressedObject.
+        """
+        out_of_vocabulary, value = record
+        if out_of_vocabulary:
+            return value
+        token_ids, _ = prediction
+        with self.metrics.timer("rank"):
+            return self.lm.get_vocabulary()[token_ids[value]]
+
+    def _get_ranking(self, token_ids, word):
+        """
+        @param token_ids: 1-D tensor of predicted token ids, best first.
+        @returns Int ranking of word among the token ids, or None when it is out
+            of vocabulary. Counted in the metrics.
+        """
+        with self.metrics.timer("rank"):
+            ranking = self.lm.get_vocabulary().get_ranking(token_ids, word)
+        self.metrics.count_ranking(ranking)
+        return ranking
+
+    def _get_binary_from_object(self, compressed_object, tokens=False):
+        """
+        @param compressed_object: CompressedObject
+        @param tokens: If True, the literals are token ids.
+        @returns bytes: bit length of the initial context and its UTF-8 bytes, the
+            word records and 1 to 8 padding ones, or 0 to 7 padding zeros for the
+            gamma coding.
+        """
+        initial_context_bytes = compressed_object.initial_context.encode("utf-8")
+        initial_context_length_size = int(math.log2(self._initial_context_max_bit_size))
+        if len(initial_context_bytes) * 8 >= self._initial_context_max_bit_size:
+            raise ValueError(
+                f"Initial context longer than {self._initial_context_max_bit_size - 1} bits."
+            )
+        initial_context_values = np.concatenate(
+            [
+                [len(initial_context_bytes) * 8],
+                np.frombuffer(initial_context_bytes, dtype=np.uint8),
+            ]
+        )
+        initial_context_widths = np.array(
+            [initial_context_length_size] + [8] * len(initial_context_bytes)
+        )
+
+        with self.metrics.timer("serialize"):
+            words_values, words_widths = self._get_word_fields(
+                compressed_object, tokens
+            )
+
+            # Pad with ones up to the next byte, pack_fields pads with zeros
+            bits_number = initial_context_widths.sum() + words_widths.sum()
+            padding_size = 0 if self._coding == "gamma" else 8 - bits_number % 8
+            binary, _ = pack_fields(
+                np.concatenate(
+                    [initial_context_values, words_values, [(1 << padding_size) - 1]]
+                ),
+                np.concatenate([initial_context_widths, words_widths, [padding_size]]),
+            )
         return binary
 
+    def _get_word_fields(self, compressed_object, tokens=False, dictionary=None):
+        """
+        @param dictionary: WordDictionary of the out of vocabulary words coded
+            before the records, or None for the one of the first record.
+        @returns (values, widths) of the word records, see CompressedObject.get_fields.
+        """
+        return compressed_object.get_fields(
+            ranking_size=int(math.log2(self._next_word_possibilities_number)),
+            literal_size=self._get_token_id_size() if tokens else None,
+            escape_symbol=(
+                self._next_word_possibilities_number
+                if self._coding == "gamma"
+                else None
+            ),
+            dictionary=dictionary if dictionary is not None else self._get_dictionary(),
+        )
+
     def _get_string_from_compressed_object(self, compressed_object):
         """
-        @param compressed_object: Dict:
-            initial_context: String
-            words: List<Dict:
-                out_of_vocabulary: Bool
-                word: String (only if out_of_vocabulary)
-                ranking: Int (only if not out_of_vocabulary)
-            >
+        @param compressed_object: CompressedObject
         @returns uncompressed_string
         """
-        self.lm.reset(compressed_object["initial_context"].split())
+        initial_context = compressed_object.initial_context.split()
+        self._reset_lm(initial_context)
         words = []
 
-        print("Getting string from compressed object.")
-        for item in tqdm(compressed_object["words"]):
-            if item["out_of_vocabulary"]:
-                word = item["word"]
+        for out_of_vocabulary, value in compressed_object:
+            if out_of_vocabulary:
+                word = value
             else:
-                word_probabilities = self.lm()
-                word = list(word_probabilities.keys())[item["ranking"]]
+                word = self._get_word_from_compressed_word(
+                    self._predict(), (out_of_vocabulary, value)
+                )
             words.append(word)
             self.lm.add_word_to_context(word)
-        return compressed_object["initial_context"] + " ".join(words)
+        return " ".join(initial_context + words)
 
-    def _get_ranking_from_probabilities(self, word_probabilities, word):
+    def _get_object_from_binary(self, binary, tokens=False, coding="rank"):
         """
-        @param word_probabilities: Dict<word, probability>
-        @returns ranking: Int
+        @param binary: bitarray produced by _get_binary_from_object.
+        @param tokens: If True, out of vocabulary records hold token ids.
+        @param coding: "rank" or "gamma", the coding of the stream.
+        @returns CompressedObject
         """
-        ordered_words = OrderedDict(
-            sorted(word_probabilities.items(), key=lambda t: -t[1])
-        )
-        return list(ordered_words.keys()).index(word)
-
-    def _get_object_from_binary(self, binary):
-        obj = {}
-        initial_context_length_binary = binary[
-            0 : int(math.log2(self._initial_context_max_bit_size))
-        ]
-        initial_context_length = int(initial_context_length_binary.to01(), 2)
-        initial_context_binary = binary[
-            int(math.log2(self._initial_context_max_bit_size)) : int(
-                math.log2(self._initial_context_max_bit_size)
+        with self.metrics.timer("serialize"):
+            reader = BitReader(binary)
+            initial_context_length = reader.read_uint(
+                int(math.log2(self._initial_context_max_bit_size))
             )
-            + initial_context_length
-        ]
-        obj["initial_context"] = initial_context_binary.tobytes().decode("utf-8")
-        obj["words"] = []
-        words_binary = binary[
-            int(math.log2(self._initial_context_max_bit_size))
-            + initial_context_length :
-        ]
-        while len(words_binary) > 0:
-            word = {}
-            word["out_of_vocabulary"] = words_binary[0]
-            if word["out_of_vocabulary"]:
-                # If there are fewer than 8 bits, then it must be the end of the file, ignore bits.
-                if len(words_binary) < 8:
-                    words_binary = []
-                    word = None
-                else:
-                    word_binary_length_binary = words_binary[
-                        1 : 1
-                        + int(math.log2(self._out_of_vocabulary_word_max_bit_size))
-                    ]
-                    word_binary_length = int(word_binary_length_binary.to01(), 2)
-                    word_binary = words_binary[
-                        1
-                        + int(math.log2(self._out_of_vocabulary_word_max_bit_size)) : 1
-                        + int(math.log2(self._out_of_vocabulary_word_max_bit_size))
-                        + word_binary_length
-                    ]
-                    word["word"] = word_binary.tobytes().decode("utf-8")
-                    words_binary = words_binary[
-                        1
-                        + int(math.log2(self._out_of_vocabulary_word_max_bit_size))
-                        + word_binary_length :
-                    ]
+            compressed_object = CompressedObject(
+                reader.read_bytes(initial_context_length).decode("utf-8")
+            )
+            compressed_object.extend(
+                self._iter_words_from_binary(reader, tokens, coding)
+            )
+        return compressed_object
+
+    def _iter_words_from_binary(
+        self, reader, tokens=False, coding="rank", dictionary=None
+    ):
+        """
+        Yields the word records following the initial context, as
+        (out_of_vocabulary, ranking or literal).
+        @param reader: BitReader positioned after the initial context.
+        @param tokens: If True, out of vocabulary records hold token ids.
+        @param coding: "rank" or "gamma", the coding of the records.
+        @param dictionary: WordDictionary of the out of vocabulary words decoded
+            before the records, or None for the one of the first record.
+        """
+        ranking_size = int(math.log2(self._next_word_possibilities_number))
+        token_id_size = self._get_token_id_size() if tokens else 0
+        escape_symbol = self._next_word_possibilities_number
+        if dictionary is None:
+            dictionary = self._get_dictionary()
+
+        while reader.remaining() > 0:
+            if coding == "gamma":
+                # The stream is padded with at most 7 zeros, while every gamma
+                # code holds a one.
+                if (
+                    reader.remaining() < 8
+                    and not reader.binary[reader.position :].any()
+                ):
+                    return
+                ranking = reader.read_gamma() - 1
+                out_of_vocabulary = ranking == escape_symbol
             else:
-                ranking_binary = words_binary[
-                    1 : 1 + int(math.log2(self._next_word_possibilities_number))
-                ]
-                word["ranking"] = int(ranking_binary.to01(), 2)
-                words_binary = words_binary[
-                    1 + int(math.log2(self._next_word_possibilities_number)) :
-                ]
-            if word:
-                obj["words"].append(word)
-
-        return obj
+                # The stream is padded with 1 to 8 ones, while every record of at
+                # most 8 bits holds a zero.
+                if reader.remaining() <= 8 and reader.binary[reader.position :].all():
+                    return
+                out_of_vocabulary = reader.read_bit()
+                if not out_of_vocabulary:
+                    ranking = reader.read_uint(ranking_size)
 
+            if not out_of_vocabulary:
+                yield False, ranking
+            elif tokens:
+                yield True, reader.read_uint(token_id_size)
+            else:
+                reference = reader.read_gamma() - 1
+                if reference == 0:
+                    word = reader.read_bytes(reader.read_gamma() * 8).decode("utf-8")
+                else:
+                    word = dictionary[reference - 1]
+                dictionary.use(word)
+                yield True, word
@@ -0,0 +1,364 @@
+import bisect
+import itertools
+
+from bitarray import bitarray
+
+from dictionary import WordDictionary
+
+
+# Probabilities are quantized to integer frequencies summing to roughly this value
+PROBABILITY_SCALE = 1 << 16
+
+# Symbol that terminates a literal byte string in LiteralModel
+END_OF_LITERAL = 256
+
+# Cumulative frequencies of the uniform distribution over byte values
+UNIFORM_BYTE_FREQUENCIES = list(range(257))
+
+# Cumulative frequencies of the uniform distribution over bits
+UNIFORM_BIT_FREQUENCIES = [0, 1, 2]
+
+# Number of bit lengths of the references of LiteralModel.write_word
+REFERENCE_LENGTHS_NUMBER = 64
+
+
+def get_cumulative_frequencies(probabilities, scale=PROBABILITY_SCALE):
+    """
+    Quantizes the given probabilities, plus an escape symbol holding the remaining
+    probability mass, to a cumulative frequency table.
+    Every symbol gets a frequency of at least 1 so any of them can be coded.
+    @param probabilities: List<Float> in symbol order.
+    @returns List<Int> of length len(probabilities) + 2, starting at 0.
+        The escape symbol is len(probabilities).
+    """
+    frequencies = [max(1, int(probability * scale)) for probability in probabilities]
+    frequencies.append(max(1, int((1.0 - sum(probabilities)) * scale)))
+    return [0] + list(itertools.accumulate(frequencies))
+
+
+def write_uint(encoder, value, num_bytes):
+    """
+    Encodes an unsigned integer as num_bytes uniformly distributed bytes.
+    """
+    for shift in reversed(range(num_bytes)):
+        encoder.write(UNIFORM_BYTE_FREQUENCIES, (value >> (8 * shift)) & 0xFF)
+
+
+def read_uint(decoder, num_bytes):
+    value = 0
+    for _ in range(num_bytes):
+        value = (value << 8) | decoder.read(UNIFORM_BYTE_FREQUENCIES)
+    return value
+
+
+class _ArithmeticCoderBase:
+    """Shared interval arithmetic of the encoder and decoder.
+
+    Based on the integer arithmetic coder described by Witten, Neal and Cleary
+    (1987), with num_state_bits of precision.
+    """
+
+    def __init__(self, num_state_bits=32):
+        self.num_state_bits = num_state_bits
+        self.full_range = 1 << num_state_bits
+        self.half_range = self.full_range >> 1
+        self.quarter_range = self.half_range >> 1
+        self.minimum_range = self.quarter_range + 2
+        self.maximum_total = self.minimum_range
+        self.state_mask = self.full_range - 1
+        self.low = 0
+        self.high = self.state_mask
+
+    def _update(self, cumulative_frequencies, symbol):
+        total = cumulative_frequencies[-1]
+        assert total <= self.maximum_total
+        symbol_low = cumulative_frequencies[symbol]
+        symbol_high = cumulative_frequencies[symbol + 1]
+        assert symbol_low < symbol_high
+
+        interval = self.high - self.low + 1
+        self.high = self.low + symbol_high * interval // total - 1
+        self.low = self.low + symbol_low * interval // total
+
+        # Shift out the bits that low and high have in common
+        while ((self.low ^ self.high) & self.half_range) == 0:
+            self._shift()
+            self.low = (self.low << 1) & self.state_mask
+            self.high = ((self.high << 1) & self.state_mask) | 1
+
+        # Handle the interval straddling the middle of the range
+        while (self.low & ~self.high & self.quarter_range) != 0:
+            self._underflow()
+            self.low = (self.low << 1) ^ self.half_range
+            self.high = ((self.high ^ self.half_range) << 1) | self.half_range | 1
+
+    def _shift(self):
+        raise NotImplementedError()
+
+    def _underflow(self):
+        raise NotImplementedError()
+
+
+class ArithmeticEncoder(_ArithmeticCoderBase):
+    """Arithmetic encoder writing to a bitarray.
+
+    Usage sample:
+
+    encoder = ArithmeticEncoder()
+
+    encoder.write([0, 3, 4], 0)
+
+    encoder.finish()
+
+    data = encoder.tobytes()
+    """
+
+    def __init__(self, num_state_bits=32):
+        super().__init__(num_state_bits)
+        self.bits = bitarray()
+        self._num_underflow = 0
+
+    def write(self, cumulative_frequencies, symbol):
+        """
+        @param cumulative_frequencies: List<Int> starting at 0, see get_cumulative_frequencies.
+        @param symbol: Int index of the symbol to encode.
+        """
+        self._update(cumulative_frequencies, symbol)
+
+    def finish(self):
+        """
+        Flushes the state so the decoder can resolve the last symbol.
+        """
+        self.bits.append(True)
+
+    def tobytes(self):
+        return self.bits.tobytes()
+
+    def _shift(self):
+        bit = self.low >> (self.num_state_bits - 1)
+        self.bits.append(bit)
+        self.bits.extend([bit ^ 1] * self._num_underflow)
+        self._num_underflow = 0
+
+    def _underflow(self):
+        self._num_underflow += 1
+
+
+class ArithmeticDecoder(_ArithmeticCoderBase):
+    """Arithmetic decoder reading from bytes produced by ArithmeticEncoder.
+
+    Usage sample:
+
+    decoder = ArithmeticDecoder(data)
+
+    symbol = decoder.read([0, 3, 4])
+    """
+
+    def __init__(self, data, num_state_bits=32):
+        super().__init__(num_state_bits)
+        self.bits = bitarray()
+        self.bits.frombytes(data)
+        self._position = 0
+        self.code = 0
+        for _ in range(self.num_state_bits):
+            self.code = (self.code << 1) | self._read_bit()
+
+    def read(self, cumulative_frequencies):
+        """
+        @param cumulative_frequencies: List<Int> the encoder used for this symbol.
+        @returns Int index of the decoded symbol.
+        """
+        total = cumulative_frequencies[-1]
+        interval = self.high - self.low + 1
+        offset = self.code - self.low
+        value = ((offset + 1) * total - 1) // interval
+        symbol = bisect.bisect_right(cumulative_frequencies, value) - 1
+        self._update(cumulative_frequencies, symbol)
+        return symbol
+
+    def _read_bit(self):
+        # Past the end of the data, the stream is padded with zeros
+        if self._position >= len(self.bits):
+            return 0
+        bit = self.bits[self._position]
+        self._position += 1
+        return bit
+
+    def _shift(self):
+        self.code = ((self.code << 1) & self.state_mask) | self._read_bit()
+
+    def _underflow(self):
+        self.code = (
+            (self.code & self.half_range)
+            | ((self.code << 1) & (self.state_mask >> 1))
+            | self._read_bit()
+        )
+
+
+class LiteralModel:
+    """Adaptive order-0 model of the bytes of literal strings.
+
+    Each literal is coded as its UTF-8 bytes followed by END_OF_LITERAL. The
+    byte counts are updated after every symbol, identically on both sides.
+
+    Out of vocabulary words are coded by write_word, as a reference to the
+    dictionary of the words it coded before: 0 for a new word, followed by the
+    word as a literal, and otherwise the word's index in the dictionary plus
+    one. A reference is coded as its bit length, with adaptive counts, then
+    its bits but the leading one, uniformly.
+
+    Usage sample:
+
+    literal_model = LiteralModel()
+
+    literal_model.write_word(encoder, 'Euler')
+
+    word = literal_model.read_word(decoder)
+    """
+
+    def __init__(self, max_total=PROBABILITY_SCALE, dictionary=None):
+        """
+        @param dictionary: WordDictionary of the words known before the first
+            one, updated as words are coded, or None for an empty one.
+        """
+        self.max_total = max_total
+        self.counts = [1] * (END_OF_LITERAL + 1)
+        self.dictionary = dictionary if dictionary is not None else WordDictionary()
+        self._reference_length_counts = [1] * REFERENCE_LENGTHS_NUMBER
+
+    def write(self, encoder, string):
+        """
+        @param encoder: ArithmeticEncoder
+        @param string: String to encode.
+        """
+        for symbol in list(string.encode("utf-8")) + [END_OF_LITERAL]:
+            encoder.write(self._get_cumulative_frequencies(), symbol)
+            self._increment(symbol)
+
+    def read(self, decoder):
+        """
+        @param decoder: ArithmeticDecoder
+        @returns the decoded String.
+        """
+        string_bytes = bytearray()
+        while True:
+            symbol = decoder.read(self._get_cumulative_frequencies())
+            self._increment(symbol)
+            if symbol == END_OF_LITERAL:
+                return string_bytes.decode("utf-8")
+            string_bytes.append(symbol)
+
+    def write_word(self, encoder, word):
+        """
+        Encodes an out of vocabulary word, then moves it to the front of the dictionary.
+        """
+        index = self.dictionary.get_index(word)
+        self._write_reference(encoder, 0 if index is None else index + 1)
+        if index is None:
+            self.write(encoder, word)
+        self.dictionary.use(word)
+
+    def read_word(self, decoder):
+        """
+        @returns the decoded String word, moved to the front of the dictionary.
+        """
+        reference = self._read_reference(decoder)
+        if reference == 0:
+            word = self.read(decoder)
+        else:
+            word = self.dictionary[reference - 1]
+        self.dictionary.use(word)
+        return word
+
+    def _write_reference(self, encoder, reference):
+        length = (reference + 1).bit_length()
+        encoder.write(
+            _get_cumulative_frequencies(self._reference_length_counts), length - 1
+        )
+        self._reference_length_counts = _increment(
+            self._reference_length_counts, length - 1, self.max_total
+        )
+        for shift in reversed(range(length - 1)):
+            encoder.write(UNIFORM_BIT_FREQUENCIES, ((reference + 1) >> shift) & 1)
+
+    def _read_reference(self, decoder):
+        length = (
+            decoder.read(_get_cumulative_frequencies(self._reference_length_counts))
+            + 1
+        )
+        self._reference_length_counts = _increment(
+            self._reference_length_counts, length - 1, self.max_total
+        )
+        value = 1
+        for _ in range(length - 1):
+            value = (value << 1) | decoder.read(UNIFORM_BIT_FREQUENCIES)
+        return value - 1
+
+    def _get_cumulative_frequencies(self):
+        return _get_cumulative_frequencies(self.counts)
+
+    def _increment(self, symbol):
+        self.counts = _increment(self.counts, symbol, self.max_total)
+
+
+def _get_cumulative_frequencies(counts):
+    return [0] + list(itertools.accumulate(counts))
+
+
+def _increment(counts, symbol, max_total):
+    """
+    @returns the counts with symbol's incremented, all halved past max_total.
+    """
+    counts[symbol] += 32
+    if sum(counts) > max_total:
+        counts = [(count + 1) // 2 for count in counts]
+    return counts
+
+
+class RankModel:
+    """Adaptive model of the rankings of coded units, plus an escape symbol.
+
+    The counts start from the distribution implied by Elias-gamma codes, where
+    symbol s takes 2 * floor(log2(s + 1)) + 1 bits, so that the first rankings
+    cost about as much as with a static gamma code. They then follow the
+    observed symbols, updated identically on both sides, which keeps large
+    numbers of rankings cheap when the best ones dominate.
+
+    Usage sample:
+
+    rank_model = RankModel(16)
+
+    encoder.write(rank_model.get_cumulative_frequencies(), 0)
+
+    rank_model.update(0)
+    """
+
+    def __init__(self, rankings_number, increment=32, max_total=PROBABILITY_SCALE):
+        """
+        @param rankings_number: Int number of rankings, the escape symbol follows them.
+        @param increment: Int count added to a symbol each time it is coded.
+        @param max_total: Int total count above which the counts are halved.
+        """
+        self.escape = rankings_number
+        self.increment = increment
+        self.max_total = max_total
+        # 1024 for the first ranking, a quarter of it for each extra gamma bit pair
+        self.counts = [
+            max(1, 1024 >> 2 * ((symbol + 1).bit_length() - 1))
+            for symbol in range(rankings_number + 1)
+        ]
+        self._cumulative_frequencies = None
+
+    def get_cumulative_frequencies(self):
+        if self._cumulative_frequencies is None:
+            self._cumulative_frequencies = [0] + list(
+                itertools.accumulate(self.counts)
+            )
+        return self._cumulative_frequencies
+
+    def update(self, symbol):
+        self.counts[symbol] += self.increment
+        self._cumulative_frequencies = None
+        if self.get_cumulative_frequencies()[-1] > self.max_total:
+            self.counts = [(count + 1) // 2 for count in self.counts]
+            self._cumulative_frequencies = None
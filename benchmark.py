@@ -0,0 +1,451 @@
+import argparse
+import bz2
+import concurrent.futures
+import itertools
+import json
+import lzma
+import math
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+import zlib
+
+from corpus import Corpus
+from LMProtocol import CODINGS, LMProtocol
+from models.instrumentation import Metrics
+from priming import PrimingDictionary
+
+
+# Version of the result records, bumped whenever their fields change meaning
+BENCHMARK_SCHEMA_VERSION = 6
+
+BASELINES = {
+    "zlib": lambda data: zlib.compress(data, 9),
+    "bz2": lambda data: bz2.compress(data, 9),
+    "lzma": lambda data: lzma.compress(data, preset=9),
+}
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile.
+    @param values: List<Float>
+    @param q: Float between 0 and 100.
+    """
+    if len(values) == 0:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def get_peak_memory(function):
+    """
+    Runs function and measures the memory allocated while it runs, so that every
+    configuration reports its own peak rather than the largest one of the process.
+    Tracing slows allocations down, so timed runs must not be measured.
+    @returns Dict: host, Int peak bytes of the Python objects and numpy arrays
+        allocated by function, traced with tracemalloc, and cuda, Int peak bytes
+        of the CUDA tensors, weights included, or None without CUDA. Tensors in
+        CPU memory are not traced.
+    """
+    import torch
+
+    use_cuda = torch.cuda.is_available()
+    if use_cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+
+    tracemalloc.start()
+    try:
+        function()
+        _, host = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    cuda = None
+    if use_cuda:
+        torch.cuda.synchronize()
+        cuda = torch.cuda.max_memory_allocated()
+    return {"host": host, "cuda": cuda}
+
+
+def _get_process_peak_rss(protocol_kwargs, documents):
+    protocol = LMProtocol(**protocol_kwargs)
+    for document in documents:
+        protocol.decompress(protocol.compress(document))
+    protocol.close()
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def get_peak_rss(protocol_kwargs, documents):
+    """
+    Compresses and decompresses the documents in a new process, which only
+    holds the model of this configuration, and measures its peak resident set
+    size. Unlike get_peak_memory, it includes the weights and the tensors in CPU
+    memory, as well as the interpreter and its imports.
+    @param protocol_kwargs: Dict of LMProtocol arguments, pickled to the process.
+    @returns Int bytes
+    """
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        return executor.submit(
+            _get_process_peak_rss, protocol_kwargs, documents
+        ).result()
+
+
+def get_documents(corpus):
+    """
+    @returns List<String> of the corpus documents. A corpus loaded as a single
+        string is a single document.
+    """
+    if isinstance(corpus.docs, str):
+        return [corpus.docs]
+    return list(corpus.docs)
+
+
+def get_baseline_bits_per_character(documents):
+    """
+    @returns Dict<baseline name, Float> bits per character of general purpose compressors.
+    """
+    characters = sum(len(document) for document in documents)
+    return {
+        name: sum(len(compress(document.encode("utf-8"))) for document in documents)
+        * 8
+        / max(characters, 1)
+        for name, compress in BASELINES.items()
+    }
+
+
+def _summarize_timings(durations, words, data_bytes):
+    total = sum(durations)
+    return {
+        "seconds": total,
+        "words_per_second": words / total if total else None,
+        "bytes_per_second": data_bytes / total if total else None,
+        "latency": {
+            "p50": percentile(durations, 50),
+            "p90": percentile(durations, 90),
+            "p99": percentile(durations, 99),
+            "max": max(durations) if durations else None,
+        },
+    }
+
+
+class Benchmark:
+    """Compression benchmark over a grid of configurations.
+
+    Every configuration compresses and decompresses each corpus document,
+    verifies the round trip and reports throughput, latency percentiles,
+    bits per character against general purpose compressors and peak memory.
+    Model loading happens before timing and is reported separately as
+    setup_time, and a warm-up run is excluded from every measurement.
+
+    Usage sample:
+
+    benchmark = Benchmark(
+        corpora=[corpus],
+        models=[("GPT-2", GPT2Model, {"incremental": True})],
+        context_window_lengths=[8, 32],
+        next_word_possibilities_numbers=[16, 128],
+        codings=["rank", "arithmetic"],
+    )
+
+    with open("results/benchmark.jsonl", "a") as f:
+        results = benchmark.run(output=f)
+    """
+
+    def __init__(
+        self,
+        corpora,
+        models,
+        context_window_lengths=(16,),
+        next_word_possibilities_numbers=(16,),
+        codings=("rank",),
+        units=("word",),
+        span_words_numbers=(None,),
+        priming=None,
+        warmup_words=64,
+        repeats=1,
+        measure_memory=False,
+    ):
+        """
+        @param corpora: List<Corpus>, loaded.
+        @param models: List<(name, ILanguageModel class, Dict of model kwargs)>.
+        @param span_words_numbers: Values of LMProtocol's span_words_number, None
+            coding one word per model call. Spans only apply to the word unit.
+        @param priming: PrimingDictionary every configuration is primed with, or
+            None. Priming only applies to the word unit.
+        @param warmup_words: Int number of words compressed and decompressed once
+            before timing each configuration.
+        @param repeats: Int number of timed runs per document.
+        @param measure_memory: If True, every document is compressed and
+            decompressed twice more, untimed, to measure the peak memory, once
+            in a new process, see get_peak_rss, and once traced, see
+            get_peak_memory.
+        """
+        self.corpora = corpora
+        self.models = models
+        self.context_window_lengths = context_window_lengths
+        self.next_word_possibilities_numbers = next_word_possibilities_numbers
+        self.codings = codings
+        self.units = units
+        self.span_words_numbers = span_words_numbers
+        self.priming = priming
+        self.warmup_words = warmup_words
+        self.repeats = repeats
+        self.measure_memory = measure_memory
+
+    def configurations(self):
+        return (
+            configuration
+            for configuration in itertools.product(
+                self.corpora,
+                self.models,
+                self.context_window_lengths,
+                self.next_word_possibilities_numbers,
+                self.codings,
+                self.units,
+                self.span_words_numbers,
+            )
+            # Token streams are neither coded by spans nor primed
+            if configuration[5] == "word"
+            or (configuration[6] is None and self.priming is None)
+        )
+
+    def run(self, output=None):
+        """
+        Runs every configuration.
+        @param output: File object receiving one JSON record per line, or None.
+        @returns List<Dict> of result records.
+        """
+        results = []
+        for configuration in self.configurations():
+            result = self.run_configuration(*configuration)
+            results.append(result)
+            if output is not None:
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+        return results
+
+    def run_configuration(
+        self,
+        corpus,
+        model,
+        context_window_length,
+        next_word_possibilities_number,
+        coding,
+        unit,
+        span_words_number=None,
+    ):
+        model_name, language_model, language_model_kwargs = model
+
+        metrics = Metrics()
+        protocol_kwargs = {
+            "language_model": language_model,
+            "context_window_length": context_window_length,
+            "next_word_possibilities_number": next_word_possibilities_number,
+            "language_model_kwargs": language_model_kwargs,
+            "coding": coding,
+            "unit": unit,
+            "span_words_number": span_words_number,
+            "priming": self.priming,
+        }
+        start_time = time.perf_counter()
+        protocol = LMProtocol(metrics=metrics, **protocol_kwargs)
+        setup_time = time.perf_counter() - start_time
+
+        documents = get_documents(corpus)
+        if unit == "word" and self.priming is None:
+            # Word streams need more words than the initial context
+            documents = [
+                document
+                for document in documents
+                if len(document.split()) > context_window_length
+            ]
+
+        if documents and self.warmup_words > 0:
+            warmup_words = documents[0].split()[
+                : context_window_length + self.warmup_words
+            ]
+            if len(warmup_words) > context_window_length:
+                protocol.decompress(protocol.compress(" ".join(warmup_words)))
+        metrics.clear()
+
+        compress_durations = []
+        decompress_durations = []
+        compressed_bytes = 0
+        round_trip = True
+        for document in documents:
+            for _ in range(self.repeats):
+                start_time = time.perf_counter()
+                compressed = protocol.compress(document)
+                compress_durations.append(time.perf_counter() - start_time)
+
+                start_time = time.perf_counter()
+                decompressed = protocol.decompress(compressed)
+                decompress_durations.append(time.perf_counter() - start_time)
+
+            compressed_bytes += len(compressed)
+            expected = document if unit == "token" else " ".join(document.split())
+            round_trip = round_trip and decompressed == expected
+
+        # Seconds spent in each stage, over all the timed runs
+        stages = {
+            stage: timer["seconds"]
+            for stage, timer in metrics.stats()["timers"].items()
+        }
+        out_of_vocabulary_rate = metrics.get_out_of_vocabulary_rate()
+
+        peak_rss = None
+        peak_memory = {"host": None, "cuda": None}
+        if self.measure_memory:
+            peak_rss = get_peak_rss(protocol_kwargs, documents)
+            peak_memory = get_peak_memory(
+                lambda: [
+                    protocol.decompress(protocol.compress(document))
+                    for document in documents
+                ]
+            )
+        protocol.close()
+
+        words = sum(len(document.split()) for document in documents) * self.repeats
+        characters = sum(len(document) for document in documents)
+        data_bytes = (
+            sum(len(document.encode("utf-8")) for document in documents) * self.repeats
+        )
+
+        return {
+            "schema_version": BENCHMARK_SCHEMA_VERSION,
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "corpus": str(corpus),
+            "model": model_name,
+            "context_window_length": context_window_length,
+            "next_word_possibilities_number": next_word_possibilities_number,
+            "coding": coding,
+            "unit": unit,
+            "span_words_number": span_words_number,
+            "priming": str(self.priming) if self.priming is not None else None,
+            "documents": len(documents),
+            "characters": characters,
+            "compressed_bytes": compressed_bytes,
+            "compression_rate": compressed_bytes / max(characters, 1),
+            "bits_per_character": compressed_bytes * 8 / max(characters, 1),
+            "baseline_bits_per_character": get_baseline_bits_per_character(
+                documents
+            ),
+            "round_trip": round_trip,
+            "setup_time": setup_time,
+            "compress": _summarize_timings(compress_durations, words, data_bytes),
+            "decompress": _summarize_timings(decompress_durations, words, data_bytes),
+            "stages": stages,
+            "out_of_vocabulary_rate": out_of_vocabulary_rate,
+            # Peak resident bytes of a process coding the documents, see
+            # get_peak_rss, and peak bytes allocated while coding, see
+            # get_peak_memory
+            "peak_rss": peak_rss,
+            "peak_memory": peak_memory["host"],
+            "peak_cuda_memory": peak_memory["cuda"],
+        }
+
+
+def _get_model(name, precision="fp32", num_threads=None):
+    kwargs = {"precision": precision, "num_threads": num_threads}
+    if name == "gpt":
+        from models.gpt import GPTModel
+
+        return (f"GPT {precision}", GPTModel, kwargs)
+    if name == "gpt2":
+        from models.gpt2 import GPT2Model
+
+        return (f"GPT-2 {precision}", GPT2Model, kwargs)
+    if name == "xlnet":
+        from models.xlnet import XLNetModel
+
+        return (f"XLNet {precision}", XLNetModel, kwargs)
+    if name == "ngram":
+        from models.ngram import NGramModel
+
+        return ("N-gram", NGramModel, {})
+    if name == "mixture":
+        from models.gpt2 import GPT2Model
+        from models.mixture import MixtureLanguageModel
+        from models.xlnet import XLNetModel
+
+        return (
+            f"Mixture of GPT-2 and XLNet {precision}",
+            MixtureLanguageModel,
+            {
+                "language_models": [(GPT2Model, kwargs), (XLNetModel, kwargs)],
+                "drop_threshold": 0.01,
+            },
+        )
+    if name == "stand-in":
+        from models.stand_in import StandInModel
+
+        return ("Stand-in", StandInModel, {})
+    raise ValueError(f"Unknown model {name}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark neural compression.")
+    parser.add_argument("--corpus", nargs="+", default=["data/sample.txt"])
+    parser.add_argument(
+        "--model",
+        nargs="+",
+        default=["gpt2"],
+        choices=["gpt", "gpt2", "xlnet", "ngram", "mixture", "stand-in"],
+    )
+    parser.add_argument(
+        "--precision", nargs="+", default=["fp32"], choices=["fp32", "bf16", "int8"]
+    )
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--window", nargs="+", type=int, default=[16])
+    parser.add_argument("--top-k", nargs="+", type=int, default=[16])
+    parser.add_argument("--coding", nargs="+", default=["rank"], choices=CODINGS)
+    parser.add_argument("--unit", nargs="+", default=["word"])
+    parser.add_argument("--span-words", nargs="+", type=int, default=[None])
+    parser.add_argument("--priming", default=None)
+    parser.add_argument("--warmup-words", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--measure-memory", action="store_true")
+    parser.add_argument("--output", default="results/benchmark.jsonl")
+    args = parser.parse_args()
+
+    corpora = []
+    for filename in args.corpus:
+        corpus = Corpus(name=filename, filename=filename, preprocess_func=lambda x: x)
+        corpus.load()
+        corpora.append(corpus)
+
+    benchmark = Benchmark(
+        corpora=corpora,
+        models=[
+            _get_model(name, precision, args.threads)
+            for name in args.model
+            for precision in args.precision
+        ],
+        context_window_lengths=args.window,
+        next_word_possibilities_numbers=args.top_k,
+        codings=args.coding,
+        units=args.unit,
+        span_words_numbers=args.span_words,
+        priming=PrimingDictionary.load(args.priming) if args.priming else None,
+        warmup_words=args.warmup_words,
+        repeats=args.repeats,
+        measure_memory=args.measure_memory,
+    )
+    with open(args.output, "a") as f:
+        benchmark.run(output=f)
+
+
+if __name__ == "__main__":
+    main()
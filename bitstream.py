@@ -0,0 +1,157 @@
+import numpy as np
+from bitarray import bitarray
+from bitarray.util import ba2int
+
+
+# Number of fields pack_fields shifts at a time, bounding its temporary arrays
+PACK_BLOCK_SIZE = 1 << 16
+
+
+def pack_fields(values, widths):
+    """
+    Packs unsigned integers into a big-endian bit string, each one written on its
+    own number of bits, all at once. The fields are shifted into the one or two
+    64-bit words they overlap, a block of them at a time, so the memory used
+    beyond the output does not grow with the number of fields.
+    @param values: 1-D array of unsigned integers, each less than 2 ** its width.
+    @param widths: 1-D array of Int number of bits of each value, up to 64.
+    @returns (bytes padded with zeros to a whole number of bytes, Int number of bits)
+    """
+    bits_number = int(np.sum(widths, dtype=np.int64))
+    words = np.zeros((bits_number + 63) // 64, dtype=np.uint64)
+    # Number of bits of the blocks before the current one
+    offset = 0
+    for start in range(0, len(widths), PACK_BLOCK_SIZE):
+        block_values = np.asarray(
+            values[start : start + PACK_BLOCK_SIZE], dtype=np.uint64
+        )
+        block_widths = np.asarray(
+            widths[start : start + PACK_BLOCK_SIZE], dtype=np.int64
+        )
+        ends = offset + np.cumsum(block_widths)
+        offset = int(ends[-1])
+        # Empty fields hold no bits
+        nonempty = block_widths > 0
+        block_values = block_values[nonempty]
+        ends = ends[nonempty]
+
+        # Index of the word holding the last bit of each field, and shift
+        # bringing that bit to its position in the word. The bits shifted out of
+        # the word belong to the previous one.
+        indices = (ends - 1) // 64
+        shifts = ((64 - ends % 64) % 64).astype(np.uint64)
+        _or_into(words, indices, block_values << shifts)
+        # Shifting by 64 is undefined, so values >> (64 - shift) is split in two
+        _or_into(
+            words,
+            indices - 1,
+            (block_values >> np.uint64(1)) >> (np.uint64(63) - shifts),
+        )
+    return words.astype(">u8").tobytes()[: (bits_number + 7) // 8], bits_number
+
+
+def _or_into(words, indices, parts):
+    """
+    Ors each part into the word at its index, in place.
+    @param indices: 1-D array of non-decreasing Int indices, of which -1 is only
+        given for parts equal to 0.
+    """
+    if len(indices) == 0:
+        return
+    firsts = np.flatnonzero(np.concatenate([[True], indices[1:] != indices[:-1]]))
+    words[indices[firsts]] |= np.bitwise_or.reduceat(parts, firsts)
+
+
+def get_gamma_widths(values):
+    """
+    @param values: 1-D array of integers, each at least 1.
+    @returns 1-D array of the Int number of significant bits of each value.
+        Its Elias-gamma code is that many bits minus one zeros, then the value.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    widths = np.zeros(len(values), dtype=np.int64)
+    remaining = values.copy()
+    while np.any(remaining):
+        widths += remaining > 0
+        remaining >>= np.uint64(1)
+    return widths
+
+
+class BitReader:
+    """Cursor over a bitarray that parses fields in place.
+
+    Fields are read by advancing a position instead of re-slicing the
+    remaining tail, so reading a whole stream is linear in its size.
+
+    Usage sample:
+
+    reader = BitReader(binary)
+
+    flag = reader.read_bit()
+
+    ranking = reader.read_uint(4)
+    """
+
+    def __init__(self, binary, position=0):
+        """
+        @param binary: big-endian bitarray, or bytes to read as one.
+        @param position: Int bit offset to start reading at.
+        """
+        if not isinstance(binary, bitarray):
+            bits = bitarray()
+            bits.frombytes(bytes(binary))
+            binary = bits
+        self.binary = binary
+        self.position = position
+
+    def remaining(self):
+        return len(self.binary) - self.position
+
+    def read_bit(self):
+        if self.position >= len(self.binary):
+            raise EOFError("Read past the end of the bitstream.")
+        bit = self.binary[self.position]
+        self.position += 1
+        return bool(bit)
+
+    def read_uint(self, width):
+        """
+        @param width: Int number of bits of the big-endian unsigned integer.
+        @returns Int
+        """
+        if width == 0:
+            return 0
+        end = self.position + width
+        if end > len(self.binary):
+            raise EOFError("Read past the end of the bitstream.")
+        value = ba2int(self.binary[self.position : end], signed=False)
+        self.position = end
+        return value
+
+    def read_gamma(self):
+        """
+        Reads an Elias-gamma code: one zero less than the number of significant
+        bits of the value, then the value, most significant bit first.
+        @returns Int, at least 1.
+        """
+        zeros = 0
+        while not self.read_bit():
+            zeros += 1
+        return (1 << zeros) | self.read_uint(zeros)
+
+    def read_bytes(self, num_bits):
+        """
+        @param num_bits: Int number of bits to read, a multiple of 8.
+        @returns bytes
+        """
+        assert num_bits % 8 == 0
+        end = self.position + num_bits
+        if end > len(self.binary):
+            raise EOFError("Read past the end of the bitstream.")
+        if self.position % 8 == 0:
+            # Byte-aligned reads come straight from the underlying buffer
+            data = memoryview(self.binary)[self.position // 8 : end // 8].tobytes()
+        else:
+            data = self.binary[self.position : end].tobytes()
+        self.position = end
+        return data
@@ -0,0 +1,199 @@
+from array import array
+
+import numpy as np
+
+from bitstream import get_gamma_widths
+from dictionary import WordDictionary
+
+
+# Fields of a record before the bytes of its literal word: the flag, or the
+# zeros of the ranking's Elias-gamma code, the ranking, then the reference of
+# the literal or its token id, and the length of the literal, both as two
+# fields of Elias-gamma codes.
+RECORD_FIELDS_NUMBER = 6
+
+
+class CompressedObject:
+    """Intermediate representation of a text coded with the rank coding.
+
+    Each coded word is either the ranking of the word among the model's
+    predictions, or an out of vocabulary literal: the word itself, or a token
+    id in token mode. The records are held in parallel arrays rather than as
+    one object per word: a flag per record, its ranking or the index of its
+    literal, and the table of literals.
+
+    Usage sample:
+
+    compressed_object = CompressedObject(initial_context="Hello world .")
+
+    compressed_object.append_ranking(3)
+
+    compressed_object.append_literal("Test")
+
+    for out_of_vocabulary, value in compressed_object:
+        ...
+    """
+
+    def __init__(self, initial_context=""):
+        """
+        @param initial_context: String of the words coded as is before the records.
+        """
+        self.initial_context = initial_context
+        self.out_of_vocabulary = bytearray()
+        # Ranking of each in vocabulary record, index in literals of the others
+        self.values = array("I")
+        self.literals = []
+
+    def append_ranking(self, ranking):
+        self.out_of_vocabulary.append(0)
+        self.values.append(ranking)
+
+    def append_literal(self, literal):
+        """
+        @param literal: String word, or Int token id.
+        """
+        self.out_of_vocabulary.append(1)
+        self.values.append(len(self.literals))
+        self.literals.append(literal)
+
+    def append(self, record):
+        """
+        @param record: (out_of_vocabulary, ranking or literal)
+        """
+        out_of_vocabulary, value = record
+        if out_of_vocabulary:
+            self.append_literal(value)
+        else:
+            self.append_ranking(value)
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def __len__(self):
+        return len(self.out_of_vocabulary)
+
+    def __getitem__(self, i):
+        """
+        @returns (out_of_vocabulary, ranking or literal)
+        """
+        if self.out_of_vocabulary[i]:
+            return True, self.literals[self.values[i]]
+        return False, self.values[i]
+
+    def __iter__(self):
+        literals = iter(self.literals)
+        for out_of_vocabulary, value in zip(self.out_of_vocabulary, self.values):
+            if out_of_vocabulary:
+                yield True, next(literals)
+            else:
+                yield False, value
+
+    def get_fields(
+        self,
+        ranking_size,
+        literal_size=None,
+        escape_symbol=None,
+        dictionary=None,
+    ):
+        """
+        Lays the records out as unsigned integer fields, see bitstream.pack_fields.
+        By default a record is a 1 bit out of vocabulary flag followed by either
+        the ranking or the literal. With an escape symbol, the flag and ranking are
+        replaced by the Elias-gamma code of the ranking plus one, or of the escape
+        symbol plus one for out of vocabulary records.
+        A literal token id is written on literal_size bits. A literal word is the
+        Elias-gamma code of its reference plus one: 0 the first time the word is
+        seen, followed by the Elias-gamma code of its number of UTF-8 bytes and
+        the bytes, and otherwise its index in the dictionary plus one.
+        @param ranking_size: Int number of bits of a fixed width ranking.
+        @param literal_size: Int number of bits of a literal token id, for token ids.
+        @param escape_symbol: Int symbol of the out of vocabulary records, to Elias-gamma
+            code the rankings, or None.
+        @param dictionary: WordDictionary of the literal words coded before these
+            records, updated with them, or None for an empty one.
+        @returns (values, widths) numpy arrays.
+        """
+        flags = np.frombuffer(self.out_of_vocabulary, dtype=np.uint8).astype(bool)
+        rankings = np.array(self.values, dtype=np.uint64)
+        # Values and widths of the fields of each record, in order
+        fields = [
+            [np.zeros(len(self), dtype=np.uint64), np.zeros(len(self), dtype=np.int64)]
+            for _ in range(RECORD_FIELDS_NUMBER)
+        ]
+        byte_counts = np.zeros(len(self), dtype=np.int64)
+
+        if escape_symbol is None:
+            fields[0] = [flags.astype(np.uint64), np.ones(len(self), dtype=np.int64)]
+            fields[1] = [
+                np.where(flags, 0, rankings).astype(np.uint64),
+                np.where(flags, 0, ranking_size),
+            ]
+        else:
+            symbols = np.where(flags, escape_symbol, rankings).astype(np.uint64)
+            _set_gamma_fields(fields, 0, symbols + np.uint64(1))
+
+        literal_bytes = []
+        if literal_size is not None:
+            fields[3][0][flags] = np.array(self.literals, dtype=np.uint64)
+            fields[3][1][flags] = literal_size
+        elif self.literals:
+            if dictionary is None:
+                dictionary = WordDictionary()
+            references = np.zeros(len(self.literals), dtype=np.uint64)
+            for i, literal in enumerate(self.literals):
+                index = dictionary.get_index(literal)
+                if index is None:
+                    literal_bytes.append(literal.encode("utf-8"))
+                else:
+                    references[i] = index + 1
+                dictionary.use(literal)
+
+            new = references == 0
+            literal_byte_counts = np.array(
+                [len(data) for data in literal_bytes], dtype=np.int64
+            )
+            positions = np.flatnonzero(flags)
+            _set_gamma_fields(fields, 2, references + np.uint64(1), positions)
+            _set_gamma_fields(
+                fields, 4, literal_byte_counts.astype(np.uint64), positions[new]
+            )
+            byte_counts[positions[new]] = literal_byte_counts
+
+        fields_numbers = RECORD_FIELDS_NUMBER + byte_counts
+        starts = np.cumsum(fields_numbers) - fields_numbers
+        values = np.zeros(int(fields_numbers.sum()), dtype=np.uint64)
+        widths = np.zeros(len(values), dtype=np.int64)
+        for offset, (field_values, field_widths) in enumerate(fields):
+            values[starts + offset] = field_values
+            widths[starts + offset] = field_widths
+
+        if literal_bytes:
+            data = np.frombuffer(b"".join(literal_bytes), dtype=np.uint8)
+            has_bytes = byte_counts > 0
+            literal_byte_counts = byte_counts[has_bytes]
+            # Position of the first byte of each literal, minus the bytes before it
+            literal_starts = (
+                starts[has_bytes]
+                + RECORD_FIELDS_NUMBER
+                - (np.cumsum(literal_byte_counts) - literal_byte_counts)
+            )
+            positions = np.repeat(literal_starts, literal_byte_counts) + np.arange(
+                len(data)
+            )
+            values[positions] = data
+            widths[positions] = 8
+        return values, widths
+
+
+def _set_gamma_fields(fields, offset, values, positions=slice(None)):
+    """
+    Writes the Elias-gamma codes of values in the two fields at offset: the
+    zeros, then the value on its number of significant bits.
+    @param positions: Indices of the records coded, all of them by default.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    widths = get_gamma_widths(values)
+    fields[offset][1][positions] = widths - 1
+    fields[offset + 1][0][positions] = values
+    fields[offset + 1][1][positions] = widths
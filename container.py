@@ -0,0 +1,119 @@
+import re
+import struct
+
+
+# A container starts with CONTAINER_MAGIC, CONTAINER_VERSION and the number of
+# chunks, followed by one index entry per chunk and then the chunk payloads.
+CONTAINER_MAGIC = b"NCC"
+CONTAINER_VERSION = 1
+
+_HEADER = struct.Struct(">3sBI")
+# Offset of the chunk relative to the end of the index, its length in bytes and
+# the number of words it holds.
+_INDEX_ENTRY = struct.Struct(">QII")
+
+
+class ChunkIndexEntry:
+    def __init__(self, offset, length, words_number):
+        self.offset = offset
+        self.length = length
+        self.words_number = words_number
+
+    def __repr__(self):
+        return (
+            f"ChunkIndexEntry(offset={self.offset}, length={self.length}, "
+            f"words_number={self.words_number})"
+        )
+
+
+def is_container(blob):
+    return blob[: len(CONTAINER_MAGIC)] == CONTAINER_MAGIC
+
+
+def pack_chunks(chunks, words_numbers):
+    """
+    @param chunks: List<bytes> of independently decodable compressed streams.
+    @param words_numbers: List<Int> number of words in each chunk.
+    @returns bytes
+    """
+    assert len(chunks) == len(words_numbers)
+    header = _HEADER.pack(CONTAINER_MAGIC, CONTAINER_VERSION, len(chunks))
+    index = bytearray()
+    offset = 0
+    for chunk, words_number in zip(chunks, words_numbers):
+        index.extend(_INDEX_ENTRY.pack(offset, len(chunk), words_number))
+        offset += len(chunk)
+    return header + bytes(index) + b"".join(chunks)
+
+
+def read_index(blob):
+    """
+    @param blob: bytes produced by pack_chunks.
+    @returns List<ChunkIndexEntry>
+    """
+    magic, version, chunks_number = _HEADER.unpack_from(blob, 0)
+    if magic != CONTAINER_MAGIC:
+        raise ValueError("Not a chunked container.")
+    if version != CONTAINER_VERSION:
+        raise ValueError(
+            f"Unsupported container version {version} (expected {CONTAINER_VERSION})."
+        )
+    return [
+        ChunkIndexEntry(
+            *_INDEX_ENTRY.unpack_from(blob, _HEADER.size + i * _INDEX_ENTRY.size)
+        )
+        for i in range(chunks_number)
+    ]
+
+
+def get_chunk(blob, chunk_number, index=None):
+    """
+    Gets the payload of a single chunk without touching the others.
+    @param blob: bytes produced by pack_chunks.
+    @param chunk_number: Int
+    @param index: List<ChunkIndexEntry>, read from blob if not given.
+    @returns bytes
+    """
+    if index is None:
+        index = read_index(blob)
+    data_start = _HEADER.size + len(index) * _INDEX_ENTRY.size
+    entry = index[chunk_number]
+    start = data_start + entry.offset
+    return bytes(blob[start : start + entry.length])
+
+
+def split_words(words, chunk_words_number, min_words_number):
+    """
+    Splits words into consecutive chunks of chunk_words_number words.
+    A last chunk of at most min_words_number words is merged into the previous one.
+    @returns List<List<String>>
+    """
+    chunks = [
+        words[i : i + chunk_words_number]
+        for i in range(0, len(words), chunk_words_number)
+    ]
+    if len(chunks) > 1 and len(chunks[-1]) <= min_words_number:
+        last_chunk = chunks.pop()
+        chunks[-1] = chunks[-1] + last_chunk
+    return chunks
+
+
+def split_text(text, chunk_words_number, min_words_number):
+    """
+    Splits text into consecutive pieces of chunk_words_number words, keeping every
+    whitespace character so that the pieces concatenate back to text.
+    A last piece of at most min_words_number words is merged into the previous one.
+    @returns List<String>
+    """
+    boundaries = [
+        match.start()
+        for i, match in enumerate(re.finditer(r"\S+", text))
+        if i > 0 and i % chunk_words_number == 0
+    ]
+    starts = [0] + boundaries
+    ends = boundaries + [len(text)]
+    pieces = [text[start:end] for start, end in zip(starts, ends)]
+    if len(pieces) > 1 and len(pieces[-1].split()) <= min_words_number:
+        last_piece = pieces.pop()
+        pieces[-1] = pieces[-1] + last_piece
+    return pieces
@@ -1,3 +1,6 @@
+from streaming import iter_source, iter_words
+
+
 class Corpus:
     def __init__(self, name, filename, preprocess_func):
         self.name = name
@@ -9,6 +12,20 @@ class Corpus:
         with open(self.filename, "r") as f:
             self.docs = self.preprocess_func(f.read().strip())
 
+    def iter_buffers(self, buffer_size=1 << 16):
+        """
+        Yields the raw text of the corpus file in buffers of at most buffer_size
+        characters, without loading the whole file or applying preprocess_func.
+        """
+        with open(self.filename, "r") as f:
+            yield from iter_source(f, buffer_size)
+
+    def iter_words(self, buffer_size=1 << 16):
+        """
+        Yields the whitespace-separated words of the corpus file, reading it in buffers.
+        """
+        yield from iter_words(self.iter_buffers(buffer_size))
+
     def __iter__(self):
         return iter(self.docs)
 
@@ -0,0 +1,131 @@
+class WordDictionary:
+    """Move-to-front table of the out of vocabulary words coded so far.
+
+    A word already in the table is coded as its index, the number of distinct
+    words used since its last use, so the words repeating close to each other
+    get the smallest indices. Both sides call use after each word, which moves
+    it to the front, and keep identical tables.
+
+    Each use is stamped with a counter and a Fenwick tree over the stamps
+    counts the ones that are still the last use of their word. A hash table
+    from word to stamp finds a word in constant time, and its index or the
+    word at an index take a logarithmic number of steps, instead of the linear
+    scan of a list kept in move-to-front order.
+
+    Usage sample:
+
+    dictionary = WordDictionary()
+
+    index = dictionary.get_index('Euler')
+
+    dictionary.use('Euler')
+
+    assert dictionary[0] == 'Euler'
+    """
+
+    def __init__(self, words=()):
+        """
+        @param words: Iterable<String> used in order, the last one at the front.
+        """
+        # Word -> stamp of its last use
+        self._stamps = {}
+        # Stamp -> word, None once the word was used again, from stamp 1
+        self._words = [None]
+        # Fenwick tree counting the stamps that are last uses, from stamp 1
+        self._tree = [0]
+        for word in words:
+            self.use(word)
+
+    def copy(self):
+        """
+        @returns WordDictionary with the same words in the same order, updated
+            independently of this one.
+        """
+        dictionary = WordDictionary()
+        dictionary._stamps = dict(self._stamps)
+        dictionary._words = list(self._words)
+        dictionary._tree = list(self._tree)
+        return dictionary
+
+    def __len__(self):
+        return len(self._stamps)
+
+    def __contains__(self, word):
+        return word in self._stamps
+
+    def __getitem__(self, index):
+        """
+        @param index: Int position from the front of the table.
+        @returns String word.
+        """
+        if not 0 <= index < len(self._stamps):
+            raise IndexError(f"No word at index {index} of {len(self._stamps)}.")
+        return self._words[self._find(len(self._stamps) - index)]
+
+    def get_index(self, word):
+        """
+        @returns Int position of the word from the front of the table, or None
+            when it is not in the table.
+        """
+        stamp = self._stamps.get(word)
+        if stamp is None:
+            return None
+        return len(self._stamps) - self._get_prefix_sum(stamp)
+
+    def use(self, word):
+        """
+        Moves the word to the front of the table, adding it if necessary.
+        """
+        stamp = self._stamps.get(word)
+        if stamp is not None:
+            self._add(stamp, -1)
+            self._words[stamp] = None
+
+        # The new node covers the stamps after stamp - lowest bit, up to itself
+        stamp = len(self._tree)
+        node = 1
+        position = stamp - 1
+        while position > stamp - (stamp & -stamp):
+            node += self._tree[position]
+            position -= position & -position
+        self._tree.append(node)
+        self._words.append(word)
+        self._stamps[word] = stamp
+
+        if len(self._words) > 2 * len(self._stamps) + 64:
+            self._compact()
+
+    def _compact(self):
+        """
+        Stamps the words again from 1, dropping the uses that are not the last.
+        """
+        words = [word for word in self._words[1:] if word is not None]
+        self._words = [None] + words
+        self._stamps = {word: stamp for stamp, word in enumerate(words, 1)}
+        # Every stamp is a last use, so each node counts the stamps it covers
+        self._tree = [stamp & -stamp for stamp in range(len(self._words))]
+
+    def _get_prefix_sum(self, stamp):
+        total = 0
+        while stamp > 0:
+            total += self._tree[stamp]
+            stamp -= stamp & -stamp
+        return total
+
+    def _add(self, stamp, delta):
+        while stamp < len(self._tree):
+            self._tree[stamp] += delta
+            stamp += stamp & -stamp
+
+    def _find(self, prefix_sum):
+        """
+        @returns Int smallest stamp whose prefix sum reaches prefix_sum.
+        """
+        stamp = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step > 0:
+            if stamp + step < len(self._tree) and self._tree[stamp + step] < prefix_sum:
+                stamp += step
+                prefix_sum -= self._tree[stamp]
+            step >>= 1
+        return stamp + 1
@@ -1,13 +1,13 @@
 import json
-import time
 
 import torch
 
+from benchmark import Benchmark
 from corpus import Corpus
 from models.gpt import GPTModel
 from models.gpt2 import GPT2Model
+from models.registry import default_registry
 from models.xlnet import XLNetModel
-from LMProtocol import LMProtocol
 
 # from models.base_transformer.base_transformer import BaseTransformerModel
 
@@ -30,42 +30,29 @@ def eval_model(model, corpus, model_name):
     @returns Dict:
         model_name: Dict:
             (window_length, num_next_word):
-                duration: Int (seconds)
+                duration: Float (seconds spent compressing)
                 compression_rate: Float (between 0 and 1)
+                benchmark: Dict (full benchmark record)
     """
-    context_window_lengths = [2, 8, 32, 128]
-    next_word_possibilities_numbers = [2, 8, 32, 128]
-    total_experiments = len(context_window_lengths) * len(
-        next_word_possibilities_numbers
+    benchmark = Benchmark(
+        corpora=[corpus],
+        models=[(model_name, model, {})],
+        context_window_lengths=[2, 8, 32, 128],
+        next_word_possibilities_numbers=[2, 8, 32, 128],
     )
-    result = {}
 
-    # Run experiment on given model and store result
-    # in given results object.
-    with open(f"results/results_{model_name.lower()}.txt", "w+") as f:
-        for i, cwl in enumerate(context_window_lengths, 1):
-            for j, nwpn in enumerate(next_word_possibilities_numbers, 1):
-                exp_number = (i - 1) * len(next_word_possibilities_numbers) + j
-                print(f"Experiment ({exp_number} / {total_experiments})")
-                protocol = LMProtocol(
-                    language_model=model,
-                    context_window_length=cwl,
-                    next_word_possibilities_number=nwpn,
-                )
-                start_time = time.time()
-                compressed_str = protocol.compress(corpus.docs)
-                end_time = time.time()
-                time_elapsed = end_time - start_time
-                compression_rate = len(compressed_str) / len(corpus.docs)
-
-                f.write(
-                    f"CWL: {cwl} | NWPN: {nwpn} | duration: {time_elapsed} | compression_rate: {compression_rate}\n"
-                )
-
-                result[f"{cwl} | {nwpn}"] = {
-                    "duration": time_elapsed,
-                    "compression_rate": compression_rate,
-                }
+    with open(f"results/results_{model_name.lower()}.jsonl", "w+") as f:
+        records = benchmark.run(output=f)
+
+    result = {}
+    for record in records:
+        cwl = record["context_window_length"]
+        nwpn = record["next_word_possibilities_number"]
+        result[f"{cwl} | {nwpn}"] = {
+            "duration": record["compress"]["seconds"],
+            "compression_rate": record["compression_rate"],
+            "benchmark": record,
+        }
 
     return result
 
@@ -104,3 +91,9 @@ if __name__ == "__main__":
     # Report results
     print(f"Reporting results.")
     output_results(results)
+
+    for stats in default_registry.stats()["models"]:
+        print(
+            f"Loaded {stats['model']} ({stats['checkpoint']}) in {stats['load_time']:.1f}s, "
+            f"{stats['memory'] / 2 ** 20:.0f} MiB, reused {stats['hits']} times."
+        )
@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
 
+from .instrumentation import Metrics
+
 
 class ILanguageModel(ABC):
     """Interface for a generic language model
@@ -13,6 +15,9 @@ class ILanguageModel(ABC):
     next_word_ranking = lm()
     """
 
+    # Metrics the model times its stages in, nothing is recorded until set_metrics
+    metrics = Metrics(enabled=False)
+
     @abstractmethod
     def __init__(
         self,
@@ -44,7 +49,8 @@ class ILanguageModel(ABC):
     @abstractmethod
     def __str__(self):
         """
-        Returns the name of the model as a string.
+        Returns the name of the model as a string. It is recorded in the stream
+        header, so models with different weights must have different names.
         """
         pass
 
@@ -55,3 +61,182 @@ class ILanguageModel(ABC):
         @returns Ordered dictionary with the word as a key and probability as a value.
         """
         pass
+
+    @abstractmethod
+    def top_k(self):
+        """
+        Gets the most likely next tokens, given current context.
+        The compressor and decompressor must see the exact same rankings, so the
+        tokens are in canonical order: by decreasing probability quantized to a
+        fixed grid, then by increasing token id. Implementations should rank with
+        models.inference.get_canonical_top_k.
+        @returns (token_ids, probabilities): 1-D tensors ordered from the most to the
+            least likely token. get_vocabulary() maps the token ids to words.
+        """
+        pass
+
+    def get_state(self):
+        """
+        Snapshots the context and everything derived from it, so that a context
+        used often, e.g. a priming context, is only processed once.
+        This default implementation copies the context.
+        @returns object to give to set_state, not modified by later calls.
+        """
+        return list(self.context)
+
+    def set_state(self, state):
+        """
+        Restores the context of a get_state snapshot. Models keeping state derived
+        from the context, such as a key/value cache, restore it without running
+        the model again.
+        @param state: object returned by get_state.
+        """
+        self.reset(list(state))
+
+    def get_context_key(self):
+        """
+        @returns Hashable value identifying everything the prediction of top_k
+            depends on, used to cache predictions. Defaults to the context.
+        """
+        token_context = getattr(self, "token_context", None)
+        if token_context is not None:
+            return ("tokens", tuple(token_context))
+        return ("words", tuple(self.context))
+
+    @abstractmethod
+    def get_vocabulary(self):
+        """
+        @returns Vocabulary mapping the token ids returned by top_k to words.
+        """
+        pass
+
+    def set_metrics(self, metrics):
+        """
+        Makes the model time its tokenization, forward passes and top-k selection.
+        Models wrapping other models should pass the metrics on to them.
+        @param metrics: models.instrumentation.Metrics
+        """
+        self.metrics = metrics
+        word_encoder = getattr(self, "word_encoder", None)
+        if word_encoder is not None:
+            metrics.add_source(f"{self} word_encoder", word_encoder.stats)
+
+    def close(self):
+        """
+        Releases the resources held by the model, e.g. threads, once it is no
+        longer used. Models wrapping other models should close them too.
+        """
+        pass
+
+    def get_precision(self):
+        """
+        @returns String inference precision of the model, one of
+            models.inference.PRECISIONS. Recorded in the stream header, since
+            rankings only reproduce at the same precision.
+        """
+        return "fp32"
+
+    def encode_text(self, text):
+        """
+        Tokenizes text for token by token coding.
+        Only models whose tokenizer is lossless implement the token methods.
+        @param text: String.
+        @returns List of token ids such that decode_tokens returns text.
+        """
+        raise NotImplementedError(f"{self} does not support token contexts.")
+
+    def decode_tokens(self, token_ids):
+        """
+        @param token_ids: List of token ids.
+        @returns String.
+        """
+        raise NotImplementedError(f"{self} does not support token contexts.")
+
+    def reset_tokens(self, token_ids):
+        """
+        Resets the context to the given token ids, in place of words.
+        @param token_ids: List of token ids, may be empty.
+        """
+        raise NotImplementedError(f"{self} does not support token contexts.")
+
+    def add_token_to_context(self, token_id):
+        """
+        Adds the given token to a context set by reset_tokens, and removes the
+        oldest token if necessary.
+        @param token_id: Int.
+        """
+        raise NotImplementedError(f"{self} does not support token contexts.")
+
+    def batch_top_k(self, contexts):
+        """
+        Batched version of top_k for several independent contexts.
+        The current context is left untouched. This default implementation scores
+        the contexts one at a time; models should override it with a batched pass.
+        @param contexts: List of lists of words.
+        @returns List of (token_ids, probabilities), one per context.
+        """
+        saved_context = list(self.context)
+        results = []
+        for context in contexts:
+            self.reset(list(context))
+            results.append(self.top_k())
+        self.reset(saved_context)
+        return results
+
+    def batch_call(self, contexts):
+        """
+        Gets rankings of possible next words for several independent contexts.
+        The current context is left untouched. This default implementation scores
+        the contexts one at a time; models should override it with a batched pass.
+        @param contexts: List of lists of words.
+        @returns List of ordered dictionaries, one per context, as returned by __call__.
+        """
+        saved_context = list(self.context)
+        results = []
+        for context in contexts:
+            self.reset(list(context))
+            results.append(self())
+        self.reset(saved_context)
+        return results
+
+    def span_top_k(self, context, words, length=None, last_only=False):
+        """
+        Teacher-forced predictions over a span of known words: the prediction
+        after the context and after each word of the span, each conditioned on
+        the context followed by the words before it. Causal models override it
+        to score the whole span in one forward pass, padded to length positions.
+        A prediction is the same whether the span is cut right after it or not,
+        so a decoder can rebuild each one from the words decoded so far, given
+        the same context and length. This default implementation scores the
+        positions one at a time, within the model's context window, and leaves
+        the current context untouched.
+        @param context: List<String> words preceding the span, at least one.
+        @param words: List<String> words of the span.
+        @param length: Int number of positions the model input is padded to, at
+            least get_span_length(context, words), or None for no padding.
+        @param last_only: If True, only return the prediction after the last word.
+        @returns List of (token_ids, probabilities), len(words) + 1 of them, or one.
+        """
+        saved_context = list(self.context)
+        self.reset(list(context))
+        results = []
+        for word in words:
+            if not last_only:
+                results.append(self.top_k())
+            self.add_word_to_context(word)
+        results.append(self.top_k())
+        self.reset(saved_context)
+        return results
+
+    def get_span_length(self, context, words):
+        """
+        @returns Int number of positions span_top_k needs to score the span.
+        """
+        return len(context) + len(words)
+
+    def get_max_span_length(self):
+        """
+        @returns Int maximum number of positions span_top_k can score at once,
+            or None when unbounded.
+        """
+        return None
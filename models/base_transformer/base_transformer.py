@@ -5,6 +5,7 @@ from tensor2tensor.bin import t2t_decoder
 import tensorflow as tf
 
 from models.ILanguageModel import ILanguageModel
+from models.context import ContextWindow
 
 
 class BaseTransformerModel(ILanguageModel):
@@ -28,10 +29,7 @@ class BaseTransformerModel(ILanguageModel):
         self.window_length = context_window_length
         self.num_possibilities = next_word_possibilities_number
 
-        if initial_context:
-            self.context = ''.join(initial_context)
-        else:
-            self.context = ''
+        self.context = ContextWindow(self.window_length, initial_context or [])
 		
         FLAGS = tf.flags.FLAGS
         FLAGS.problem = "languagemodel_lm1b32k"
@@ -48,19 +46,24 @@ class BaseTransformerModel(ILanguageModel):
         if len(new_context) > self.window_length:
             raise Exception('New context exceeds context window length.')
 
-        self.context = new_context
+        self.context.reset(new_context)
 
     def add_word_to_context(self, word):
-        assert len(self.context) <= self.window_length
-
-        if len(self.context) == self.window_length:
-            self.context.pop()
-
         self.context.append(word)
 
     def __str__(self):
         return "base_transformer"
 
+    def top_k(self):
+        """
+        Beam search only ranks the next words, without their probabilities, so
+        the model can only be called for its ranking.
+        """
+        raise NotImplementedError(f"{self} only ranks words, see __call__.")
+
+    def get_vocabulary(self):
+        raise NotImplementedError(f"{self} only ranks words, see __call__.")
+
     def __call__(self):
         if os.path.exists('input.txt'):
             os.remove('input.txt')
@@ -0,0 +1,135 @@
+import itertools
+
+import torch
+
+
+# Contexts scored in a batch are padded to a multiple of BUCKET_LENGTH tokens
+BUCKET_LENGTH = 8
+
+
+def pad_batch(sequences, pad_token_id=0, length=None):
+    """
+    Left-pads token id sequences to a common length, so the last position of
+    every row holds the last token of its sequence.
+    @param sequences: List<List<Int>>
+    @param pad_token_id: Int id used for padding positions, which are masked out.
+    @param length: Int number of positions of every row, or None for the length
+        of the longest sequence.
+    @returns (input_ids, attention_mask, position_ids) LongTensors of shape
+        (len(sequences), length). Positions start at 0 at the first real token
+        of each row.
+    """
+    if length is None:
+        length = max(len(sequence) for sequence in sequences)
+    input_ids = torch.full((len(sequences), length), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(sequences), length), dtype=torch.long)
+    for row, sequence in enumerate(sequences):
+        if len(sequence) > 0:
+            input_ids[row, length - len(sequence) :] = torch.tensor(sequence)
+            attention_mask[row, length - len(sequence) :] = 1
+    position_ids = (attention_mask.cumsum(dim=1) - 1).clamp(min=0)
+    return input_ids, attention_mask, position_ids
+
+
+def group_by_bucket(sequences, bucket_length=BUCKET_LENGTH):
+    """
+    Groups token id sequences by their length rounded up to a multiple of
+    bucket_length, the length they are padded to. Sequences of similar lengths
+    share a forward pass, while the padded input of each one only depends on
+    its own length.
+    @param sequences: List<List<Int>>
+    @returns Dict<Int padded length, List<Int> indices of the sequences>, in the
+        order of their first sequence.
+    """
+    groups = {}
+    for i, sequence in enumerate(sequences):
+        length = -(-len(sequence) // bucket_length) * bucket_length
+        groups.setdefault(length, []).append(i)
+    return groups
+
+
+def get_batch_logits(
+    model, device, sequences, pad_token_id=0, position_ids=True, metrics=None
+):
+    """
+    Scores token id sequences in one forward pass per group of group_by_bucket.
+    @param model: torch.nn.Module taking input_ids and attention_mask, whose first
+        output holds the logits of each input position.
+    @param pad_token_id: Int id of the padding positions.
+    @param position_ids: If True, give the model the position of each token,
+        which the padding shifts. Models with relative positions take none.
+    @param metrics: models.instrumentation.Metrics counting the forward passes,
+        as forward_batches, and the sequences they score, as forward_batch_rows,
+        or None.
+    @returns List of the next token logits after each sequence.
+    """
+    logits = [None] * len(sequences)
+    for length, indices in group_by_bucket(sequences).items():
+        input_ids, attention_mask, positions = pad_batch(
+            [sequences[i] for i in indices], pad_token_id, length
+        )
+        kwargs = {"attention_mask": attention_mask.to(device)}
+        if position_ids:
+            kwargs["position_ids"] = positions.to(device)
+        with torch.no_grad():
+            outputs = model(input_ids.to(device), **kwargs)
+        for i, row in zip(indices, outputs[0][:, -1, :]):
+            logits[i] = row
+        if metrics is not None:
+            metrics.count("forward_batches")
+            metrics.count("forward_batch_rows", len(indices))
+    return logits
+
+
+def pad_span(units, context_units_number, length=None, pad_token_id=0):
+    """
+    Right-pads the token ids of a span of units, words or tokens, to a fixed
+    length for teacher-forced scoring by a causal model. The outputs at a
+    position do not depend on the positions after it, and inputs of the same
+    shape go through the same kernels, so padding every call over a span to the
+    same length gives bit for bit the same predictions however much of the span
+    is filled in. This does not hold under dynamic int8 quantization, which
+    scales the activations of a linear layer by their maximum over every
+    position, padding included.
+    @param units: List<List<Int>> token ids of the context units, then the span units.
+    @param context_units_number: Int number of context units, at least 1.
+    @param length: Int number of positions of the input, defaults to the number of tokens.
+    @param pad_token_id: Int id of the padding positions.
+    @returns (input_ids LongTensor of shape (1, length), List<Int> positions of the
+        last token of the context and of each span unit)
+    """
+    assert context_units_number > 0
+    inpt = [token_id for unit in units for token_id in unit]
+    length = len(inpt) if length is None else length
+    if len(inpt) > length:
+        raise ValueError(f"Span of {len(inpt)} tokens longer than {length}.")
+
+    input_ids = torch.full((1, length), pad_token_id, dtype=torch.long)
+    input_ids[0, : len(inpt)] = torch.tensor(inpt, dtype=torch.long)
+    ends = list(itertools.accumulate(len(unit) for unit in units))
+    positions = [end - 1 for end in ends[context_units_number - 1 :]]
+    return input_ids, positions
+
+
+def get_span_logits(
+    model, device, units, context_units_number, length=None, last_only=False
+):
+    """
+    Teacher-forced scoring of a span of units by a causal model, in one forward
+    pass over the input of pad_span.
+    @param model: torch.nn.Module whose first output holds the logits of each
+        input position.
+    @param device: torch.device of the model.
+    @param units: List<List<Int>> token ids of the context units, then the span units.
+    @param context_units_number: Int number of context units, at least 1.
+    @param length: Int number of positions of the input, see pad_span.
+    @param last_only: If True, only return the logits after the last unit.
+    @returns Tensor of the next token logits after the last context unit and after
+        each span unit, one row each, or one row.
+    """
+    input_ids, positions = pad_span(units, context_units_number, length)
+    if last_only:
+        positions = positions[-1:]
+    with torch.no_grad():
+        outputs = model(input_ids.to(device))
+    return outputs[0][0, positions]
@@ -0,0 +1,266 @@
+import sys
+from collections import OrderedDict
+
+from .ILanguageModel import ILanguageModel
+
+
+CACHE_POLICIES = ("lru", "lfu")
+
+
+def _get_key_memory(key):
+    if isinstance(key, tuple):
+        return sys.getsizeof(key) + sum(_get_key_memory(item) for item in key)
+    return sys.getsizeof(key)
+
+
+def get_prediction_memory(key, prediction):
+    """
+    Returns an estimate of the number of bytes held by a cache entry.
+    @param key: Possibly nested tuple of words or token ids.
+    @param prediction: (token_ids, probabilities) tensors.
+    """
+    tensors_memory = sum(
+        tensor.nelement() * tensor.element_size() for tensor in prediction
+    )
+    return tensors_memory + _get_key_memory(key)
+
+
+class PredictionCache:
+    """Bounded cache of top-k predictions keyed on the context they were made from.
+
+    Entries are evicted once more than max_entries are held, or once their
+    estimated size exceeds max_memory bytes. The lru policy evicts the least
+    recently used entry, the lfu policy the least frequently used one, the
+    oldest first among equally used entries. Eviction only depends on the
+    sequence of lookups, so it is deterministic.
+
+    Usage sample:
+
+    cache = PredictionCache(max_entries=4096, policy="lfu")
+
+    protocol = LMProtocol(GPT2Model, prediction_cache=cache)
+
+    print(cache.stats())
+    """
+
+    def __init__(self, max_entries=4096, max_memory=None, policy="lru"):
+        """
+        @param max_entries: Int maximum number of predictions held, or None.
+        @param max_memory: Int maximum estimated size of the predictions in bytes, or None.
+        @param policy: Eviction policy, one of CACHE_POLICIES.
+        """
+        assert policy in CACHE_POLICIES
+        self.max_entries = max_entries
+        self.max_memory = max_memory
+        self.policy = policy
+        self.clear()
+
+    def clear(self):
+        # key -> (prediction, memory, use count)
+        self._entries = {}
+        # use count -> OrderedDict of keys, oldest first. The lru policy keeps
+        # every key under the count 0.
+        self._buckets = {}
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        @returns the cached (token_ids, probabilities), or None.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        prediction, memory, count = entry
+        self._remove_from_bucket(key, count)
+        if self.policy == "lfu":
+            count += 1
+            self._entries[key] = (prediction, memory, count)
+        self._buckets.setdefault(count, OrderedDict())[key] = None
+        return prediction
+
+    def put(self, key, prediction):
+        """
+        @param key: Hashable context the prediction was made from.
+        @param prediction: (token_ids, probabilities) tensors.
+        """
+        if key in self._entries:
+            return
+
+        memory = get_prediction_memory(key, prediction)
+        if self.max_memory is not None and memory > self.max_memory:
+            return
+
+        self._entries[key] = (prediction, memory, 0)
+        self._buckets.setdefault(0, OrderedDict())[key] = None
+        self.memory += memory
+
+        while (
+            self.max_entries is not None and len(self._entries) > self.max_entries
+        ) or (self.max_memory is not None and self.memory > self.max_memory):
+            self._evict()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "policy": self.policy,
+            "entries": len(self._entries),
+            "memory": self.memory,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else None,
+        }
+
+    def _evict(self):
+        count = min(self._buckets)
+        key = next(iter(self._buckets[count]))
+        self._remove_from_bucket(key, count)
+        _, memory, _ = self._entries.pop(key)
+        self.memory -= memory
+        self.evictions += 1
+
+    def _remove_from_bucket(self, key, count):
+        bucket = self._buckets[count]
+        del bucket[key]
+        if len(bucket) == 0:
+            del self._buckets[count]
+
+
+class CachedLanguageModel(ILanguageModel):
+    """Language model answering top_k from a PredictionCache when it has already
+    seen the exact same context.
+
+    The cache is keyed on the identity of the wrapped model, its name,
+    checkpoint, precision, device, tokenizer and k, and on its get_context_key(),
+    which identifies everything its prediction depends on, so a cached
+    prediction is the one the model would compute. Compressing and
+    decompressing through the same cache therefore reproduce the same
+    rankings, whatever is cached.
+
+    The wrapped model is only asked on a miss. An incremental GPT-2 feeds its
+    new words through the model when asked, so a hit also saves their forward
+    passes until the next miss, and its context key is a 64-bit hash chained
+    as words are added rather than the words themselves.
+
+    Usage sample:
+
+    gpt2 = CachedLanguageModel(GPT2Model(), PredictionCache(max_entries=4096))
+
+    gpt2.reset(['Hello', 'world', '.'])
+
+    token_ids, probabilities = gpt2.top_k()
+    """
+
+    def __init__(self, language_model, cache=None):
+        """
+        @param language_model: ILanguageModel instance to wrap.
+        @param cache: PredictionCache, possibly shared with other wrappers.
+        """
+        self.lm = language_model
+        self.cache = cache if cache is not None else PredictionCache()
+        # Predictions of different models, weights, precisions, devices or
+        # tokenizers, or of different k, never match
+        tokenizer = getattr(language_model, "tokenizer", None)
+        self._namespace = (
+            str(language_model),
+            getattr(language_model, "checkpoint", None),
+            language_model.get_precision(),
+            str(getattr(language_model, "device", None)),
+            None if tokenizer is None else type(tokenizer).__name__,
+            getattr(language_model, "num_possibilities", None),
+        )
+
+    @property
+    def context(self):
+        return self.lm.context
+
+    def reset(self, new_context):
+        self.lm.reset(new_context)
+
+    def add_word_to_context(self, word):
+        self.lm.add_word_to_context(word)
+
+    def encode_text(self, text):
+        return self.lm.encode_text(text)
+
+    def decode_tokens(self, token_ids):
+        return self.lm.decode_tokens(token_ids)
+
+    def reset_tokens(self, token_ids):
+        self.lm.reset_tokens(token_ids)
+
+    def add_token_to_context(self, token_id):
+        self.lm.add_token_to_context(token_id)
+
+    def get_state(self):
+        return self.lm.get_state()
+
+    def set_state(self, state):
+        self.lm.set_state(state)
+
+    def get_context_key(self):
+        return self.lm.get_context_key()
+
+    def get_precision(self):
+        return self.lm.get_precision()
+
+    def close(self):
+        self.lm.close()
+
+    def set_metrics(self, metrics):
+        self.metrics = metrics
+        self.lm.set_metrics(metrics)
+        metrics.add_source("prediction_cache", self.cache.stats)
+
+    def get_vocabulary(self):
+        return self.lm.get_vocabulary()
+
+    def __str__(self):
+        return str(self.lm)
+
+    def __call__(self):
+        return self.get_vocabulary().to_ordered_dict(*self.top_k())
+
+    def top_k(self):
+        key = (self._namespace, self.lm.get_context_key())
+        prediction = self.cache.get(key)
+        if prediction is None:
+            prediction = self.lm.top_k()
+            self.cache.put(key, prediction)
+        return prediction
+
+    def batch_call(self, contexts):
+        vocabulary = self.get_vocabulary()
+        return [
+            vocabulary.to_ordered_dict(token_ids, probabilities)
+            for token_ids, probabilities in self.batch_top_k(contexts)
+        ]
+
+    def batch_top_k(self, contexts):
+        """
+        Batched predictions come from a separate pass over the last window of
+        each context, not from the predictions top_k caches, so they are not
+        cached.
+        """
+        return self.lm.batch_top_k(contexts)
+
+    def span_top_k(self, context, words, length=None, last_only=False):
+        """
+        Teacher-forced predictions are not cached either.
+        """
+        return self.lm.span_top_k(context, words, length, last_only)
+
+    def get_span_length(self, context, words):
+        return self.lm.get_span_length(context, words)
+
+    def get_max_span_length(self):
+        return self.lm.get_max_span_length()
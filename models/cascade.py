@@ -0,0 +1,159 @@
+from .ILanguageModel import ILanguageModel
+from .ngram import NGramModel
+from .vocabulary import CombinedVocabulary
+
+
+class CascadeLanguageModel(ILanguageModel):
+    """N-gram model backed by a larger language model for hard predictions.
+
+    Each prediction is first asked of an NGramModel learning from the text,
+    and only escalated to the wrapped language model when the probability of
+    the n-gram's most likely word is below threshold. The decision only
+    depends on the n-gram counts, which compression and decompression learn
+    identically, so it is reproduced when decoding without being coded. The
+    order and threshold are part of the model name written in the stream
+    header. Words are added to both models, an incremental GPT-2 only feeding
+    them through the transformer at its next prediction, so words the n-gram
+    model answers cost no forward pass.
+
+    Token ids of the language model are kept, those of the n-gram model are
+    offset by the size of the language model's vocabulary.
+
+    Usage sample:
+
+    cascade = CascadeLanguageModel(
+        language_model=GPT2Model, order=3, threshold=0.5
+    )
+
+    cascade.reset(['Hello', 'world', '.'])
+
+    token_ids, probabilities = cascade.top_k()
+    """
+
+    def __init__(
+        self,
+        context_window_length=16,
+        next_word_possibilities_number=16,
+        initial_context=None,
+        language_model=None,
+        language_model_kwargs=None,
+        order=3,
+        threshold=0.5,
+    ):
+        """
+        @param language_model: ILanguageModel class consulted below threshold.
+        @param language_model_kwargs: Dict of extra constructor arguments for it.
+        @param order: Int order of the n-gram model.
+        @param threshold: Float minimum probability of the n-gram's best word for
+            its prediction to be used.
+        """
+        assert language_model is not None
+        self.name = "Cascade"
+        self.window_length = context_window_length
+        self.num_possibilities = next_word_possibilities_number
+        self.threshold = threshold
+        self.ngram = NGramModel(
+            context_window_length=context_window_length,
+            next_word_possibilities_number=next_word_possibilities_number,
+            order=order,
+        )
+        self.lm = language_model(
+            context_window_length=context_window_length,
+            next_word_possibilities_number=next_word_possibilities_number,
+            **(language_model_kwargs or {}),
+        )
+        self.ngram_predictions = 0
+        self.model_predictions = 0
+
+        if initial_context:
+            self.reset(initial_context)
+
+    @property
+    def context(self):
+        return self.ngram.context
+
+    def reset(self, new_context):
+        self.ngram.reset(list(new_context))
+        self.lm.reset(list(new_context))
+
+    def add_word_to_context(self, word):
+        self.ngram.add_word_to_context(word)
+        self.lm.add_word_to_context(word)
+
+    def get_state(self):
+        return (self.ngram.get_state(), self.lm.get_state())
+
+    def set_state(self, state):
+        ngram_state, lm_state = state
+        self.ngram.set_state(ngram_state)
+        self.lm.set_state(lm_state)
+
+    def get_context_key(self):
+        return ("cascade", self.ngram.get_context_key(), self.lm.get_context_key())
+
+    def get_precision(self):
+        return self.lm.get_precision()
+
+    def close(self):
+        self.ngram.close()
+        self.lm.close()
+
+    def set_metrics(self, metrics):
+        self.metrics = metrics
+        self.lm.set_metrics(metrics)
+        metrics.add_source(
+            str(self),
+            lambda: {
+                "ngram_predictions": self.ngram_predictions,
+                "model_predictions": self.model_predictions,
+            },
+        )
+
+    def get_vocabulary(self):
+        return CombinedVocabulary(
+            [self.lm.get_vocabulary(), self.ngram.get_vocabulary()]
+        )
+
+    def __str__(self):
+        return f"Cascade({self.ngram}|{self.lm}|{self.threshold})"
+
+    def __call__(self):
+        return self.get_vocabulary().to_ordered_dict(*self.top_k())
+
+    def top_k(self):
+        prediction = self.ngram.top_k()
+        if self.ngram.get_confidence(prediction) >= self.threshold:
+            return self._from_ngram(prediction)
+        self.model_predictions += 1
+        return self.lm.top_k()
+
+    def _from_ngram(self, prediction):
+        self.ngram_predictions += 1
+        token_ids, probabilities = prediction
+        return token_ids + len(self.lm.get_vocabulary()), probabilities
+
+    def batch_call(self, contexts):
+        vocabulary = self.get_vocabulary()
+        return [
+            vocabulary.to_ordered_dict(token_ids, probabilities)
+            for token_ids, probabilities in self.batch_top_k(contexts)
+        ]
+
+    def batch_top_k(self, contexts):
+        """
+        Only the contexts the n-gram model is not confident about are scored by
+        the language model, in a single batch.
+        """
+        predictions = self.ngram.batch_top_k(contexts)
+        escalated = []
+        for i, prediction in enumerate(predictions):
+            if self.ngram.get_confidence(prediction) >= self.threshold:
+                predictions[i] = self._from_ngram(prediction)
+            else:
+                escalated.append(i)
+
+        self.model_predictions += len(escalated)
+        scored = self.lm.batch_top_k([contexts[i] for i in escalated])
+        for i, prediction in zip(escalated, scored):
+            predictions[i] = prediction
+        return predictions
@@ -0,0 +1,96 @@
+from collections import deque
+
+
+class ContextWindow:
+    """Sliding window over the last max_length words, or tokens, of a text.
+
+    Appending evicts the oldest item once the window is full, both in O(1).
+    When an encode function is given, the token ids of every item are computed
+    once as it enters the window and kept alongside it, so the model input is
+    a concatenation of cached ids rather than a tokenization of the joined
+    words. This requires a tokenizer that never merges tokens across the
+    whitespace between words, which holds for the byte-level BPE of GPT-2, the
+    BPE of GPT and the SentencePiece model of XLNet.
+
+    Usage sample:
+
+    context = ContextWindow(16, encode=lambda word: tokenizer.encode(word))
+
+    context.reset(['Hello', 'world', '.'])
+
+    context.append('Test')
+
+    input_ids = context.get_token_ids()
+    """
+
+    def __init__(self, max_length, items=(), encode=None):
+        """
+        @param max_length: Int maximum number of items held.
+        @param items: Iterable of the initial items, only the last max_length are kept.
+        @param encode: Function from an item to its List<Int> token ids, or None
+            when the items are token ids themselves.
+        """
+        self.max_length = max_length
+        self.encode = encode
+        self._items = deque(maxlen=max_length)
+        self._item_token_ids = deque(maxlen=max_length)
+        self._token_ids = None
+        self.extend(items)
+
+    def append(self, item):
+        self._items.append(item)
+        if self.encode is not None:
+            self._item_token_ids.append(self.encode(item))
+        self._token_ids = None
+
+    def extend(self, items):
+        items = list(items)[-self.max_length :] if self.max_length else []
+        for item in items:
+            self.append(item)
+
+    def reset(self, items=()):
+        """
+        Replaces the items with a copy of the last max_length given ones.
+        """
+        self._items.clear()
+        self._item_token_ids.clear()
+        self._token_ids = None
+        self.extend(items)
+
+    def is_full(self):
+        return len(self._items) == self.max_length
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __getitem__(self, i):
+        return self._items[i]
+
+    def __repr__(self):
+        return f"ContextWindow({list(self._items)})"
+
+    def get_item_token_ids(self):
+        """
+        @returns List<List<Int>> token ids of each item, oldest first.
+        """
+        if self.encode is None:
+            return [[item] for item in self._items]
+        return list(self._item_token_ids)
+
+    def get_token_ids(self):
+        """
+        @returns List<Int> token ids of the whole window, cached until it changes.
+        """
+        if self._token_ids is None:
+            if self.encode is None:
+                self._token_ids = list(self._items)
+            else:
+                self._token_ids = [
+                    token_id
+                    for token_ids in self._item_token_ids
+                    for token_id in token_ids
+                ]
+        return self._token_ids
@@ -1,9 +1,18 @@
-from collections import OrderedDict
-
 import torch
 import transformers as tfms
 
 from .ILanguageModel import ILanguageModel
+from .batching import get_batch_logits, get_span_logits
+from .context import ContextWindow
+from .inference import (
+    check_precision,
+    get_default_device,
+    get_top_k,
+    set_num_threads,
+)
+from .registry import default_registry
+from .tokenization import WordEncoder, get_tokenizer_class
+from .vocabulary import get_vocabulary
 
 
 class GPT2Model(ILanguageModel):
@@ -16,6 +25,25 @@ class GPT2Model(ILanguageModel):
     gpt2.add_word_to_context('Test')
 
     next_word_ranking = gpt2()
+
+    With incremental=True, the past keys/values of the transformer are kept
+    between calls and only the tokens of newly added words are fed through
+    the model. The cache grows until it spans twice the context window length
+    (or the model's maximum number of positions), at which point it is rebuilt
+    from the last context_window_length words. Predictions are therefore
+    conditioned on between one and two windows of words. Words are only fed
+    when the next prediction is asked, so words predicted without the model,
+    e.g. from a prediction cache or by the n-gram model of a cascade, cost no
+    forward pass when they are added, and words dropped by a rebuild none at
+    all.
+
+    Each word is tokenized once as it enters the context, the token ids of
+    recently seen words being memoized, and the model input is built by
+    concatenating the cached ids.
+
+    The byte-level tokenizer of GPT-2 round-trips any text exactly, so the
+    model can also be driven token by token with reset_tokens and
+    add_token_to_context, in which case the window counts tokens.
     """
 
     def __init__(
@@ -23,61 +51,312 @@ class GPT2Model(ILanguageModel):
         context_window_length=16,
         next_word_possibilities_number=16,
         initial_context="",
+        incremental=False,
+        checkpoint="gpt2",
+        registry=None,
+        device=None,
+        precision="fp32",
+        num_threads=None,
+        fast_tokenizer=False,
+        max_cached_words=1 << 16,
     ):
+        """
+        @param device: torch.device or String, defaults to CUDA when available.
+        @param precision: Inference precision, one of models.inference.PRECISIONS.
+            Compressor and decompressor must use the same one.
+        @param num_threads: Int number of CPU threads used by torch, for the whole process.
+        @param fast_tokenizer: If True, use the Rust tokenizer where transformers has one.
+            It is part of the model name, recorded in the stream header.
+        @param max_cached_words: Int number of words whose token ids are memoized.
+        """
         self.name = "GPT-2"
+        self.checkpoint = checkpoint
         self.window_length = context_window_length
         self.num_possibilities = next_word_possibilities_number
-        self.model = tfms.GPT2LMHeadModel.from_pretrained("gpt2")
-        self.tokenizer = tfms.GPT2Tokenizer.from_pretrained("gpt2")
+        self.incremental = incremental
+        self.device = (
+            torch.device(device) if device is not None else get_default_device()
+        )
+        self.precision = precision
+        check_precision(precision, self.device)
+        set_num_threads(num_threads)
+        registry = registry if registry is not None else default_registry
+        tokenizer_class = get_tokenizer_class(tfms.GPT2Tokenizer, fast_tokenizer)
+        self.fast_tokenizer = tokenizer_class is not tfms.GPT2Tokenizer
+        # The Rust tokenizer takes add_prefix_space when loaded, the Python one
+        # when encoding.
+        if self.fast_tokenizer:
+            tokenizer_kwargs = {"add_prefix_space": True}
+            self._encode_kwargs = {}
+        else:
+            tokenizer_kwargs = {}
+            self._encode_kwargs = {"add_prefix_space": True}
+        self.model, self.tokenizer = registry.get(
+            tfms.GPT2LMHeadModel,
+            tokenizer_class,
+            checkpoint,
+            device=self.device,
+            precision=precision,
+            tokenizer_kwargs=tokenizer_kwargs,
+        )
 
-        # Prevent dropout from being considered when evaluating
-        self.model.eval()
+        self.word_encoder = WordEncoder(self._encode_word, max_cached_words)
+        self.context = ContextWindow(
+            self.window_length, initial_context or [], encode=self.word_encoder
+        )
 
-        if initial_context:
-            self.context = initial_context
-        else:
-            self.context = []
+        # Token ids of the context when it is given as tokens rather than words
+        self.token_context = None
+
+        self._reset_cache(self.context.get_item_token_ids())
 
     def reset(self, new_context):
         if len(new_context) > self.window_length:
-            print(
-                f"New context ({len(new_context)}) exceeds context window length ({self.window_length})."
-            )
-            new_context = new_context[-self.window_length:]
+            # Only the last window of words is kept
+            self.metrics.count("truncated_contexts")
 
-        self.context = new_context
+        self.context.reset(new_context)
+        self.token_context = None
+        self._reset_cache(self.context.get_item_token_ids())
 
     def add_word_to_context(self, word):
-        assert len(self.context) <= self.window_length
+        self.context.append(word)
 
-        if len(self.context) == self.window_length:
-            self.context.pop()
+        if self.incremental:
+            self._extend_cache(self.context.get_item_token_ids()[-1:])
 
-        self.context.append(word)
+    def encode_text(self, text):
+        if self.fast_tokenizer:
+            raise NotImplementedError("Token contexts need the Python tokenizer.")
+        # The byte-level BPE is applied directly, since encode() strips the
+        # whitespace around special tokens and would not round-trip.
+        return self.tokenizer.convert_tokens_to_ids(self.tokenizer._tokenize(text))
+
+    def decode_tokens(self, token_ids):
+        return self.tokenizer.convert_tokens_to_string(
+            self.tokenizer.convert_ids_to_tokens(list(token_ids))
+        )
+
+    def reset_tokens(self, token_ids):
+        """
+        An empty context is represented by the end of text token, which GPT-2
+        was trained with as a document separator.
+        """
+        token_ids = list(token_ids)[-self.window_length:]
+        if len(token_ids) == 0:
+            token_ids = [self.tokenizer.eos_token_id]
+
+        self.context.reset()
+        self.token_context = ContextWindow(self.window_length, token_ids)
+        self._reset_cache(self.token_context.get_item_token_ids())
+
+    def add_token_to_context(self, token_id):
+        self.token_context.append(token_id)
+
+        if self.incremental:
+            self._extend_cache([[token_id]])
+
+    def _encode_word(self, word):
+        """
+        @returns List<Int> token ids of the word, preceded by a space as within a text.
+        """
+        with self.metrics.timer("tokenize"):
+            return self.tokenizer.encode(word, **self._encode_kwargs)
+
+    def _reset_cache(self, units):
+        """
+        Drops the key/value cache, the next prediction being conditioned on the
+        given units.
+        @param units: List<List<Int>> token ids of each word, or of each token.
+        """
+        units = list(units)
+        # Units the next prediction is conditioned on, the first
+        # _first_pass_units_number of them being fed in a single pass
+        self._units = units
+        self._units_length = min(
+            sum(len(unit) for unit in units), self.model.config.n_positions
+        )
+        self._units_key = hash(tuple(tuple(unit) for unit in units))
+        self._first_pass_units_number = len(units)
+        # Keys/values of the first _past_units_number units
+        self._past = None
+        self._past_units_number = 0
+        self._next_token_logits = None
+
+    def _extend_cache(self, units):
+        """
+        Adds units on top of the cache, which is rebuilt from the last window of
+        units once it grows past its bound. Nothing is fed through the model
+        until the next prediction, see _feed_cache.
+        @param units: List<List<Int>> token ids of each word, or of each token.
+        """
+        for unit in units:
+            if (
+                len(self._units) >= 2 * self.window_length
+                or self._units_length + len(unit) > self.model.config.n_positions
+            ):
+                self._reset_cache((self._units + [unit])[-self.window_length :])
+            else:
+                self._units.append(unit)
+                self._units_length += len(unit)
+                self._units_key = hash((self._units_key, tuple(unit)))
+                self._next_token_logits = None
+
+    def _feed_cache(self):
+        """
+        Feeds the units missing from the key/value cache through the model: the
+        units of the last rebuild in one pass, then one pass per unit, as if each
+        one had been predicted. The cache therefore holds the same values however
+        many units were added between two predictions.
+        """
+        if self._next_token_logits is not None:
+            return
+
+        if self._past_units_number == 0:
+            self._past_units_number = max(self._first_pass_units_number, 1)
+            units = self._units[: self._past_units_number]
+            inpt = [token_id for unit in units for token_id in unit]
+            passes = [inpt[-self.model.config.n_positions :]]
+        else:
+            passes = []
+        passes.extend(self._units[self._past_units_number :])
+        self._past_units_number = len(self._units)
+
+        for inpt in passes:
+            with torch.no_grad(), self.metrics.timer("forward"):
+                outputs = self.model(
+                    torch.tensor([inpt]).to(self.device), past=self._past
+                )
+            self._past = outputs[1]
+        self._next_token_logits = outputs[0][0, -1, :]
+
+    def get_state(self):
+        # The cached keys/values are never modified in place, extending the
+        # cache creates new tensors, so the snapshot can share them.
+        return (
+            list(self.context),
+            None if self.token_context is None else list(self.token_context),
+            list(self._units),
+            self._units_length,
+            self._units_key,
+            self._first_pass_units_number,
+            self._past,
+            self._past_units_number,
+            self._next_token_logits,
+        )
+
+    def set_state(self, state):
+        words, token_ids, units, *cache_state = state
+        # The token ids of the words are memoized, so this does not tokenize again
+        self.context.reset(words)
+        self.token_context = (
+            None if token_ids is None else ContextWindow(self.window_length, token_ids)
+        )
+        self._units = list(units)
+        (
+            self._units_length,
+            self._units_key,
+            self._first_pass_units_number,
+            self._past,
+            self._past_units_number,
+            self._next_token_logits,
+        ) = cache_state
+
+    def get_context_key(self):
+        # Incremental predictions are conditioned on every unit of the cache,
+        # which can span up to two windows, and on how they were fed. The key
+        # is a hash of the units chained as they are added, so that it does not
+        # cost a pass over them.
+        if self.incremental and len(self._units) > 0:
+            return (
+                "units",
+                self._first_pass_units_number,
+                len(self._units),
+                self._units_key,
+            )
+        return super().get_context_key()
 
     def __str__(self):
-        return "GPT-2"
+        # The tokenizers may not split words the same way, so the predictions
+        # of the fast one are not interchangeable with those of the other
+        if self.fast_tokenizer:
+            return f"GPT-2({self.checkpoint}|fast)"
+        return f"GPT-2({self.checkpoint})"
 
     def __call__(self):
-        if len(self.context) > 0:
-            inpt = self.tokenizer.encode(" ".join(self.context), add_prefix_space=True)
+        return self.get_vocabulary().to_ordered_dict(*self.top_k())
+
+    def top_k(self):
+        if self.incremental and len(self._units) > 0:
+            self._feed_cache()
+            loss = self._next_token_logits
         else:
-            inpt = self.tokenizer.encode("", add_prefix_space=True)
+            if self.token_context is not None:
+                inpt = self.token_context.get_token_ids()
+            elif len(self.context) > 0:
+                inpt = self.context.get_token_ids()
+            else:
+                inpt = self.tokenizer.encode("", **self._encode_kwargs)
 
-        with torch.no_grad():
-            inpt = torch.tensor([inpt])
-            outputs = self.model(inpt)
+            with torch.no_grad(), self.metrics.timer("forward"):
+                outputs = self.model(torch.tensor([inpt]).to(self.device))
             loss = outputs[0][0, -1, :]
-            softmaxed = torch.softmax(loss, dim=0)
-            top_words = torch.topk(softmaxed, k=self.num_possibilities)
-            top_words_indices = top_words.indices
-            top_words_probabilities = top_words.values
 
-            result = OrderedDict()
-            for i in range(top_words_indices.shape[0]):
-                word = self.tokenizer.decode(torch.tensor([top_words_indices[i]]))
-                prob = top_words_probabilities[i].item()
-                result[word] = prob
+        return self._get_top_k(loss)
+
+    def _get_top_k(self, logits):
+        """
+        @param logits: Tensor of next token scores over the vocabulary.
+        @returns (token_ids, probabilities) of the most likely tokens.
+        """
+        with self.metrics.timer("top_k"):
+            return get_top_k(logits, self.num_possibilities)
+
+    def get_vocabulary(self):
+        return get_vocabulary(self.tokenizer)
+
+    def get_precision(self):
+        return self.precision
+
+    def batch_call(self, contexts):
+        vocabulary = self.get_vocabulary()
+        return [
+            vocabulary.to_ordered_dict(token_ids, probabilities)
+            for token_ids, probabilities in self.batch_top_k(contexts)
+        ]
+
+    def batch_top_k(self, contexts):
+        if len(contexts) == 0:
+            return []
+
+        with self.metrics.timer("tokenize"):
+            inpts = [
+                self.tokenizer.encode(
+                    " ".join(context[-self.window_length:]), **self._encode_kwargs
+                )
+                for context in contexts
+            ]
+        with self.metrics.timer("forward"):
+            logits = get_batch_logits(
+                self.model, self.device, inpts, metrics=self.metrics
+            )
+        return [self._get_top_k(row) for row in logits]
+
+    def span_top_k(self, context, words, length=None, last_only=False):
+        """
+        Scores the span in one causal forward pass, see ILanguageModel.span_top_k.
+        The words are tokenized as within the context, the model input being the
+        concatenation of their token ids.
+        """
+        units = [self.word_encoder(word) for word in list(context) + list(words)]
+        with self.metrics.timer("forward"):
+            logits = get_span_logits(
+                self.model, self.device, units, len(context), length, last_only
+            )
+        return [self._get_top_k(row) for row in logits]
 
-            return result
+    def get_span_length(self, context, words):
+        return sum(len(self.word_encoder(word)) for word in list(context) + list(words))
 
+    def get_max_span_length(self):
+        return self.model.config.n_positions
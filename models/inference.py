@@ -0,0 +1,121 @@
+import torch
+
+
+# Inference precisions of the transformer models, indexed by their id in the
+# stream header:
+#   fp32: full precision weights.
+#   bf16: bfloat16 weights and activations.
+#   int8: dynamic int8 quantization of the linear layers, on CPU only.
+PRECISIONS = ("fp32", "bf16", "int8")
+
+# Probabilities are quantized to multiples of 1 / RANKING_GRID before ranking.
+# Matches the scale at which the arithmetic coder quantizes them.
+RANKING_GRID = 1 << 16
+
+
+def get_default_device():
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    return torch.device("cpu")
+
+
+def check_precision(precision, device):
+    """
+    @raises ValueError if the precision is unknown or cannot run on device.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}, expected one of {PRECISIONS}.")
+    device = torch.device(device)
+    if precision == "int8" and device.type != "cpu":
+        raise ValueError("int8 dynamic quantization only runs on CPU.")
+    if (
+        precision == "bf16"
+        and device.type == "cuda"
+        and not torch.cuda.is_bf16_supported()
+    ):
+        raise ValueError(f"{device} does not support bf16.")
+
+
+def _replace_conv1d_with_linear(module):
+    """
+    GPT style models implement their projections with transformers' Conv1D,
+    a linear layer with transposed weights that dynamic quantization does not
+    recognize. Replaces every Conv1D with the equivalent torch.nn.Linear.
+    """
+    for name, child in module.named_children():
+        if type(child).__name__ == "Conv1D":
+            in_features, out_features = child.weight.shape
+            linear = torch.nn.Linear(in_features, out_features)
+            with torch.no_grad():
+                linear.weight.copy_(child.weight.t())
+                linear.bias.copy_(child.bias)
+            setattr(module, name, linear)
+        else:
+            _replace_conv1d_with_linear(child)
+
+
+def set_precision(model, precision):
+    """
+    Converts a model, in evaluation mode, to the given precision.
+    @param model: torch.nn.Module
+    @param precision: One of PRECISIONS.
+    @returns torch.nn.Module, possibly a new one.
+    """
+    if precision == "bf16":
+        return model.to(torch.bfloat16)
+    if precision == "int8":
+        _replace_conv1d_with_linear(model)
+        return torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    return model
+
+
+def set_num_threads(num_threads):
+    """
+    Sets the number of threads torch uses for intra-op parallelism on CPU,
+    for the whole process.
+    """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+
+
+def get_canonical_top_k(probabilities, k, token_ids=None):
+    """
+    Gets the k most likely tokens in canonical order: by decreasing probability
+    quantized to multiples of 1 / RANKING_GRID, then by increasing token id.
+    Differences in the last bits of the probabilities, as produced by other
+    kernels, thread counts or batch paddings, therefore only change the ranking
+    when they cross a grid boundary.
+    @param probabilities: 1-D tensor.
+    @param k: Int maximum number of tokens returned.
+    @param token_ids: 1-D tensor of the token id of each probability, or None
+        when the probabilities are indexed by token id.
+    @returns (token_ids, probabilities) on CPU. The probabilities are quantized.
+    """
+    with torch.no_grad():
+        quantized = torch.floor(probabilities.double().cpu() * RANKING_GRID)
+        if token_ids is None:
+            token_ids = torch.arange(len(quantized))
+        k = min(k, len(quantized))
+        if k == 0:
+            return token_ids[:0], quantized[:0].float()
+
+        kth_quantized = torch.topk(quantized, k=k).values[-1]
+        # Every token tied with the k-th one is a candidate, in increasing id order
+        candidates = (quantized >= kth_quantized).nonzero().squeeze(1)
+        candidates = candidates[torch.argsort(token_ids[candidates])]
+        order = torch.sort(quantized[candidates], descending=True, stable=True)
+        selected = candidates[order.indices[:k]]
+        return token_ids[selected], (order.values[:k] / RANKING_GRID).float()
+
+
+def get_top_k(logits, k):
+    """
+    Gets the k most likely tokens in canonical order, see get_canonical_top_k.
+    @param logits: Tensor of next token scores over the vocabulary.
+    @returns (token_ids, probabilities) on CPU, from the most to the least likely.
+    """
+    with torch.no_grad():
+        # Softmax in full precision, whatever the precision of the model
+        return get_canonical_top_k(torch.softmax(logits.float(), dim=0), k)
@@ -0,0 +1,266 @@
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import torch
+
+
+# Stages timed by the protocol and the model wrappers:
+#   tokenize: tokenization of the words entering a model's context.
+#   forward: forward passes of a model, including key/value cache updates.
+#   top_k: selection of the k most likely tokens from a model's logits.
+#   predict: whole model predictions as seen by the protocol, which includes the
+#       three stages above, prediction cache lookups and models without stages.
+#   rank: lookup of each unit among the predictions, or of a ranking's unit.
+#   entropy_coding: arithmetic coding of each unit.
+#   serialize: bit packing and parsing of the rank coding's records.
+#   zlib: zlib compression and decompression.
+#   queue: time the predictions of service jobs wait for their batch to start.
+STAGES = (
+    "tokenize",
+    "forward",
+    "top_k",
+    "predict",
+    "rank",
+    "entropy_coding",
+    "serialize",
+    "zlib",
+    "queue",
+)
+
+
+class _Timer:
+    """Context manager adding the time spent in it to a stage of Metrics."""
+
+    __slots__ = ("metrics", "stage", "start", "record")
+
+    def __init__(self, metrics, stage, record=None):
+        self.metrics = metrics
+        self.stage = stage
+        self.record = record
+
+    def __enter__(self):
+        if self.record is not None:
+            self.record.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.add_time(self.stage, time.perf_counter() - self.start)
+        if self.record is not None:
+            self.record.__exit__(*exc_info)
+        return False
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """Timers, counters and callbacks of compression jobs.
+
+    Timers sum the wall time spent in each stage, see STAGES, and counters
+    track the coded units: how many there are, how many were out of vocabulary
+    and the histogram of their rankings, as well as events such as batches or
+    contexts truncated to a model's window. Recording costs a few hundred
+    nanoseconds per unit, little next to a model prediction, so it can stay on
+    in production. Recording is thread safe, e.g. for the components of a
+    mixture predicting on its thread pool. Statistics kept elsewhere, such as
+    cache hits, are added as sources and only read when stats() is called.
+
+    Each outermost operation, e.g. a compress call, ends by calling every
+    callback with its name and the metrics. With profile set, the operation
+    also runs under the torch profiler, the timed stages showing up as labelled
+    ranges in the trace.
+
+    Usage sample:
+
+    metrics = Metrics(callbacks=[log_metrics])
+
+    protocol = LMProtocol(GPT2Model, metrics=metrics)
+
+    protocol.compress(text)
+
+    print(metrics.stats()["timers"]["forward"])
+    """
+
+    def __init__(self, enabled=True, callbacks=(), profile=False, profile_directory=None):
+        """
+        @param enabled: If False, nothing is recorded and no callback is called.
+        @param callbacks: Functions called as callback(operation_name, metrics)
+            at the end of each outermost operation.
+        @param profile: If True, run operations under torch.profiler.
+        @param profile_directory: String directory where a Chrome trace of each
+            profiled operation is written, or None to only keep the profilers.
+        """
+        self.enabled = enabled
+        self.callbacks = list(callbacks)
+        self.profile = profile
+        self.profile_directory = profile_directory
+        # Profiler of the last run of each operation
+        self.profiles = {}
+        self._sources = {}
+        self._operations_depth = 0
+        self._profiling = False
+        # Guards the timers and counters, updated from several threads
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """
+        Resets the timers and counters, keeping the callbacks and sources.
+        """
+        with self._lock:
+            self.seconds = Counter()
+            self.calls = Counter()
+            self.counters = Counter()
+            self.ranking_histogram = Counter()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def add_source(self, name, get_stats):
+        """
+        @param name: String key of the statistics in stats().
+        @param get_stats: Function returning a Dict of statistics.
+        """
+        self._sources[name] = get_stats
+
+    def timer(self, stage):
+        """
+        @param stage: String name of the stage, see STAGES.
+        @returns context manager adding the time spent in it to the stage.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        if self._profiling:
+            return _Timer(self, stage, torch.profiler.record_function(stage))
+        return _Timer(self, stage)
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            self.seconds[stage] += seconds
+            self.calls[stage] += 1
+
+    def count(self, name, number=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += number
+
+    def count_ranking(self, ranking):
+        """
+        Counts a coded unit.
+        @param ranking: Int ranking of the unit, or None when out of vocabulary.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters["units"] += 1
+            if ranking is None:
+                self.counters["out_of_vocabulary"] += 1
+            else:
+                self.ranking_histogram[ranking] += 1
+
+    @contextmanager
+    def operation(self, name):
+        """
+        Times an operation, e.g. a whole compress call. Operations nested in
+        another one are only timed, the outermost one is profiled and notifies
+        the callbacks.
+        @param name: String name of the operation, timed as a stage.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        outermost = self._operations_depth == 0
+        self._operations_depth += 1
+        try:
+            if outermost and self.profile:
+                with self._profile(name), self.timer(name):
+                    yield
+            else:
+                with self.timer(name):
+                    yield
+        finally:
+            self._operations_depth -= 1
+
+        if outermost:
+            for callback in self.callbacks:
+                callback(name, self)
+
+    @contextmanager
+    def _profile(self, name):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+        with torch.profiler.profile(activities=activities) as profiler:
+            self._profiling = True
+            try:
+                yield
+            finally:
+                self._profiling = False
+
+        self.profiles[name] = profiler
+        if self.profile_directory is not None:
+            os.makedirs(self.profile_directory, exist_ok=True)
+            profiler.export_chrome_trace(
+                os.path.join(self.profile_directory, f"{name}-{time.time_ns()}.json")
+            )
+
+    def get_out_of_vocabulary_rate(self):
+        """
+        @returns Float fraction of the coded units that were out of vocabulary.
+        """
+        if self.counters["units"] == 0:
+            return 0.0
+        return self.counters["out_of_vocabulary"] / self.counters["units"]
+
+    def stats(self):
+        """
+        @returns Dict: timers, with the seconds and calls of each stage, counters,
+            out_of_vocabulary_rate, ranking_histogram, a List<Int> of the number of
+            units coded at each ranking, and the statistics of each source.
+        """
+        with self._lock:
+            stats = {
+                "timers": {
+                    stage: {"seconds": self.seconds[stage], "calls": self.calls[stage]}
+                    for stage in self.seconds
+                },
+                "counters": dict(self.counters),
+                "ranking_histogram": [
+                    self.ranking_histogram[ranking]
+                    for ranking in range(max(self.ranking_histogram, default=-1) + 1)
+                ],
+            }
+        stats["out_of_vocabulary_rate"] = self.get_out_of_vocabulary_rate()
+        for name, get_stats in self._sources.items():
+            stats[name] = get_stats()
+        return stats
+
+
+def log_metrics(operation_name, metrics):
+    """
+    Callback printing a one line summary of the metrics after an operation.
+    """
+    timers = ", ".join(
+        f"{stage} {metrics.seconds[stage]:.3f}s"
+        for stage in STAGES
+        if stage in metrics.seconds
+    )
+    print(
+        f"{operation_name}: {metrics.seconds[operation_name]:.3f}s, "
+        f"{metrics.counters['units']} units, "
+        f"{metrics.get_out_of_vocabulary_rate():.2%} out of vocabulary ({timers})"
+    )
@@ -0,0 +1,332 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from .ILanguageModel import ILanguageModel
+from .context import ContextWindow
+from .inference import RANKING_GRID, get_canonical_top_k
+from .vocabulary import CombinedVocabulary
+
+
+class MixtureLanguageModel(ILanguageModel):
+    """Ensemble of language models whose predictions are mixed with weights
+    learned online from their coding cost.
+
+    The probability of a word is the weighted sum of its probabilities in the
+    top-k predictions of the components. After each word, every component is
+    charged the bits it would have spent coding it, at most those of a
+    probability of 1 / RANKING_GRID, and the weight of a component is
+    proportional to 2 ** (-learning_rate * its recent cost), where the recent
+    cost decays by decay at each word. The weights only depend on the words
+    already coded, so the decompressor learns the same ones, and they are
+    quantized to the ranking grid so that last bit differences are absorbed
+    as for the probabilities, see models.inference.get_canonical_top_k.
+
+    The components predict concurrently on a thread pool, torch releasing the
+    GIL during their forward passes, until close shuts the pool down. With
+    drop_threshold, a component whose weight falls below it is no longer run
+    until the next reset, the weights being shared by the remaining ones.
+
+    Token ids of each component are offset by the sizes of the vocabularies of
+    the components before it. A word predicted by several components takes the
+    id of the first one. Only the last component's vocabulary may grow.
+
+    Usage sample:
+
+    mixture = MixtureLanguageModel(
+        language_models=[(GPT2Model, None), (XLNetModel, None)],
+        drop_threshold=0.05,
+    )
+
+    mixture.reset(['Hello', 'world', '.'])
+
+    token_ids, probabilities = mixture.top_k()
+    """
+
+    def __init__(
+        self,
+        context_window_length=16,
+        next_word_possibilities_number=16,
+        initial_context=None,
+        language_models=(),
+        learning_rate=1.0,
+        decay=0.9,
+        drop_threshold=None,
+    ):
+        """
+        @param language_models: List<(ILanguageModel class, Dict of extra
+            constructor arguments or None)> of the components.
+        @param learning_rate: Float scale of the costs in the weights, 0 for a
+            uniform mixture.
+        @param decay: Float factor of the recent cost of a component at each word,
+            between 0, for the cost of the last word only, and 1, for the cost of
+            every word since the last reset.
+        @param drop_threshold: Float weight below which a component stops being
+            run, or None to always run every component.
+        """
+        assert len(language_models) > 0
+        assert learning_rate >= 0
+        assert 0 <= decay <= 1
+        assert drop_threshold is None or 0 < drop_threshold < 1
+        self.name = "Mixture"
+        self.window_length = context_window_length
+        self.num_possibilities = next_word_possibilities_number
+        self.learning_rate = learning_rate
+        self.decay = decay
+        self.drop_threshold = drop_threshold
+        self.components = [
+            language_model(
+                context_window_length=context_window_length,
+                next_word_possibilities_number=next_word_possibilities_number,
+                **(language_model_kwargs or {}),
+            )
+            for language_model, language_model_kwargs in language_models
+        ]
+        precisions = {component.get_precision() for component in self.components}
+        if len(precisions) > 1:
+            raise ValueError("Mixture components must share an inference precision.")
+        self.executor = (
+            ThreadPoolExecutor(max_workers=len(self.components))
+            if len(self.components) > 1
+            else None
+        )
+        self.context = ContextWindow(self.window_length)
+        self.dropped_components = 0
+        self.reset(initial_context or [])
+
+    def reset(self, new_context):
+        self.context.reset(new_context)
+        for component in self.components:
+            component.reset(list(new_context))
+        self._restart()
+
+    def _restart(self, active=None, costs=None):
+        # Indices of the components still run
+        self._active = (
+            list(active) if active is not None else list(range(len(self.components)))
+        )
+        self._costs = list(costs) if costs is not None else [0.0] * len(self.components)
+        self._set_weights()
+        # Predictions of the active components for the current context
+        self._predictions = None
+
+    def add_word_to_context(self, word):
+        # The weights are updated whether or not the prediction was asked, e.g.
+        # when it was served by a prediction cache, for the decoder to follow.
+        if self._predictions is None:
+            self._predictions = self._predict_components()
+        self._update_weights(word, self._predictions)
+        self._predictions = None
+
+        self.context.append(word)
+        self._map(
+            lambda component: component.add_word_to_context(word),
+            [self.components[i] for i in self._active],
+        )
+
+    def get_state(self):
+        return (
+            list(self.context),
+            [component.get_state() for component in self.components],
+            list(self._active),
+            list(self._costs),
+        )
+
+    def set_state(self, state):
+        words, component_states, active, costs = state
+        self.context.reset(words)
+        for component, component_state in zip(self.components, component_states):
+            component.set_state(component_state)
+        self._restart(active, costs)
+
+    def get_context_key(self):
+        return (
+            "mixture",
+            tuple(self.components[i].get_context_key() for i in self._active),
+            tuple(self._weights),
+        )
+
+    def get_precision(self):
+        return self.components[0].get_precision()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        for component in self.components:
+            component.close()
+
+    def set_metrics(self, metrics):
+        self.metrics = metrics
+        for component in self.components:
+            component.set_metrics(metrics)
+        metrics.add_source(
+            str(self),
+            lambda: {
+                "weights": {
+                    str(self.components[i]): weight
+                    for i, weight in zip(self._active, self._weights)
+                },
+                "dropped_components": self.dropped_components,
+            },
+        )
+
+    def get_vocabulary(self):
+        return CombinedVocabulary(
+            [component.get_vocabulary() for component in self.components]
+        )
+
+    def __str__(self):
+        components = "|".join(str(component) for component in self.components)
+        return (
+            f"Mixture({components}|{self.learning_rate}|{self.decay}"
+            f"|{self.drop_threshold})"
+        )
+
+    def __call__(self):
+        return self.get_vocabulary().to_ordered_dict(*self.top_k())
+
+    def top_k(self):
+        if self._predictions is None:
+            self._predictions = self._predict_components()
+        return self._mix(self._predictions)
+
+    def batch_call(self, contexts):
+        vocabulary = self.get_vocabulary()
+        return [
+            vocabulary.to_ordered_dict(token_ids, probabilities)
+            for token_ids, probabilities in self.batch_top_k(contexts)
+        ]
+
+    def batch_top_k(self, contexts):
+        """
+        Each active component scores the contexts in one batch. They are mixed
+        with the current weights, which are left unchanged, so streams coded in
+        lockstep keep the weights of the last reset.
+        """
+        if len(contexts) == 0:
+            return []
+
+        active = [self.components[i] for i in self._active]
+        offsets = self._get_offsets()
+        component_predictions = self._map(
+            lambda component: component.batch_top_k(contexts), active
+        )
+        return [
+            self._mix(
+                [
+                    self._get_word_probabilities(
+                        self.components[i], offsets[i], predictions[j]
+                    )
+                    for i, predictions in zip(self._active, component_predictions)
+                ]
+            )
+            for j in range(len(contexts))
+        ]
+
+    def _map(self, function, components):
+        """
+        Calls function on each component, concurrently when there are several.
+        @returns List of the results, in the order of the components.
+        """
+        if self.executor is None or len(components) <= 1:
+            return [function(component) for component in components]
+        return list(self.executor.map(function, components))
+
+    def _get_offsets(self):
+        offsets = [0]
+        for component in self.components[:-1]:
+            offsets.append(offsets[-1] + len(component.get_vocabulary()))
+        return offsets
+
+    def _predict_components(self):
+        """
+        @returns List of the predictions of the active components, see
+            _get_word_probabilities.
+        """
+        offsets = self._get_offsets()
+        return self._map(
+            lambda i: self._get_word_probabilities(
+                self.components[i], offsets[i], self.components[i].top_k()
+            ),
+            self._active,
+        )
+
+    def _get_word_probabilities(self, component, offset, prediction):
+        """
+        @returns Dict: word -> [Float probability of the tokens of the prediction
+            decoding to the word, Int mixture token id of the first one].
+        """
+        vocabulary = component.get_vocabulary()
+        token_ids, probabilities = prediction
+        words = {}
+        for token_id, probability in zip(token_ids.tolist(), probabilities.tolist()):
+            word = vocabulary[token_id]
+            # Whitespace tokens can never be the next word
+            if not word:
+                continue
+            if word in words:
+                words[word][0] += probability
+            else:
+                words[word] = [probability, token_id + offset]
+        return words
+
+    def _mix(self, predictions):
+        """
+        @param predictions: List of the word probabilities of the active components.
+        @returns (token_ids, probabilities) of the most likely words of the mixture.
+        """
+        words = {}
+        for weight, prediction in zip(self._weights, predictions):
+            for word, (probability, token_id) in prediction.items():
+                if word in words:
+                    words[word][0] += weight * probability
+                else:
+                    words[word] = [weight * probability, token_id]
+
+        probabilities = torch.tensor(
+            [probability for probability, _ in words.values()], dtype=torch.float64
+        )
+        token_ids = torch.tensor(
+            [token_id for _, token_id in words.values()], dtype=torch.long
+        )
+        with self.metrics.timer("top_k"):
+            return get_canonical_top_k(probabilities, self.num_possibilities, token_ids)
+
+    def _update_weights(self, word, predictions):
+        for i, prediction in zip(self._active, predictions):
+            probability = prediction[word][0] if word in prediction else 0.0
+            cost = -math.log2(max(probability, 1 / RANKING_GRID))
+            self._costs[i] = self.decay * self._costs[i] + cost
+        self._set_weights()
+
+        if self.drop_threshold is None or len(self._active) == 1:
+            return
+        kept = [
+            i
+            for i, weight in zip(self._active, self._weights)
+            if weight >= self.drop_threshold
+        ]
+        if len(kept) < len(self._active):
+            if len(kept) == 0:
+                # The best component is kept whatever its weight
+                kept = [self._active[self._weights.index(max(self._weights))]]
+            self.dropped_components += len(self._active) - len(kept)
+            self._active = kept
+            self._set_weights()
+
+    def _set_weights(self):
+        """
+        Sets the weights of the active components from their recent costs,
+        quantized to multiples of 1 / RANKING_GRID.
+        """
+        min_cost = min(self._costs[i] for i in self._active)
+        scores = [
+            2.0 ** (-self.learning_rate * (self._costs[i] - min_cost))
+            for i in self._active
+        ]
+        total = sum(scores)
+        self._weights = [
+            math.floor(score / total * RANKING_GRID) / RANKING_GRID for score in scores
+        ]
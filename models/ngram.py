@@ -0,0 +1,221 @@
+import itertools
+from array import array
+from collections import OrderedDict
+
+import torch
+
+from .ILanguageModel import ILanguageModel
+from .context import ContextWindow
+from .inference import get_canonical_top_k
+from .vocabulary import Vocabulary
+
+
+# Successor lists with more entries than this get a position index, smaller ones
+# are searched linearly.
+_INDEXED_SUCCESSORS_NUMBER = 32
+
+# Version of the learned counts, shared by every model so that no two states
+# ever get the same context key.
+_state_versions = itertools.count()
+
+
+class _Successors:
+    """Words seen after a given context, with their counts.
+
+    The word ids and counts are held in two arrays kept sorted by decreasing
+    count, so the most frequent successors are always the first ones.
+    """
+
+    __slots__ = ("ids", "counts", "total", "positions")
+
+    def __init__(self):
+        self.ids = array("I")
+        self.counts = array("I")
+        self.total = 0
+        # Word id -> position in the arrays, only for long successor lists
+        self.positions = None
+
+    def increment(self, word_id):
+        self.total += 1
+        position = self._find(word_id)
+        if position is None:
+            self.ids.append(word_id)
+            self.counts.append(1)
+            if self.positions is not None:
+                self.positions[word_id] = len(self.ids) - 1
+            elif len(self.ids) > _INDEXED_SUCCESSORS_NUMBER:
+                self.positions = {
+                    successor_id: i for i, successor_id in enumerate(self.ids)
+                }
+            return
+
+        count = self.counts[position] + 1
+        # Every successor between the first one counted less than count and
+        # position has the old count, so swapping keeps the arrays sorted.
+        low, high = 0, position
+        while low < high:
+            middle = (low + high) // 2
+            if self.counts[middle] < count:
+                high = middle
+            else:
+                low = middle + 1
+        self.counts[position] = count
+        if low != position:
+            self._swap(low, position)
+
+    def _find(self, word_id):
+        if self.positions is not None:
+            return self.positions.get(word_id)
+        try:
+            return self.ids.index(word_id)
+        except ValueError:
+            return None
+
+    def _swap(self, i, j):
+        self.ids[i], self.ids[j] = self.ids[j], self.ids[i]
+        self.counts[i], self.counts[j] = self.counts[j], self.counts[i]
+        if self.positions is not None:
+            self.positions[self.ids[i]] = i
+            self.positions[self.ids[j]] = j
+
+
+class NGramModel(ILanguageModel):
+    """Word n-gram language model learning from the text as it is processed.
+
+    The counts of the words following every context of up to order - 1 words
+    are updated each time a word is added to the context, and cleared by
+    reset, so compressing and decompressing a text learn the same counts.
+    Predictions back off from the longest context to shorter ones, with
+    Witten-Bell escape probabilities. Words never seen before are out of the
+    vocabulary.
+
+    Usage sample:
+
+    ngram = NGramModel(order=3, initial_context=['Hello', 'world', '.'])
+
+    ngram.add_word_to_context('Test')
+
+    next_word_ranking = ngram()
+    """
+
+    def __init__(
+        self,
+        context_window_length=16,
+        next_word_possibilities_number=16,
+        initial_context=None,
+        order=3,
+    ):
+        """
+        @param order: Int length of the longest n-grams counted.
+        """
+        assert order >= 1
+        self.name = "N-gram"
+        self.window_length = context_window_length
+        self.num_possibilities = next_word_possibilities_number
+        self.order = order
+        self.reset(initial_context or [])
+
+    def reset(self, new_context):
+        self.context = ContextWindow(self.window_length, new_context)
+        self.vocabulary = Vocabulary([])
+        self._word_ids = {}
+        # Tuple of word ids -> _Successors
+        self._successors = {}
+        self._history = []
+        self._state_version = next(_state_versions)
+        for word in new_context:
+            self._learn(word)
+
+    def add_word_to_context(self, word):
+        self.context.append(word)
+        self._learn(word)
+
+    def get_context_key(self):
+        # Predictions depend on everything learned so far
+        return ("ngram", self._state_version)
+
+    def get_confidence(self, prediction):
+        """
+        @returns Float probability of the most likely word, 0 without any prediction.
+        """
+        _, probabilities = prediction
+        if len(probabilities) == 0:
+            return 0.0
+        return float(probabilities[0])
+
+    def _learn(self, word):
+        word_id = self._word_ids.get(word)
+        if word_id is None:
+            word_id = self.vocabulary.add_word(word)
+            self._word_ids[word] = word_id
+
+        for n in range(min(len(self._history), self.order - 1) + 1):
+            context = tuple(self._history[len(self._history) - n :])
+            successors = self._successors.get(context)
+            if successors is None:
+                successors = self._successors[context] = _Successors()
+            successors.increment(word_id)
+
+        self._history.append(word_id)
+        if len(self._history) >= self.order:
+            del self._history[0]
+        self._state_version = next(_state_versions)
+
+    def __str__(self):
+        return f"N-gram-{self.order}"
+
+    def __call__(self):
+        return self.get_vocabulary().to_ordered_dict(*self.top_k())
+
+    def top_k(self):
+        return self._predict(self._history)
+
+    def _predict(self, history):
+        """
+        @param history: List<Int> ids of the last words, oldest first.
+        """
+        probabilities = OrderedDict()
+        escape_probability = 1.0
+        for n in reversed(range(min(len(history), self.order - 1) + 1)):
+            successors = self._successors.get(tuple(history[len(history) - n :]))
+            if successors is None:
+                continue
+            distinct = len(successors.ids)
+            denominator = successors.total + distinct
+            for word_id, count in zip(
+                successors.ids[: self.num_possibilities],
+                successors.counts[: self.num_possibilities],
+            ):
+                if word_id not in probabilities:
+                    probabilities[word_id] = escape_probability * count / denominator
+            escape_probability *= distinct / denominator
+
+        return get_canonical_top_k(
+            torch.tensor(list(probabilities.values()), dtype=torch.float64),
+            self.num_possibilities,
+            torch.tensor(list(probabilities.keys()), dtype=torch.long),
+        )
+
+    def get_vocabulary(self):
+        return self.vocabulary
+
+    def batch_call(self, contexts):
+        vocabulary = self.get_vocabulary()
+        return [
+            vocabulary.to_ordered_dict(token_ids, probabilities)
+            for token_ids, probabilities in self.batch_top_k(contexts)
+        ]
+
+    def batch_top_k(self, contexts):
+        """
+        Predicts from the counts learned so far, without learning the contexts.
+        """
+        results = []
+        for context in contexts:
+            history = []
+            for word in context[len(context) - (self.order - 1) :]:
+                word_id = self._word_ids.get(word)
+                # An unknown word cuts the contexts it could be part of
+                history = [] if word_id is None else history + [word_id]
+            results.append(self._predict(history))
+        return results
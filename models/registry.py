@@ -0,0 +1,236 @@
+import os
+import resource
+import threading
+import time
+from collections import OrderedDict
+
+from .inference import set_precision
+
+
+def get_resident_memory():
+    """
+    Returns the resident set size of the current process in bytes.
+    Falls back to the peak resident set size where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if max_rss > 1 << 32 else max_rss * 1024
+
+
+def get_model_memory(model):
+    """
+    Returns the number of bytes held by the parameters and buffers of the given torch module.
+    """
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.nelement() * tensor.element_size() for tensor in tensors)
+
+
+class _RegistryEntry:
+    def __init__(self, value, load_time, memory=None):
+        self.value = value
+        self.load_time = load_time
+        self.memory = memory
+        self.hits = 0
+
+
+class ModelRegistry:
+    """Process-wide cache of pretrained models and tokenizers.
+
+    Each (model class, checkpoint, device, dtype, precision) is loaded once and
+    shared by every wrapper asking for it, and so is each (tokenizer class,
+    checkpoint, tokenizer arguments), so that wrappers using different
+    tokenizers still share the weights. When max_models is set, the least
+    recently used model is dropped once more than max_models are held, with
+    the tokenizers of its checkpoint if no other model uses it.
+
+    Usage sample:
+
+    registry = ModelRegistry(max_models=2)
+
+    model, tokenizer = registry.get(
+        tfms.GPT2LMHeadModel, tfms.GPT2Tokenizer, "gpt2"
+    )
+    """
+
+    def __init__(self, max_models=None):
+        self.max_models = max_models
+        self._models = OrderedDict()
+        self._tokenizers = OrderedDict()
+        self._loading_locks = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        model_class,
+        tokenizer_class,
+        checkpoint,
+        device=None,
+        dtype=None,
+        precision="fp32",
+        tokenizer_kwargs=None,
+    ):
+        """
+        Gets the shared model and tokenizer, loading them on first use.
+        @param model_class: transformers model class.
+        @param tokenizer_class: transformers tokenizer class.
+        @param checkpoint: String name or path of the pretrained weights.
+        @param device: torch.device or None for the default device.
+        @param dtype: torch.dtype or None to keep the stored precision.
+        @param precision: Inference precision, one of models.inference.PRECISIONS.
+        @param tokenizer_kwargs: Dict of extra arguments for loading the tokenizer.
+        @returns (model, tokenizer)
+        """
+        tokenizer_kwargs = tokenizer_kwargs or {}
+        model = self._get_shared(
+            self._models,
+            (model_class, checkpoint, str(device), str(dtype), precision),
+            lambda: self._load_model(model_class, checkpoint, device, dtype, precision),
+        )
+        tokenizer = self._get_shared(
+            self._tokenizers,
+            (tokenizer_class, checkpoint, tuple(sorted(tokenizer_kwargs.items()))),
+            lambda: self._load_tokenizer(tokenizer_class, checkpoint, tokenizer_kwargs),
+        )
+        return model, tokenizer
+
+    def _get_shared(self, entries, key, load):
+        """
+        @param entries: OrderedDict of the entries, least recently used first.
+        @param load: Function returning the _RegistryEntry of key.
+        @returns the value of the entry of key, loaded on first use.
+        """
+        with self._lock:
+            entry = self._get_entry(entries, key)
+            if entry is not None:
+                return entry.value
+            loading_lock = self._loading_locks.setdefault(key, threading.Lock())
+
+        # Load outside of the registry lock so other entries are not blocked
+        with loading_lock:
+            with self._lock:
+                entry = self._get_entry(entries, key)
+                if entry is not None:
+                    return entry.value
+
+            entry = load()
+
+            with self._lock:
+                entries[key] = entry
+                self._loading_locks.pop(key, None)
+                if entries is self._models and self.max_models is not None:
+                    while len(self._models) > self.max_models:
+                        self._models.popitem(last=False)
+                    self._drop_unused_tokenizers()
+
+        return entry.value
+
+    def _get_entry(self, entries, key):
+        entry = entries.get(key)
+        if entry is not None:
+            entry.hits += 1
+            entries.move_to_end(key)
+        return entry
+
+    def _drop_unused_tokenizers(self):
+        checkpoints = {key[1] for key in self._models}
+        for key in list(self._tokenizers):
+            if key[1] not in checkpoints:
+                del self._tokenizers[key]
+
+    def _load_model(self, model_class, checkpoint, device, dtype, precision):
+        start_time = time.time()
+        model = model_class.from_pretrained(checkpoint)
+        if device is not None:
+            model = model.to(device)
+        if dtype is not None:
+            model = model.to(dtype)
+
+        # Prevent dropout from being considered when evaluating
+        model.eval()
+        model = set_precision(model, precision)
+        load_time = time.time() - start_time
+        return _RegistryEntry(model, load_time, get_model_memory(model))
+
+    def _load_tokenizer(self, tokenizer_class, checkpoint, tokenizer_kwargs):
+        start_time = time.time()
+        tokenizer = tokenizer_class.from_pretrained(checkpoint, **tokenizer_kwargs)
+        return _RegistryEntry(tokenizer, time.time() - start_time)
+
+    def evict(self, model_class=None, checkpoint=None):
+        """
+        Drops the matching models, or every model when no filter is given, and
+        the tokenizers no remaining model uses.
+        """
+        with self._lock:
+            for key in list(self._models):
+                if model_class is not None and key[0] is not model_class:
+                    continue
+                if checkpoint is not None and key[1] != checkpoint:
+                    continue
+                del self._models[key]
+            self._drop_unused_tokenizers()
+
+    def stats(self):
+        """
+        @returns Dict:
+            resident_memory: Int (bytes, whole process)
+            models: List<Dict:
+                model: String
+                checkpoint: String
+                device: String
+                dtype: String
+                precision: String
+                load_time: Float (seconds)
+                memory: Int (bytes of parameters and buffers)
+                hits: Int
+            >
+            tokenizers: List<Dict:
+                tokenizer: String
+                checkpoint: String
+                load_time: Float (seconds)
+                hits: Int
+            >
+        """
+        with self._lock:
+            models = [
+                {
+                    "model": key[0].__name__,
+                    "checkpoint": key[1],
+                    "device": key[2],
+                    "dtype": key[3],
+                    "precision": key[4],
+                    "load_time": entry.load_time,
+                    "memory": entry.memory,
+                    "hits": entry.hits,
+                }
+                for key, entry in self._models.items()
+            ]
+            tokenizers = [
+                {
+                    "tokenizer": key[0].__name__,
+                    "checkpoint": key[1],
+                    "load_time": entry.load_time,
+                    "hits": entry.hits,
+                }
+                for key, entry in self._tokenizers.items()
+            ]
+        return {
+            "resident_memory": get_resident_memory(),
+            "models": models,
+            "tokenizers": tokenizers,
+        }
+
+    def __len__(self):
+        """
+        @returns Int number of models held.
+        """
+        with self._lock:
+            return len(self._models)
+
+
+default_registry = ModelRegistry()
@@ -0,0 +1,100 @@
+import time
+import zlib
+
+import torch
+
+from .ILanguageModel import ILanguageModel
+from .context import ContextWindow
+from .inference import get_top_k
+from .vocabulary import Vocabulary
+
+
+# Vocabulary of the stand-in model when none is given
+DEFAULT_WORDS = (
+    "the of and to a in is that it was for on are as with his they at be this "
+    "from have or by one had not but what all were when we there can an your "
+    "which their said if do will each about how up out them then she many some "
+    "so these would other into has more her two like him see time could no make "
+    "than first been its who now people my made over did down only way find use "
+    "may water long little very after words called just where most know . ,"
+).split()
+
+
+class StandInModel(ILanguageModel):
+    """Deterministic language model without weights, standing in for a neural
+    one when exercising the protocol and the service locally.
+
+    The scores of the next word are pseudo-random numbers seeded by the last
+    two words of the context, so any process predicts the same rankings for
+    the same context. Each top_k or batch_top_k call can sleep to simulate the
+    forward pass of a real model, a batch costing as much as a single context
+    as it would on an accelerator.
+
+    Usage sample:
+
+    lm = StandInModel(initial_context=['Hello', 'world', '.'], latency=0.01)
+
+    lm.add_word_to_context('Test')
+
+    next_word_ranking = lm()
+    """
+
+    def __init__(
+        self,
+        context_window_length=16,
+        next_word_possibilities_number=16,
+        initial_context=None,
+        words=DEFAULT_WORDS,
+        latency=0.0,
+    ):
+        """
+        @param words: List<String> vocabulary of the model.
+        @param latency: Float seconds each model call sleeps.
+        """
+        self.name = "Stand-in"
+        self.window_length = context_window_length
+        self.num_possibilities = next_word_possibilities_number
+        self.latency = latency
+        self.vocabulary = Vocabulary(words)
+        self.context = ContextWindow(self.window_length, initial_context or [])
+
+    def reset(self, new_context):
+        self.context.reset(new_context)
+
+    def add_word_to_context(self, word):
+        self.context.append(word)
+
+    def __str__(self):
+        return "Stand-in"
+
+    def __call__(self):
+        return self.get_vocabulary().to_ordered_dict(*self.top_k())
+
+    def top_k(self):
+        return self.batch_top_k([list(self.context)])[0]
+
+    def _get_logits(self, context):
+        seed = zlib.crc32(" ".join(context[-2:]).encode("utf-8"))
+        generator = torch.Generator().manual_seed(seed)
+        return torch.randn(len(self.vocabulary), generator=generator)
+
+    def get_vocabulary(self):
+        return self.vocabulary
+
+    def batch_call(self, contexts):
+        vocabulary = self.get_vocabulary()
+        return [
+            vocabulary.to_ordered_dict(token_ids, probabilities)
+            for token_ids, probabilities in self.batch_top_k(contexts)
+        ]
+
+    def batch_top_k(self, contexts):
+        if len(contexts) == 0:
+            return []
+
+        with self.metrics.timer("forward"):
+            if self.latency > 0:
+                time.sleep(self.latency)
+            logits = [self._get_logits(context) for context in contexts]
+        with self.metrics.timer("top_k"):
+            return [get_top_k(row, self.num_possibilities) for row in logits]
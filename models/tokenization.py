@@ -0,0 +1,66 @@
+from collections import OrderedDict
+
+import transformers as tfms
+
+
+def get_tokenizer_class(tokenizer_class, fast=False):
+    """
+    @param tokenizer_class: transformers tokenizer class.
+    @param fast: If True, prefer the Rust implementation of the tokenizer.
+    @returns the fast variant of tokenizer_class when asked for and available in
+        the installed transformers, tokenizer_class otherwise.
+    """
+    if not fast:
+        return tokenizer_class
+    return getattr(tfms, f"{tokenizer_class.__name__}Fast", tokenizer_class)
+
+
+class WordEncoder:
+    """Memoized tokenization of single words.
+
+    Natural text reuses a small set of words, so the token ids of the most
+    recently used max_words words are kept and the tokenizer only runs on the
+    others.
+
+    Usage sample:
+
+    encoder = WordEncoder(lambda word: tokenizer.encode(word), max_words=1 << 16)
+
+    token_ids = encoder('Hello')
+    """
+
+    def __init__(self, encode, max_words=1 << 16):
+        """
+        @param encode: Function from a word to its List<Int> token ids.
+        @param max_words: Int maximum number of words whose token ids are kept.
+        """
+        self.encode = encode
+        self.max_words = max_words
+        self._token_ids = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, word):
+        """
+        @returns Tuple<Int> token ids of the word.
+        """
+        token_ids = self._token_ids.get(word)
+        if token_ids is not None:
+            self.hits += 1
+            self._token_ids.move_to_end(word)
+            return token_ids
+
+        self.misses += 1
+        token_ids = tuple(self.encode(word))
+        if self.max_words > 0:
+            self._token_ids[word] = token_ids
+            if len(self._token_ids) > self.max_words:
+                self._token_ids.popitem(last=False)
+        return token_ids
+
+    def stats(self):
+        return {
+            "words": len(self._token_ids),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,143 @@
+import threading
+import weakref
+from collections import OrderedDict
+
+import torch
+
+
+class Vocabulary:
+    """Table from token ids to the words they decode to.
+
+    Words are stripped of surrounding whitespace, since the protocol compares
+    them to whitespace-separated words. Several ids may map to the same word.
+
+    Usage sample:
+
+    vocabulary = get_vocabulary(tokenizer)
+
+    token_ids, probabilities = lm.top_k()
+
+    ranking = vocabulary.get_ranking(token_ids, 'world')
+
+    word = vocabulary[token_ids[ranking]]
+    """
+
+    def __init__(self, words):
+        """
+        @param words: List<String> indexed by token id.
+        """
+        self.words = list(words)
+        self._ids = None
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, token_id):
+        return self.words[int(token_id)]
+
+    def get_ids(self, word):
+        """
+        @returns LongTensor of the ids decoding to word, or None.
+        """
+        if self._ids is None:
+            self._build_index()
+        return self._ids.get(word)
+
+    def get_ranking(self, token_ids, word):
+        """
+        @param token_ids: 1-D tensor of candidate token ids, best first.
+        @param word: String
+        @returns Int position of the first candidate decoding to word, or None.
+        """
+        word_ids = self.get_ids(word)
+        if word_ids is None:
+            return None
+        matches = (token_ids.unsqueeze(1) == word_ids.unsqueeze(0)).any(dim=1)
+        positions = matches.nonzero()
+        if positions.shape[0] == 0:
+            return None
+        return int(positions[0, 0])
+
+    def to_ordered_dict(self, token_ids, probabilities):
+        """
+        @returns Ordered dictionary with the word as a key and probability as a value.
+        """
+        result = OrderedDict()
+        for token_id, probability in zip(token_ids.tolist(), probabilities.tolist()):
+            result[self[token_id]] = probability
+        return result
+
+    def add_word(self, word):
+        """
+        Appends a word, for vocabularies growing with the text.
+        @returns Int id of the word.
+        """
+        token_id = len(self.words)
+        self.words.append(word)
+        if self._ids is not None:
+            word_ids = torch.tensor([token_id])
+            if word in self._ids:
+                word_ids = torch.cat([self._ids[word], word_ids])
+            self._ids[word] = word_ids
+        return token_id
+
+    def _build_index(self):
+        ids = {}
+        for token_id, word in enumerate(self.words):
+            ids.setdefault(word, []).append(token_id)
+        self._ids = {word: torch.tensor(word_ids) for word, word_ids in ids.items()}
+
+
+class CombinedVocabulary(Vocabulary):
+    """Vocabulary of several models placed one after the other, the ids of each
+    model being offset by the sizes of the vocabularies before it.
+    Only the last vocabulary may grow.
+    """
+
+    def __init__(self, vocabularies):
+        self.vocabularies = list(vocabularies)
+
+    def get_offset(self, i):
+        return sum(len(vocabulary) for vocabulary in self.vocabularies[:i])
+
+    def __len__(self):
+        return sum(len(vocabulary) for vocabulary in self.vocabularies)
+
+    def __getitem__(self, token_id):
+        token_id = int(token_id)
+        for vocabulary in self.vocabularies:
+            if token_id < len(vocabulary):
+                return vocabulary[token_id]
+            token_id -= len(vocabulary)
+        raise IndexError(token_id)
+
+    def get_ids(self, word):
+        ids = []
+        offset = 0
+        for vocabulary in self.vocabularies:
+            word_ids = vocabulary.get_ids(word)
+            if word_ids is not None:
+                ids.append(word_ids + offset)
+            offset += len(vocabulary)
+        if len(ids) == 0:
+            return None
+        return torch.cat(ids)
+
+
+_vocabularies = weakref.WeakKeyDictionary()
+_vocabularies_lock = threading.Lock()
+
+
+def get_vocabulary(tokenizer):
+    """
+    Gets the vocabulary of a tokenizer, built once and shared by every model using it.
+    """
+    with _vocabularies_lock:
+        vocabulary = _vocabularies.get(tokenizer)
+        if vocabulary is None:
+            vocabulary = Vocabulary(
+                tokenizer.decode([token_id]).strip()
+                for token_id in range(len(tokenizer))
+            )
+            _vocabularies[tokenizer] = vocabulary
+        return vocabulary
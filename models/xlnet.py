@@ -1,9 +1,18 @@
-from collections import OrderedDict
-
 import torch
 import transformers as tfms
 
 from .ILanguageModel import ILanguageModel
+from .batching import get_batch_logits
+from .context import ContextWindow
+from .inference import (
+    check_precision,
+    get_default_device,
+    get_top_k,
+    set_num_threads,
+)
+from .registry import default_registry
+from .tokenization import WordEncoder, get_tokenizer_class
+from .vocabulary import get_vocabulary
 
 
 class XLNetModel(ILanguageModel):
@@ -23,61 +32,122 @@ class XLNetModel(ILanguageModel):
         context_window_length=16,
         next_word_possibilities_number=16,
         initial_context="",
+        checkpoint="xlnet-large-cased",
+        registry=None,
+        device=None,
+        precision="fp32",
+        num_threads=None,
+        fast_tokenizer=False,
+        max_cached_words=1 << 16,
     ):
+        """
+        @param device: torch.device or String, defaults to CUDA when available.
+        @param precision: Inference precision, one of models.inference.PRECISIONS.
+            Compressor and decompressor must use the same one.
+        @param num_threads: Int number of CPU threads used by torch, for the whole process.
+        @param fast_tokenizer: If True, use the Rust tokenizer where transformers has one.
+            It is part of the model name, recorded in the stream header.
+        @param max_cached_words: Int number of words whose token ids are memoized.
+        """
         self.name = "XLNet"
+        self.checkpoint = checkpoint
         self.window_length = context_window_length
         self.num_possibilities = next_word_possibilities_number
-        self.model = tfms.XLNetLMHeadModel.from_pretrained("xlnet-large-cased")
-        self.tokenizer = tfms.XLNetTokenizer.from_pretrained("xlnet-large-cased")
-
-        # Prevent dropout from being considered when evaluating
-        self.model.eval()
-
-        if initial_context:
-            self.context = initial_context
-        else:
-            self.context = []
+        self.device = (
+            torch.device(device) if device is not None else get_default_device()
+        )
+        self.precision = precision
+        check_precision(precision, self.device)
+        set_num_threads(num_threads)
+        registry = registry if registry is not None else default_registry
+        tokenizer_class = get_tokenizer_class(tfms.XLNetTokenizer, fast_tokenizer)
+        self.fast_tokenizer = tokenizer_class is not tfms.XLNetTokenizer
+        self.model, self.tokenizer = registry.get(
+            tfms.XLNetLMHeadModel,
+            tokenizer_class,
+            checkpoint,
+            device=self.device,
+            precision=precision,
+        )
+
+        self.word_encoder = WordEncoder(self._encode_word, max_cached_words)
+        self.context = ContextWindow(
+            self.window_length, initial_context or [], encode=self.word_encoder
+        )
 
     def reset(self, new_context):
         if len(new_context) > self.window_length:
-            print(
-                f"New context ({len(new_context)}) exceeds context window length ({self.window_length})."
-            )
-            new_context = new_context[-self.window_length:]
+            # Only the last window of words is kept
+            self.metrics.count("truncated_contexts")
 
-        self.context = new_context
+        self.context.reset(new_context)
 
     def add_word_to_context(self, word):
-        assert len(self.context) <= self.window_length
-
-        if len(self.context) == self.window_length:
-            self.context.pop()
-
         self.context.append(word)
 
+    def _encode_word(self, word):
+        with self.metrics.timer("tokenize"):
+            return self.tokenizer.encode(word, add_special_tokens=False)
+
     def __str__(self):
-        return "XLNet"
+        if self.fast_tokenizer:
+            return f"XLNet({self.checkpoint}|fast)"
+        return f"XLNet({self.checkpoint})"
 
     def __call__(self):
-        if len(self.context) > 0:
-            inpt = self.tokenizer.encode(" ".join(self.context))
-        else:
-            inpt = self.tokenizer.encode("")
+        return self.get_vocabulary().to_ordered_dict(*self.top_k())
+
+    def top_k(self):
+        # The separator and classification tokens end the input, as with encode()
+        inpt = self.tokenizer.build_inputs_with_special_tokens(
+            self.context.get_token_ids()
+        )
 
-        with torch.no_grad():
-            inpt = torch.tensor([inpt])
+        with torch.no_grad(), self.metrics.timer("forward"):
+            inpt = torch.tensor([inpt]).to(self.device)
             outputs = self.model(inpt)
             loss = outputs[0][0, -1, :]
-            softmaxed = torch.softmax(loss, dim=0)
-            top_words = torch.topk(softmaxed, k=self.num_possibilities)
-            top_words_indices = top_words.indices
-            top_words_probabilities = top_words.values
-
-            result = OrderedDict()
-            for i in range(top_words_indices.shape[0]):
-                word = self.tokenizer.decode(torch.tensor([top_words_indices[i]]))
-                prob = top_words_probabilities[i].item()
-                result[word] = prob
-
-            return result
+
+        return self._get_top_k(loss)
+
+    def _get_top_k(self, logits):
+        """
+        @param logits: Tensor of next token scores over the vocabulary.
+        @returns (token_ids, probabilities) of the most likely tokens.
+        """
+        with self.metrics.timer("top_k"):
+            return get_top_k(logits, self.num_possibilities)
+
+    def get_vocabulary(self):
+        return get_vocabulary(self.tokenizer)
+
+    def get_precision(self):
+        return self.precision
+
+    def batch_call(self, contexts):
+        vocabulary = self.get_vocabulary()
+        return [
+            vocabulary.to_ordered_dict(token_ids, probabilities)
+            for token_ids, probabilities in self.batch_top_k(contexts)
+        ]
+
+    def batch_top_k(self, contexts):
+        if len(contexts) == 0:
+            return []
+
+        with self.metrics.timer("tokenize"):
+            inpts = [
+                self.tokenizer.encode(" ".join(context[-self.window_length:]))
+                for context in contexts
+            ]
+        with self.metrics.timer("forward"):
+            logits = get_batch_logits(
+                self.model,
+                self.device,
+                inpts,
+                self.tokenizer.pad_token_id,
+                position_ids=False,
+                metrics=self.metrics,
+            )
+        return [self._get_top_k(row) for row in logits]
 
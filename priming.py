@@ -0,0 +1,146 @@
+import json
+import struct
+import zlib
+from collections import Counter
+
+from dictionary import WordDictionary
+
+
+# Identifier of a priming dictionary in the stream header: the length of its
+# name, the name, then PRIMING_ID_FIELDS, its version and checksum.
+PRIMING_ID_FIELDS = struct.Struct(">HI")
+
+
+class PrimingDictionary:
+    """Named, versioned context shared by the compressor and the decompressor,
+    for documents too small to pay for their own initial context.
+
+    A primed protocol predicts the first word of a document from the seed
+    context, rather than storing the first context window of words raw, and
+    starts the dictionary of out of vocabulary words with the seed words, the
+    first one at the front, so that their first occurrence is already coded as
+    a reference. Streams record the name, version and checksum of the priming
+    dictionary, which must be the same when decompressing.
+
+    Usage sample:
+
+    priming = PrimingDictionary.load('priming/messages.json')
+
+    protocol = LMProtocol(GPT2Model, priming=priming)
+
+    compressed = protocol.compress('Thanks , see you tomorrow .')
+    """
+
+    def __init__(self, name, version, seed_context, out_of_vocabulary_words=()):
+        """
+        @param name: String name, of at most 255 UTF-8 bytes.
+        @param version: Int version, below 2 ** 16, to change when the content does.
+        @param seed_context: String canonical text preceding every document.
+        @param out_of_vocabulary_words: List<String> words expected out of the
+            model's vocabulary, the most frequent first.
+        """
+        if not 0 < len(name.encode("utf-8")) < 256:
+            raise ValueError("Priming dictionary names take 1 to 255 bytes.")
+        if not 0 <= version < 1 << 16:
+            raise ValueError(f"Priming dictionary version {version} out of range.")
+        if not seed_context.split():
+            raise ValueError("The seed context of a priming dictionary is empty.")
+        self.name = name
+        self.version = version
+        self.seed_context = " ".join(seed_context.split())
+        self.out_of_vocabulary_words = list(out_of_vocabulary_words)
+        self.checksum = zlib.crc32(
+            json.dumps([self.seed_context, self.out_of_vocabulary_words]).encode(
+                "utf-8"
+            )
+        )
+        self._dictionary = None
+
+    def __str__(self):
+        return f"{self.name} version {self.version}"
+
+    def get_id(self):
+        """
+        @returns (name, version, checksum) recorded in the header of the streams.
+        """
+        return self.name, self.version, self.checksum
+
+    def pack_id(self):
+        """
+        @returns bytes of the identifier in the stream header.
+        """
+        name = self.name.encode("utf-8")
+        return (
+            bytes([len(name)])
+            + name
+            + PRIMING_ID_FIELDS.pack(self.version, self.checksum)
+        )
+
+    def get_context(self, context_window_length):
+        """
+        @returns List<String> last words of the seed context, the context the
+            first word of a document is predicted from.
+        """
+        if context_window_length == 0:
+            return []
+        return self.seed_context.split()[-context_window_length:]
+
+    def get_dictionary(self):
+        """
+        @returns WordDictionary of the out of vocabulary words, a copy that can be
+            updated as a document is coded.
+        """
+        if self._dictionary is None:
+            self._dictionary = WordDictionary(reversed(self.out_of_vocabulary_words))
+        return self._dictionary.copy()
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "version": self.version,
+            "seed_context": self.seed_context,
+            "out_of_vocabulary_words": self.out_of_vocabulary_words,
+        }
+
+    def save(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        @param filename: String path of a JSON file written by save.
+        """
+        with open(filename, "r") as f:
+            return cls(**json.load(f))
+
+    @classmethod
+    def build(
+        cls,
+        name,
+        version,
+        seed_context,
+        texts,
+        vocabulary,
+        max_out_of_vocabulary_words=1024,
+        min_count=2,
+    ):
+        """
+        Collects the out of vocabulary words of a sample of documents.
+        @param texts: Iterable<String> documents representative of those to compress.
+        @param vocabulary: Vocabulary of the model, see ILanguageModel.get_vocabulary.
+        @param max_out_of_vocabulary_words: Int maximum number of words kept.
+        @param min_count: Int number of occurrences below which words are left out.
+        """
+        counts = Counter(word for text in texts for word in text.split())
+        out_of_vocabulary_words = [
+            word
+            for word, count in counts.most_common()
+            if count >= min_count and vocabulary.get_ids(word) is None
+        ]
+        return cls(
+            name,
+            version,
+            seed_context,
+            out_of_vocabulary_words[:max_out_of_vocabulary_words],
+        )
@@ -0,0 +1,299 @@
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from LMProtocol import FLAG_LOCKSTEP
+
+
+class BatchScheduler:
+    """Coalesces the next word predictions of concurrent jobs into batches.
+
+    Jobs await predict with their context and the scheduler gives the
+    contexts waiting together to one batch_top_k call of the model. A batch
+    is run as soon as it holds max_batch_size contexts, as soon as every
+    running job is waiting for a prediction, since no other context could join
+    it, or once its oldest context has waited max_wait seconds. Model calls
+    are made one at a time on a single thread, the event loop staying free to
+    code the words of the other jobs.
+
+    Usage sample:
+
+    scheduler = BatchScheduler(protocol.lm, max_batch_size=32, max_wait=0.002)
+
+    scheduler.start()
+
+    with scheduler.job():
+        prediction = await scheduler.predict(context)
+
+    await scheduler.stop()
+    """
+
+    def __init__(self, lm, max_batch_size=32, max_wait=0.002, metrics=None):
+        """
+        @param lm: ILanguageModel answering batch_top_k.
+        @param max_batch_size: Int maximum number of contexts per model call.
+        @param max_wait: Float maximum seconds a context waits for others to join
+            its batch.
+        @param metrics: models.instrumentation.Metrics counting the batches, and
+            timing how long the predictions wait, or None.
+        """
+        assert max_batch_size > 0
+        assert max_wait >= 0
+        self.lm = lm
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.metrics = metrics if metrics is not None else lm.metrics
+        # Single thread running every model call
+        self.executor = None
+        # (context, future, enqueue time) of the predictions not in a batch yet
+        self._pending = collections.deque()
+        self._jobs_number = 0
+        self._wakeup = None
+        self._task = None
+        # Task of the batch being predicted, see stop
+        self._running_batch = None
+
+    def start(self):
+        """
+        Starts the scheduling task on the running event loop.
+        """
+        if self._task is not None:
+            raise RuntimeError("Scheduler already started.")
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Fails the pending predictions and waits for the running batch to end.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # The running batch is shielded from the cancellation and still resolves
+        # the futures of its predictions
+        if self._running_batch is not None:
+            await self._running_batch
+            self._running_batch = None
+        while self._pending:
+            _, future, _ = self._pending.popleft()
+            if not future.done():
+                future.set_exception(RuntimeError("Scheduler stopped."))
+        self.executor.shutdown(wait=True)
+
+    def job(self):
+        """
+        @returns context manager marking a job as running, so that batches do not
+            wait for the predictions of jobs that ended.
+        """
+        return _Job(self)
+
+    async def predict(self, context):
+        """
+        @param context: List<String> words the next word is predicted from. It must
+            not change until the prediction is returned.
+        @returns (token_ids, probabilities) of lm.batch_top_k.
+        """
+        if self._task is None:
+            raise RuntimeError("Scheduler not started.")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((context, future, loop.time()))
+        self._wakeup.set()
+        return await future
+
+    async def call(self, function, *args):
+        """
+        Runs a function using the model on the model thread, between batches.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            deadline = self._pending[0][2] + self.max_wait
+            while not self._is_batch_ready() and loop.time() < deadline:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), deadline - loop.time()
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            batch = [
+                self._pending.popleft()
+                for _ in range(min(self.max_batch_size, len(self._pending)))
+            ]
+            self._running_batch = loop.create_task(self._run_batch(batch))
+            await asyncio.shield(self._running_batch)
+            self._running_batch = None
+
+    def _is_batch_ready(self):
+        return (
+            len(self._pending) >= self.max_batch_size
+            or len(self._pending) >= self._jobs_number
+        )
+
+    async def _run_batch(self, batch):
+        if self.metrics.enabled:
+            now = asyncio.get_running_loop().time()
+            for _, _, enqueue_time in batch:
+                self.metrics.add_time("queue", now - enqueue_time)
+        self.metrics.count("batches")
+        self.metrics.count("batched_predictions", len(batch))
+
+        contexts = [list(context) for context, _, _ in batch]
+        try:
+            predictions = await self.call(self._batch_top_k, contexts)
+        except Exception as exception:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(exception)
+            return
+
+        for (_, future, _), prediction in zip(batch, predictions):
+            # Jobs cancelled while waiting no longer want their prediction
+            if not future.done():
+                future.set_result(prediction)
+
+    def _batch_top_k(self, contexts):
+        with self.metrics.timer("predict"):
+            return self.lm.batch_top_k(contexts)
+
+
+class _Job:
+    __slots__ = ("scheduler",)
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    def __enter__(self):
+        self.scheduler._jobs_number += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.scheduler._jobs_number -= 1
+        # The remaining jobs may all be waiting
+        if self.scheduler._wakeup is not None:
+            self.scheduler._wakeup.set()
+        return False
+
+
+class CompressionService:
+    """Asynchronous front-end compressing and decompressing concurrent jobs with
+    one shared model.
+
+    Each job keeps its own context window and coder state, the model only
+    holding weights, and the next word predictions of all the running jobs are
+    batched by a BatchScheduler. Jobs are coded as in LMProtocol.compress_many:
+    every prediction comes from batch_top_k on the last window of words, so the
+    streams can also be decompressed with decompress_many. Models pad each
+    context to a length that only depends on its own, see
+    models.batching.group_by_bucket, and rank predictions canonically, see
+    models.inference.get_canonical_top_k, which absorbs the last bit
+    differences kernels may make for other batch sizes. LMProtocol.verify
+    checks rankings against a reference configuration. At int8 precision
+    activations are quantized with a scale shared by the whole batch, so int8
+    models are not served.
+
+    Streams that were not compressed in lockstep are decompressed by the
+    protocol itself, on the model thread between two batches.
+
+    Usage sample:
+
+    protocol = LMProtocol(GPT2Model, coding="arithmetic")
+
+    async with CompressionService(protocol, max_batch_size=32) as service:
+        compressed = await service.compress(text)
+        text = await service.decompress(compressed)
+    """
+
+    def __init__(self, protocol, max_batch_size=32, max_wait=0.002):
+        """
+        @param protocol: LMProtocol coding the jobs, compressing words, with a
+            model not at int8 precision.
+        @param max_batch_size: Int maximum number of contexts per model call.
+        @param max_wait: Float maximum seconds a prediction waits for others to
+            join its batch. Larger waits make fuller batches when jobs arrive
+            steadily, smaller ones shorten each word's latency.
+        """
+        if protocol.lm.get_precision() == "int8":
+            raise ValueError("Batched predictions do not reproduce at int8 precision.")
+        self.protocol = protocol
+        self.scheduler = BatchScheduler(
+            protocol.lm, max_batch_size, max_wait, protocol.metrics
+        )
+
+    async def __aenter__(self):
+        self.scheduler.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.scheduler.stop()
+        return False
+
+    async def compress(self, text):
+        """
+        @param text: String to compress, longer than the context window.
+        @returns binary string, compressed in lockstep.
+        """
+        stream = self.protocol._open_lockstep_compression(text)
+        with self.scheduler.job():
+            for step in range(len(stream["words"])):
+                prediction = await self.scheduler.predict(stream["context"])
+                self.protocol._code_lockstep_word(stream, step, prediction)
+        return self.protocol._close_lockstep_compression(stream)
+
+    async def decompress(self, compressed_binary):
+        """
+        @param compressed_binary: binary string produced by the protocol.
+        @returns original string
+        """
+        _, flags, _ = self.protocol._read_header(compressed_binary)
+        if not flags & FLAG_LOCKSTEP:
+            return await self.scheduler.call(
+                self.protocol.decompress, compressed_binary
+            )
+
+        stream = self.protocol._open_lockstep_decompression(compressed_binary)
+        with self.scheduler.job():
+            for step in range(len(stream["words"])):
+                prediction = await self.scheduler.predict(stream["context"])
+                self.protocol._decode_lockstep_word(stream, step, prediction)
+        return self.protocol._close_lockstep_decompression(stream)
+
+    def stats(self):
+        """
+        @returns Dict: batches, Int number of model calls, mean_batch_size,
+            mean_forward_batch_size, Float mean number of contexts per forward
+            pass of the models splitting batches by context length, see
+            models.batching.get_batch_logits, or None without such models, and
+            mean_queue_time, Float seconds a prediction waited for its batch.
+        """
+        metrics = self.protocol.metrics
+        batches = metrics.counters["batches"]
+        predictions = metrics.counters["batched_predictions"]
+        forward_batches = metrics.counters["forward_batches"]
+        return {
+            "batches": batches,
+            "mean_batch_size": predictions / batches if batches else 0.0,
+            "mean_forward_batch_size": metrics.counters["forward_batch_rows"]
+            / forward_batches
+            if forward_batches
+            else None,
+            "mean_queue_time": metrics.seconds["queue"] / predictions
+            if predictions
+            else 0.0,
+        }
@@ -0,0 +1,98 @@
+import zlib
+
+
+def iter_source(source, buffer_size):
+    """
+    Yields the successive buffers of a file object or an iterator of strings/bytes.
+    @param source: Object with a read method, or an iterable.
+    @param buffer_size: Int maximum size of each read from a file object.
+    """
+    if hasattr(source, "read"):
+        while True:
+            data = source.read(buffer_size)
+            if not data:
+                return
+            yield data
+    else:
+        for data in source:
+            if data:
+                yield data
+
+
+def iter_words(source, buffer_size=1 << 16):
+    """
+    Yields the whitespace-separated words of a text source, holding at most one
+    buffer and one partial word in memory.
+    @param source: Text file object, or an iterable of strings.
+    """
+    partial_word = ""
+    for data in iter_source(source, buffer_size):
+        words = (partial_word + data).split()
+        # A buffer that does not end with whitespace may end inside a word
+        if words and not data[-1].isspace():
+            partial_word = words.pop()
+        else:
+            partial_word = ""
+        yield from words
+    if partial_word:
+        yield partial_word
+
+
+class ByteReader:
+    """Reads exact amounts of bytes from a binary file object or an iterable of bytes."""
+
+    def __init__(self, source, buffer_size=1 << 16):
+        self._buffers = iter_source(source, buffer_size)
+        self._buffer = b""
+
+    def read(self, size):
+        """
+        @returns bytes of length size.
+        @raises EOFError if the source ends first.
+        """
+        while len(self._buffer) < size:
+            data = next(self._buffers, None)
+            if data is None:
+                raise EOFError("Unexpected end of compressed stream.")
+            self._buffer += data
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def read_rest(self):
+        """
+        Yields the remaining buffers.
+        """
+        if self._buffer:
+            yield self._buffer
+            self._buffer = b""
+        yield from self._buffers
+
+
+class ZlibReader:
+    """Reads exact amounts of decompressed bytes from a zlib stream given as buffers."""
+
+    def __init__(self, buffers, wbits=zlib.MAX_WBITS):
+        """
+        @param wbits: Int window size of zlib.decompressobj, negative to read raw
+            deflate data, e.g. from a full flush point of a zlib stream.
+        """
+        self._buffers = iter(buffers)
+        self._decompressor = zlib.decompressobj(wbits)
+        self._buffer = bytearray()
+
+    def read(self, size):
+        """
+        @returns bytes of length size.
+        @raises EOFError if the stream ends first.
+        """
+        while len(self._buffer) < size:
+            data = next(self._buffers, None)
+            if data is None:
+                self._buffer.extend(self._decompressor.flush())
+                if len(self._buffer) < size:
+                    raise EOFError("Unexpected end of compressed stream.")
+                break
+            self._buffer.extend(self._decompressor.decompress(data))
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
@@ -0,0 +1,53 @@
+import json
+import os
+import sys
+
+import pytest
+
+# The modules of the repository are imported from its root, as by main.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def text():
+    """
+    @returns String of the first words of the sample corpus, with its out of
+        vocabulary words, numbers and punctuation.
+    """
+    with open(os.path.join(ROOT, "data", "sample.txt"), "r") as f:
+        return " ".join(f.read().split()[:400])
+
+
+@pytest.fixture(scope="session")
+def gpt2_checkpoint(tmp_path_factory):
+    """
+    @returns String directory of a small GPT-2 with random weights and a
+        byte-level tokenizer without merges, or skips without transformers.
+    """
+    tfms = pytest.importorskip("transformers")
+    import torch
+    from transformers.tokenization_gpt2 import bytes_to_unicode
+
+    directory = tmp_path_factory.mktemp("gpt2")
+    vocabulary = {character: byte for byte, character in bytes_to_unicode().items()}
+    vocabulary["<|endoftext|>"] = len(vocabulary)
+    with open(directory / "vocab.json", "w") as f:
+        json.dump(vocabulary, f)
+    with open(directory / "merges.txt", "w") as f:
+        f.write("#version: 0.2\n")
+
+    torch.manual_seed(0)
+    config = tfms.GPT2Config(
+        vocab_size=len(vocabulary),
+        n_positions=64,
+        n_ctx=64,
+        n_embd=16,
+        n_layer=2,
+        n_head=2,
+    )
+    tfms.GPT2LMHeadModel(config).save_pretrained(str(directory))
+    tfms.GPT2Tokenizer(
+        str(directory / "vocab.json"), str(directory / "merges.txt")
+    ).save_pretrained(str(directory))
+    return str(directory)
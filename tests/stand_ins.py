@@ -0,0 +1,40 @@
+from models.stand_in import StandInModel
+
+
+class Int8StandInModel(StandInModel):
+    """Stand-in model reporting int8 precision, for the checks made on it."""
+
+    def get_precision(self):
+        return "int8"
+
+
+class ByteStandInModel(StandInModel):
+    """Stand-in model over the UTF-8 bytes of a text, implementing the token
+    methods. The context holds the character of each byte."""
+
+    def __init__(
+        self,
+        context_window_length=16,
+        next_word_possibilities_number=16,
+        initial_context=None,
+        latency=0.0,
+    ):
+        super().__init__(
+            context_window_length,
+            next_word_possibilities_number,
+            initial_context,
+            words=[chr(byte) for byte in range(256)],
+            latency=latency,
+        )
+
+    def encode_text(self, text):
+        return list(text.encode("utf-8"))
+
+    def decode_tokens(self, token_ids):
+        return bytes(token_ids).decode("utf-8")
+
+    def reset_tokens(self, token_ids):
+        self.context.reset([chr(token_id) for token_id in token_ids])
+
+    def add_token_to_context(self, token_id):
+        self.context.append(chr(token_id))
@@ -0,0 +1,71 @@
+import random
+
+from arithmetic_coding import (
+    ArithmeticDecoder,
+    ArithmeticEncoder,
+    LiteralModel,
+    RankModel,
+    get_cumulative_frequencies,
+    read_uint,
+    write_uint,
+)
+
+
+def test_symbols_round_trip():
+    generator = random.Random(0)
+    probabilities = [0.5, 0.25, 0.125, 0.0625, 0.0001]
+    cumulative_frequencies = get_cumulative_frequencies(probabilities)
+    symbols = [generator.randrange(len(probabilities) + 1) for _ in range(1000)]
+
+    encoder = ArithmeticEncoder()
+    for symbol in symbols:
+        encoder.write(cumulative_frequencies, symbol)
+    write_uint(encoder, 123456, 3)
+    encoder.finish()
+
+    decoder = ArithmeticDecoder(encoder.tobytes())
+    assert [decoder.read(cumulative_frequencies) for _ in symbols] == symbols
+    assert read_uint(decoder, 3) == 123456
+
+
+def test_every_symbol_has_a_frequency():
+    cumulative_frequencies = get_cumulative_frequencies([1.0, 0.0, 0.0])
+    frequencies = [
+        high - low
+        for low, high in zip(cumulative_frequencies, cumulative_frequencies[1:])
+    ]
+    assert len(frequencies) == 4 and min(frequencies) > 0
+
+
+def test_literal_model_round_trip():
+    words = ["Euler", "Gauss", "Euler", "Noether", "Gauss", "Gauss", "é"]
+    encoder = ArithmeticEncoder()
+    literal_model = LiteralModel()
+    literal_model.write(encoder, "initial context")
+    for word in words:
+        literal_model.write_word(encoder, word)
+    encoder.finish()
+
+    decoder = ArithmeticDecoder(encoder.tobytes())
+    literal_model = LiteralModel()
+    assert literal_model.read(decoder) == "initial context"
+    assert [literal_model.read_word(decoder) for _ in words] == words
+
+
+def test_rank_model_round_trip_and_adapts():
+    symbols = [0] * 50 + [3, 16, 0, 15]
+    encoder = ArithmeticEncoder()
+    rank_model = RankModel(16)
+    for symbol in symbols:
+        encoder.write(rank_model.get_cumulative_frequencies(), symbol)
+        rank_model.update(symbol)
+    encoder.finish()
+    assert rank_model.counts[0] > RankModel(16).counts[0]
+
+    decoder = ArithmeticDecoder(encoder.tobytes())
+    rank_model = RankModel(16)
+    decoded = []
+    for _ in symbols:
+        decoded.append(decoder.read(rank_model.get_cumulative_frequencies()))
+        rank_model.update(decoded[-1])
+    assert decoded == symbols
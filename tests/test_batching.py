@@ -0,0 +1,62 @@
+import pytest
+import torch
+
+from LMProtocol import LMProtocol
+from models.batching import get_span_logits, group_by_bucket, pad_batch, pad_span
+from stand_ins import Int8StandInModel
+
+
+class CausalModel(torch.nn.Module):
+    """Causal model whose output at a position averages the embeddings of the
+    positions up to it."""
+
+    def __init__(self, vocabulary_size=20):
+        super().__init__()
+        generator = torch.Generator().manual_seed(0)
+        self.embedding = torch.nn.Embedding(vocabulary_size, 8)
+        self.output = torch.nn.Linear(8, vocabulary_size)
+        with torch.no_grad():
+            for parameter in self.parameters():
+                parameter.copy_(torch.randn(parameter.shape, generator=generator))
+
+    def forward(self, input_ids):
+        embeddings = self.embedding(input_ids).cumsum(dim=1)
+        positions = torch.arange(1, input_ids.shape[1] + 1).unsqueeze(1)
+        return (self.output(embeddings / positions),)
+
+
+def test_pad_batch_left_pads():
+    input_ids, attention_mask, position_ids = pad_batch([[5, 6, 7], [8]], 0, 4)
+    assert input_ids.tolist() == [[0, 5, 6, 7], [0, 0, 0, 8]]
+    assert attention_mask.tolist() == [[0, 1, 1, 1], [0, 0, 0, 1]]
+    assert position_ids.tolist() == [[0, 0, 1, 2], [0, 0, 0, 0]]
+
+
+def test_group_by_bucket():
+    sequences = [[5, 6, 7], [8] * 9, [1, 2, 3, 4], [9] * 16]
+    assert group_by_bucket(sequences, 8) == {8: [0, 2], 16: [1, 3]}
+
+
+def test_pad_span_positions():
+    input_ids, positions = pad_span([[1], [2, 3], [4], [5, 6]], 2, length=8)
+    assert input_ids.tolist() == [[1, 2, 3, 4, 5, 6, 0, 0]]
+    # Last token of the context, then of each span unit
+    assert positions == [2, 3, 5]
+    with pytest.raises(ValueError):
+        pad_span([[1, 2, 3]], 1, length=2)
+
+
+def test_span_logits_do_not_depend_on_the_rest_of_the_span():
+    model = CausalModel()
+    units = [[1, 2], [3], [4, 5], [6], [7]]
+    device = torch.device("cpu")
+    logits = get_span_logits(model, device, units, 2, length=10)
+    assert logits.shape[0] == 4
+    for end in range(2, len(units) + 1):
+        last = get_span_logits(model, device, units[:end], 2, 10, last_only=True)
+        assert torch.equal(last[0], logits[end - 2])
+
+
+def test_spans_are_rejected_at_int8():
+    with pytest.raises(ValueError):
+        LMProtocol(Int8StandInModel, span_words_number=8)
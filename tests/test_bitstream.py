@@ -0,0 +1,70 @@
+import random
+
+import numpy as np
+import pytest
+from bitarray import bitarray
+
+import bitstream
+from bitstream import BitReader, get_gamma_widths, pack_fields
+
+
+def _pack_reference(values, widths):
+    bits = "".join(
+        format(int(value), f"0{width}b") if width else ""
+        for value, width in zip(values, widths)
+    )
+    return bitarray(bits).tobytes(), len(bits)
+
+
+def test_pack_fields_matches_bit_strings():
+    generator = random.Random(0)
+    for _ in range(200):
+        widths = [generator.randrange(65) for _ in range(generator.randrange(100))]
+        values = [generator.getrandbits(width) if width else 0 for width in widths]
+        assert pack_fields(np.array(values, dtype=np.uint64), widths) == (
+            _pack_reference(values, widths)
+        )
+
+
+def test_pack_fields_full_width_values_across_blocks(monkeypatch):
+    monkeypatch.setattr(bitstream, "PACK_BLOCK_SIZE", 3)
+    widths = [64, 1, 64, 0, 63, 64, 7]
+    values = [(1 << width) - 1 for width in widths]
+    assert pack_fields(np.array(values, dtype=np.uint64), widths) == (
+        _pack_reference(values, widths)
+    )
+
+
+def test_pack_fields_empty():
+    assert pack_fields([], []) == (b"", 0)
+    assert pack_fields([0], [0]) == (b"", 0)
+
+
+def test_gamma_widths():
+    assert get_gamma_widths([1, 2, 3, 4, 255, 256]).tolist() == [1, 2, 2, 3, 8, 9]
+
+
+def test_bit_reader_reads_packed_fields():
+    values = [1, 5, 0, 300, 2 ** 40 + 3]
+    widths = [1, 3, 2, 9, 41]
+    binary, _ = pack_fields(values, widths)
+    reader = BitReader(binary)
+    assert [reader.read_uint(width) for width in widths] == values
+    assert reader.remaining() == len(binary) * 8 - sum(widths)
+
+
+def test_bit_reader_gamma_and_bytes():
+    # Elias-gamma codes of 1, 2 and 5, then two unaligned bytes
+    binary, _ = pack_fields(
+        [1, 0, 2, 0, 5, ord("h"), ord("i")], [1, 1, 2, 2, 3, 8, 8]
+    )
+    reader = BitReader(binary)
+    assert [reader.read_gamma() for _ in range(3)] == [1, 2, 5]
+    assert reader.read_bytes(16) == b"hi"
+
+
+def test_bit_reader_raises_past_the_end():
+    reader = BitReader(b"\x00")
+    reader.read_uint(8)
+    with pytest.raises(EOFError):
+        reader.read_bit()
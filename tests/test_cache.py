@@ -0,0 +1,60 @@
+import torch
+
+from LMProtocol import LMProtocol
+from models.cache import CachedLanguageModel, PredictionCache
+from models.stand_in import StandInModel
+from stand_ins import Int8StandInModel
+
+
+def _get_prediction(i):
+    return torch.tensor([i]), torch.tensor([1.0])
+
+
+def test_lru_evicts_the_least_recently_used():
+    cache = PredictionCache(max_entries=2, policy="lru")
+    cache.put("a", _get_prediction(0))
+    cache.put("b", _get_prediction(1))
+    cache.get("a")
+    cache.put("c", _get_prediction(2))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lfu_evicts_the_least_frequently_used():
+    cache = PredictionCache(max_entries=2, policy="lfu")
+    cache.put("a", _get_prediction(0))
+    cache.put("b", _get_prediction(1))
+    cache.get("a")
+    cache.get("a")
+    cache.put("c", _get_prediction(2))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_memory_bound():
+    cache = PredictionCache(max_entries=None, max_memory=1000)
+    for i in range(100):
+        cache.put(("context", i), _get_prediction(i))
+    assert 0 < cache.memory <= 1000 and len(cache) < 100
+
+
+def test_models_of_other_precisions_do_not_share_predictions():
+    cache = PredictionCache()
+    models = [
+        CachedLanguageModel(StandInModel(initial_context=["a", "b"]), cache),
+        CachedLanguageModel(Int8StandInModel(initial_context=["a", "b"]), cache),
+    ]
+    for lm in models:
+        lm.top_k()
+    assert len(cache) == 2 and cache.hits == 0
+
+
+def test_round_trip_through_a_shared_cache(text):
+    cache = PredictionCache(max_entries=1024)
+    compressor = LMProtocol(StandInModel, coding="arithmetic", prediction_cache=cache)
+    decompressor = LMProtocol(
+        StandInModel, coding="arithmetic", prediction_cache=cache
+    )
+    assert decompressor.decompress(compressor.compress(text)) == text
+    assert cache.hits > 0
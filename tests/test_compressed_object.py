@@ -0,0 +1,39 @@
+import math
+
+from bitstream import BitReader, pack_fields
+from compressed_object import CompressedObject
+from dictionary import WordDictionary
+
+
+def _get_records():
+    return [(False, 3), (True, "Euler"), (False, 0), (True, "Gauss"), (True, "Euler")]
+
+
+def test_records_round_trip():
+    compressed_object = CompressedObject("Hello world")
+    compressed_object.extend(_get_records())
+    assert len(compressed_object) == 5
+    assert list(compressed_object) == _get_records()
+    assert compressed_object[3] == (True, "Gauss")
+
+
+def test_fields_reference_repeated_literals():
+    compressed_object = CompressedObject()
+    compressed_object.extend(_get_records())
+    dictionary = WordDictionary()
+    values, widths = compressed_object.get_fields(
+        ranking_size=int(math.log2(16)), dictionary=dictionary
+    )
+    assert [dictionary[i] for i in range(len(dictionary))] == ["Euler", "Gauss"]
+
+    reader = BitReader(pack_fields(values, widths)[0])
+    # Flag and ranking
+    assert (reader.read_bit(), reader.read_uint(4)) == (False, 3)
+    # Flag, reference 0 to a new word, its length and bytes
+    assert reader.read_bit() and reader.read_gamma() == 1
+    assert reader.read_bytes(reader.read_gamma() * 8) == b"Euler"
+    assert (reader.read_bit(), reader.read_uint(4)) == (False, 0)
+    assert reader.read_bit() and reader.read_gamma() == 1
+    assert reader.read_bytes(reader.read_gamma() * 8) == b"Gauss"
+    # Euler is second in the dictionary, reference 2
+    assert reader.read_bit() and reader.read_gamma() == 3
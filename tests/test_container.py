@@ -0,0 +1,42 @@
+import pytest
+
+from container import (
+    get_chunk,
+    is_container,
+    pack_chunks,
+    read_index,
+    split_text,
+    split_words,
+)
+
+
+def test_pack_and_read_chunks():
+    chunks = [b"first", b"", b"third chunk"]
+    blob = pack_chunks(chunks, [3, 0, 7])
+    assert is_container(blob)
+    index = read_index(blob)
+    assert [entry.words_number for entry in index] == [3, 0, 7]
+    assert [get_chunk(blob, i) for i in range(3)] == chunks
+    assert get_chunk(blob, 2, index) == b"third chunk"
+
+
+def test_read_index_rejects_other_data():
+    with pytest.raises(ValueError):
+        read_index(b"NC\x05" + bytes(16))
+
+
+def test_split_words_merges_short_last_chunk():
+    words = [str(i) for i in range(10)]
+    assert split_words(words, 4, 1) == [words[:4], words[4:8], words[8:]]
+    assert split_words(words, 4, 2) == [words[:4], words[4:]]
+
+
+def test_split_text_keeps_whitespace():
+    text = "  one two\nthree   four five\tsix "
+    pieces = split_text(text, 2, 0)
+    assert "".join(pieces) == text
+    assert [piece.split() for piece in pieces] == [
+        ["one", "two"],
+        ["three", "four"],
+        ["five", "six"],
+    ]
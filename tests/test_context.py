@@ -0,0 +1,80 @@
+import torch
+
+from LMProtocol import LMProtocol
+from models.context import ContextWindow
+from models.stand_in import StandInModel
+
+
+class TrigramModel(StandInModel):
+    """Stand-in model predicting the word that followed the last two words of
+    its context in a reference text, as a well trained model would."""
+
+    def __init__(self, text="", **kwargs):
+        words = text.split()
+        super().__init__(words=sorted(set(words)), **kwargs)
+        self._ids = {word: i for i, word in enumerate(self.vocabulary.words)}
+        self._successors = {
+            (first, second): third
+            for first, second, third in zip(words, words[1:], words[2:])
+        }
+
+    def _get_logits(self, context):
+        logits = torch.zeros(len(self.vocabulary))
+        successor = self._successors.get(tuple(context[-2:]))
+        if successor is not None:
+            logits[self._ids[successor]] = 10.0
+        return logits
+
+
+class NewestEvictingTrigramModel(TrigramModel):
+    """The context of the transformer wrappers before ContextWindow: once the
+    window was full, adding a word dropped the newest one, freezing the context
+    as the initial words and the last one."""
+
+    def add_word_to_context(self, word):
+        words = list(self.context)
+        if len(words) == self.window_length:
+            words.pop()
+        self.context.reset(words + [word])
+
+
+def test_append_evicts_the_oldest_word():
+    context = ContextWindow(3, ["a", "b"])
+    context.append("c")
+    context.append("d")
+    assert list(context) == ["b", "c", "d"]
+    assert context.is_full()
+
+
+def test_reset_copies_the_words():
+    words = ["a", "b", "c", "d"]
+    context = ContextWindow(3)
+    context.reset(words)
+    words.append("e")
+    assert list(context) == ["b", "c", "d"]
+
+
+def test_token_ids_are_cached_per_word():
+    encoded = []
+
+    def encode(word):
+        encoded.append(word)
+        return [len(word), 0]
+
+    context = ContextWindow(2, ["a", "bb"], encode=encode)
+    assert context.get_token_ids() == [1, 0, 2, 0]
+    context.append("ccc")
+    assert context.get_item_token_ids() == [[2, 0], [3, 0]]
+    assert context.get_token_ids() == [2, 0, 3, 0]
+    assert encoded == ["a", "bb", "ccc"]
+
+
+def test_oldest_word_eviction_improves_compression(text):
+    kwargs = {"context_window_length": 4, "language_model_kwargs": {"text": text}}
+    protocol = LMProtocol(TrigramModel, **kwargs)
+    newest_evicting_protocol = LMProtocol(NewestEvictingTrigramModel, **kwargs)
+
+    compressed = protocol.compress(text)
+    newest_evicting_compressed = newest_evicting_protocol.compress(text)
+    assert protocol.decompress(compressed) == text
+    assert len(compressed) * 10 < len(newest_evicting_compressed)
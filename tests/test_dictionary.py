@@ -0,0 +1,36 @@
+import random
+
+from dictionary import WordDictionary
+
+
+def test_move_to_front_order():
+    dictionary = WordDictionary(["a", "b", "c"])
+    assert [dictionary[i] for i in range(3)] == ["c", "b", "a"]
+    assert dictionary.get_index("a") == 2
+    dictionary.use("a")
+    assert [dictionary[i] for i in range(3)] == ["a", "c", "b"]
+    assert dictionary.get_index("z") is None
+    assert "b" in dictionary and len(dictionary) == 3
+
+
+def test_matches_a_list_through_compactions():
+    generator = random.Random(0)
+    dictionary = WordDictionary()
+    table = []
+    for _ in range(2000):
+        word = f"w{generator.randrange(40)}"
+        index = dictionary.get_index(word)
+        assert index == (table.index(word) if word in table else None)
+        dictionary.use(word)
+        if word in table:
+            table.remove(word)
+        table.insert(0, word)
+    assert [dictionary[i] for i in range(len(table))] == table
+
+
+def test_copy_is_independent():
+    dictionary = WordDictionary(["a", "b"])
+    copy = dictionary.copy()
+    copy.use("c")
+    assert len(dictionary) == 2 and len(copy) == 3
+    assert dictionary[0] == "b" and copy[0] == "c"
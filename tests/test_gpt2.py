@@ -0,0 +1,196 @@
+import pytest
+import torch
+
+from LMProtocol import CODINGS, LMProtocol
+from models.cache import PredictionCache
+from models.cascade import CascadeLanguageModel
+from models.instrumentation import Metrics
+from models.registry import ModelRegistry, default_registry
+
+tfms = pytest.importorskip("transformers")
+
+from models.gpt2 import GPT2Model  # noqa: E402
+
+
+SHORT_WORDS = "a be cat do ear fig go hat ink jam kit log map nut".split()
+LONG_WORDS = "absent bridge cactus dimple escort fabric goblet hamlet".split()
+
+
+def get_model(checkpoint, context_window_length, **kwargs):
+    lm = GPT2Model(
+        context_window_length=context_window_length,
+        checkpoint=checkpoint,
+        device="cpu",
+        **kwargs,
+    )
+    lm.set_metrics(Metrics())
+    return lm
+
+
+@pytest.mark.parametrize(
+    "context_window_length, words",
+    [
+        # The cache is rebuilt once it spans twice the window
+        (4, SHORT_WORDS * 3),
+        # The cache is rebuilt once it exceeds the 64 positions of the model
+        (8, LONG_WORDS * 3),
+    ],
+)
+def test_incremental_predictions_after_a_cache_rebuild(
+    gpt2_checkpoint, context_window_length, words
+):
+    incremental = get_model(gpt2_checkpoint, context_window_length, incremental=True)
+    full = get_model(gpt2_checkpoint, context_window_length)
+    incremental.reset(words[:2])
+    full.reset(words[:2])
+
+    rebuilds = 0
+    for word in words[2:]:
+        cached_units_number = len(incremental._units)
+        incremental.add_word_to_context(word)
+        full.add_word_to_context(word)
+        if len(incremental._units) <= cached_units_number:
+            # The rebuilt cache holds the same window as the full model input
+            rebuilds += 1
+            assert incremental._units == full.context.get_item_token_ids()
+            token_ids, probabilities = incremental.top_k()
+            full_token_ids, full_probabilities = full.top_k()
+            assert torch.equal(token_ids, full_token_ids)
+            assert torch.equal(probabilities, full_probabilities)
+    assert rebuilds >= 2
+
+
+def test_an_empty_registry_is_used(gpt2_checkpoint):
+    registry = ModelRegistry(max_models=1)
+    assert len(registry) == 0
+    default_models_number = len(default_registry)
+    lm = get_model(gpt2_checkpoint, 4, registry=registry)
+    assert len(registry) == 1
+    assert len(default_registry) == default_models_number
+    assert registry.get(
+        tfms.GPT2LMHeadModel, tfms.GPT2Tokenizer, gpt2_checkpoint, device=lm.device
+    ) == (lm.model, lm.tokenizer)
+
+
+def test_batch_predictions_do_not_depend_on_batch_partners(gpt2_checkpoint):
+    lm = get_model(gpt2_checkpoint, 4)
+    contexts = [SHORT_WORDS[i : i + 4] for i in range(8)] + [LONG_WORDS[:4]]
+    predictions = lm.batch_top_k(contexts)
+    counters = lm.metrics.counters
+    # Contexts of similar lengths share a forward pass
+    assert counters["forward_batch_rows"] == len(contexts)
+    assert counters["forward_batches"] < len(contexts) / 2
+    for context, (token_ids, probabilities) in zip(contexts, predictions):
+        [(alone_token_ids, alone_probabilities)] = lm.batch_top_k([context])
+        assert torch.equal(token_ids, alone_token_ids)
+        assert torch.equal(probabilities, alone_probabilities)
+
+
+def test_incremental_token_predictions_after_a_cache_rebuild(gpt2_checkpoint):
+    incremental = get_model(gpt2_checkpoint, 8, incremental=True)
+    full = get_model(gpt2_checkpoint, 8)
+    token_ids = incremental.encode_text(" ".join(SHORT_WORDS))
+    incremental.reset_tokens([])
+    full.reset_tokens([])
+
+    rebuilds = 0
+    for token_id in token_ids:
+        cached_units_number = len(incremental._units)
+        incremental.add_token_to_context(token_id)
+        full.add_token_to_context(token_id)
+        if len(incremental._units) <= cached_units_number:
+            rebuilds += 1
+            assert incremental._units == full.token_context.get_item_token_ids()
+            assert torch.equal(incremental.top_k()[0], full.top_k()[0])
+    assert rebuilds >= 2
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+@pytest.mark.parametrize("coding", CODINGS)
+def test_tokens_round_trip(gpt2_checkpoint, coding, incremental):
+    protocol = LMProtocol(
+        GPT2Model,
+        context_window_length=8,
+        coding=coding,
+        unit="token",
+        language_model_kwargs={
+            "checkpoint": gpt2_checkpoint,
+            "device": "cpu",
+            "incremental": incremental,
+        },
+    )
+    text = "Tokens keep  every\nspace, and any character: é, ∑."
+    assert protocol.lm.decode_tokens(protocol.lm.encode_text(text)) == text
+    assert protocol.decompress(protocol.compress(text)) == text
+
+
+def test_incremental_predictions_do_not_depend_on_when_they_are_asked(
+    gpt2_checkpoint,
+):
+    every_word = get_model(gpt2_checkpoint, 4, incremental=True)
+    every_fifth_word = get_model(gpt2_checkpoint, 4, incremental=True)
+    words = SHORT_WORDS * 2
+    every_word.reset(words[:2])
+    every_fifth_word.reset(words[:2])
+
+    for i, word in enumerate(words[2:]):
+        every_word.add_word_to_context(word)
+        every_fifth_word.add_word_to_context(word)
+        token_ids, probabilities = every_word.top_k()
+        if i % 5 == 4:
+            assert every_fifth_word.get_context_key() == every_word.get_context_key()
+            other_token_ids, other_probabilities = every_fifth_word.top_k()
+            assert torch.equal(token_ids, other_token_ids)
+            assert torch.equal(probabilities, other_probabilities)
+
+
+def test_cache_hits_do_not_feed_the_model(gpt2_checkpoint, text):
+    cache = PredictionCache()
+    protocol = LMProtocol(
+        GPT2Model,
+        context_window_length=4,
+        prediction_cache=cache,
+        language_model_kwargs={
+            "checkpoint": gpt2_checkpoint,
+            "device": "cpu",
+            "incremental": True,
+        },
+    )
+    text = " ".join(text.split()[:40])
+    compressed = protocol.compress(text)
+    protocol.metrics.clear()
+    assert protocol.compress(text) == compressed
+    assert protocol.metrics.calls["forward"] == 0
+    assert protocol.decompress(compressed) == text
+
+
+def test_cascade_only_feeds_the_model_for_escalated_words(gpt2_checkpoint):
+    protocol = LMProtocol(
+        CascadeLanguageModel,
+        context_window_length=4,
+        language_model_kwargs={
+            "language_model": GPT2Model,
+            "language_model_kwargs": {
+                "checkpoint": gpt2_checkpoint,
+                "device": "cpu",
+                "incremental": True,
+            },
+        },
+    )
+    text = " ".join(SHORT_WORDS[:6] * 10)
+    compressed = protocol.compress(text)
+    stats = protocol.metrics.stats()
+    cascade = stats[str(protocol.lm)]
+    # The n-gram model answers the repeated words
+    assert cascade["ngram_predictions"] > cascade["model_predictions"]
+    # Words fed for an escalation take one pass each, a rebuild one pass
+    assert stats["timers"]["forward"]["calls"] < len(text.split()) / 2
+    assert protocol.decompress(compressed) == text
+
+
+def test_truncated_contexts_are_counted(gpt2_checkpoint, capsys):
+    lm = get_model(gpt2_checkpoint, 4)
+    lm.reset(SHORT_WORDS[:6])
+    assert list(lm.context) == SHORT_WORDS[2:6]
+    assert lm.metrics.counters["truncated_contexts"] == 1
+    assert capsys.readouterr().out == ""
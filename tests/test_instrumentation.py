@@ -0,0 +1,25 @@
+import threading
+
+from models.instrumentation import Metrics
+
+
+def test_concurrent_recording_loses_no_update():
+    metrics = Metrics()
+
+    def record():
+        for ranking in range(1000):
+            metrics.add_time("forward", 0.001)
+            metrics.count("batches")
+            metrics.count_ranking(ranking % 4)
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = metrics.stats()
+    assert stats["timers"]["forward"]["calls"] == 8000
+    assert stats["counters"]["batches"] == 8000
+    assert stats["counters"]["units"] == 8000
+    assert stats["ranking_histogram"] == [2000] * 4
@@ -0,0 +1,34 @@
+import pytest
+
+from models.ILanguageModel import ILanguageModel
+from models.stand_in import StandInModel
+
+
+class WordsOnlyModel(ILanguageModel):
+    """Model implementing every required method but top_k and get_vocabulary."""
+
+    def __init__(self, context_window_length=16, next_word_possibilities_number=16):
+        self.context = []
+
+    def reset(self, new_context):
+        self.context = list(new_context)
+
+    def add_word_to_context(self, word):
+        self.context.append(word)
+
+    def __str__(self):
+        return "Words only"
+
+    def __call__(self):
+        return {}
+
+
+def test_incomplete_models_fail_when_constructed():
+    with pytest.raises(TypeError):
+        WordsOnlyModel()
+
+
+def test_optional_capabilities_fail_when_called():
+    lm = StandInModel()
+    with pytest.raises(NotImplementedError):
+        lm.encode_text("Hello world")
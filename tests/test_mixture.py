@@ -0,0 +1,32 @@
+from LMProtocol import LMProtocol
+from models.mixture import MixtureLanguageModel
+from models.stand_in import DEFAULT_WORDS, StandInModel
+
+
+def get_protocol(coding="arithmetic"):
+    return LMProtocol(
+        MixtureLanguageModel,
+        coding=coding,
+        language_model_kwargs={
+            "language_models": [
+                (StandInModel, None),
+                (StandInModel, {"words": DEFAULT_WORDS[:-1]}),
+            ],
+        },
+    )
+
+
+def test_round_trip(text):
+    protocol = get_protocol()
+    try:
+        assert protocol.decompress(protocol.compress(text)) == text
+    finally:
+        protocol.close()
+
+
+def test_close_shuts_the_thread_pool_down():
+    protocol = get_protocol()
+    executor = protocol.lm.executor
+    protocol.close()
+    assert protocol.lm.executor is None
+    assert executor._shutdown
@@ -0,0 +1,139 @@
+import io
+import math
+
+import pytest
+
+from LMProtocol import CODINGS, FLAG_TOKENS, LMProtocol, get_stream_parameters
+from models.cache import PredictionCache
+from models.stand_in import DEFAULT_WORDS, StandInModel
+from priming import PrimingDictionary
+from stand_ins import ByteStandInModel
+
+
+@pytest.mark.parametrize("coding", CODINGS)
+def test_round_trip(text, coding):
+    protocol = LMProtocol(StandInModel, coding=coding)
+    compressed = protocol.compress(text)
+    assert get_stream_parameters(compressed)["coding"] == coding
+    assert protocol.decompress(compressed) == text
+
+
+
+@pytest.mark.parametrize("coding", CODINGS)
+def test_tokens_round_trip(coding):
+    protocol = LMProtocol(ByteStandInModel, coding=coding, unit="token")
+    text = "Tokens keep  every\nspace, and any character: é, ∑."
+    compressed = protocol.compress(text)
+    assert get_stream_parameters(compressed)["flags"] & FLAG_TOKENS
+    assert protocol.decompress(compressed) == text
+
+@pytest.mark.parametrize("coding", CODINGS)
+def test_spans_round_trip(text, coding):
+    protocol = LMProtocol(StandInModel, coding=coding, span_words_number=8)
+    assert protocol.decompress(protocol.compress(text)) == text
+
+
+@pytest.mark.parametrize("coding", CODINGS)
+def test_stream_round_trip(text, coding):
+    protocol = LMProtocol(StandInModel, coding=coding)
+    writer = io.BytesIO()
+    protocol.compress_stream(io.StringIO(text), writer, frame_words_number=50)
+    reader = io.StringIO()
+    protocol.decompress_stream(io.BytesIO(writer.getvalue()), reader, buffer_size=7)
+    assert reader.getvalue() == text
+    assert protocol.decompress(writer.getvalue()) == text
+
+
+@pytest.mark.parametrize("coding", CODINGS)
+def test_sync_points_decompress_ranges(text, coding):
+    protocol = LMProtocol(StandInModel, coding=coding, sync_words_number=64)
+    compressed = protocol.compress(text)
+    assert protocol.decompress(compressed) == text
+    words = text.split()
+    for start, end in [(0, 5), (60, 70), (64, 128), (200, 1000), (399, 400)]:
+        assert protocol.decompress_range(compressed, start, end) == " ".join(
+            words[start:end]
+        )
+
+
+@pytest.mark.parametrize("coding", CODINGS)
+def test_primed_round_trip(coding):
+    priming = PrimingDictionary(
+        "test", 1, "the people of the world said", ["Euler", "Gauss"]
+    )
+    protocol = LMProtocol(StandInModel, coding=coding, priming=priming)
+    text = "Euler said the Gauss of the"
+    compressed = protocol.compress(text)
+    assert get_stream_parameters(compressed)["priming"] == priming.get_id()
+    assert protocol.decompress(compressed) == text
+    with pytest.raises(ValueError):
+        LMProtocol(StandInModel, coding=coding).decompress(compressed)
+
+
+@pytest.mark.parametrize("coding", CODINGS)
+def test_chunked_round_trip(text, coding):
+    protocol = LMProtocol(StandInModel, coding=coding)
+    compressed = protocol.compress_chunked(text, chunk_words_number=100, workers=1)
+    assert protocol.decompress_chunked(compressed, workers=1) == text
+    assert protocol.decompress(compressed) == text
+    assert protocol.decompress_chunk(compressed, 1) == " ".join(
+        text.split()[100:200]
+    )
+    assert protocol.decompress_range(compressed, 90, 110) == " ".join(
+        text.split()[90:110]
+    )
+
+
+def test_chunks_must_be_longer_than_the_window(text):
+    protocol = LMProtocol(StandInModel, context_window_length=16)
+    with pytest.raises(ValueError):
+        protocol.compress_chunked(text, chunk_words_number=16, workers=1)
+
+
+@pytest.mark.parametrize("coding", CODINGS)
+def test_lockstep_round_trip(text, coding):
+    protocol = LMProtocol(StandInModel, coding=coding)
+    words = text.split()
+    texts = [" ".join(words[:150]), " ".join(words[150:]), " ".join(words[:40])]
+    compressed = protocol.compress_many(texts)
+    assert protocol.decompress_many(compressed) == texts
+    with pytest.raises(ValueError):
+        protocol.decompress(compressed[0])
+
+
+def test_header_mismatch_is_rejected(text):
+    compressed = LMProtocol(StandInModel, context_window_length=16).compress(text)
+    with pytest.raises(ValueError):
+        LMProtocol(StandInModel, context_window_length=8).decompress(compressed)
+    with pytest.raises(ValueError):
+        LMProtocol(StandInModel, next_word_possibilities_number=32).decompress(
+            compressed
+        )
+
+
+def test_verify_reruns_the_model(text):
+    cache = PredictionCache()
+    protocol = LMProtocol(StandInModel, prediction_cache=cache)
+    assert protocol.verify(text, chunk_words_number=100) == []
+    assert len(cache) == 0
+
+
+@pytest.mark.parametrize(
+    "protocol_kwargs", [{"span_words_number": 8}, {"sync_words_number": 64}]
+)
+def test_verify_modes(text, protocol_kwargs):
+    protocol = LMProtocol(StandInModel, **protocol_kwargs)
+    reference = LMProtocol(
+        StandInModel,
+        language_model_kwargs={"words": DEFAULT_WORDS[:-1]},
+        **protocol_kwargs,
+    )
+    assert protocol.verify(text, chunk_words_number=100) == []
+    assert protocol.verify(text, reference, chunk_words_number=100) != []
+
+
+def test_ranking_checksums_cover_every_prediction(text):
+    protocol = LMProtocol(StandInModel, context_window_length=16)
+    predictions_number = len(text.split()) - 16
+    checksums = protocol.get_ranking_checksums(text, chunk_words_number=64)
+    assert len(checksums) == math.ceil(predictions_number / 64)
@@ -0,0 +1,58 @@
+import torch
+
+from models.registry import ModelRegistry
+
+
+class FakeModel(torch.nn.Linear):
+    loads = 0
+
+    @classmethod
+    def from_pretrained(cls, checkpoint):
+        cls.loads += 1
+        return cls(2, 2)
+
+
+class FakeTokenizer:
+    def __init__(self, checkpoint, **kwargs):
+        self.checkpoint = checkpoint
+        self.kwargs = kwargs
+
+    @classmethod
+    def from_pretrained(cls, checkpoint, **kwargs):
+        return cls(checkpoint, **kwargs)
+
+
+class FakeTokenizerFast(FakeTokenizer):
+    pass
+
+
+def test_tokenizers_share_the_model(monkeypatch):
+    monkeypatch.setattr(FakeModel, "loads", 0)
+    registry = ModelRegistry()
+    model, tokenizer = registry.get(FakeModel, FakeTokenizer, "small")
+    fast_model, fast_tokenizer = registry.get(
+        FakeModel,
+        FakeTokenizerFast,
+        "small",
+        tokenizer_kwargs={"add_prefix_space": True},
+    )
+    assert fast_model is model and FakeModel.loads == 1
+    assert type(fast_tokenizer) is FakeTokenizerFast
+    assert fast_tokenizer.kwargs == {"add_prefix_space": True}
+    assert registry.get(FakeModel, FakeTokenizer, "small") == (model, tokenizer)
+    assert len(registry) == 1 and len(registry.stats()["tokenizers"]) == 2
+
+
+def test_least_recently_used_model_is_dropped(monkeypatch):
+    monkeypatch.setattr(FakeModel, "loads", 0)
+    registry = ModelRegistry(max_models=1)
+    registry.get(FakeModel, FakeTokenizer, "small")
+    registry.get(FakeModel, FakeTokenizer, "large")
+    stats = registry.stats()
+    assert [entry["checkpoint"] for entry in stats["models"]] == ["large"]
+    assert [entry["checkpoint"] for entry in stats["tokenizers"]] == ["large"]
+    registry.get(FakeModel, FakeTokenizer, "small")
+    assert FakeModel.loads == 3
+
+    registry.evict(checkpoint="small")
+    assert len(registry) == 0 and registry.stats()["tokenizers"] == []
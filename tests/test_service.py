@@ -0,0 +1,69 @@
+import asyncio
+import threading
+
+import pytest
+
+from LMProtocol import LMProtocol
+from models.stand_in import StandInModel
+from service import BatchScheduler, CompressionService
+from stand_ins import Int8StandInModel
+
+
+class BlockingStandInModel(StandInModel):
+    """Stand-in model whose batches wait for release to be set."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def batch_top_k(self, contexts):
+        self.started.set()
+        self.release.wait()
+        return super().batch_top_k(contexts)
+
+
+def test_service_round_trip(text):
+    protocol = LMProtocol(StandInModel, coding="arithmetic")
+    documents = [" ".join(text.split()[i:]) for i in range(0, 40, 10)]
+
+    async def run():
+        async with CompressionService(protocol, max_batch_size=4) as service:
+            compressed = await asyncio.gather(
+                *(service.compress(document) for document in documents)
+            )
+            decompressed = await asyncio.gather(
+                *(service.decompress(blob) for blob in compressed)
+            )
+            return compressed, decompressed, service.stats()
+
+    compressed, decompressed, stats = asyncio.run(run())
+    assert decompressed == documents
+    assert stats["mean_batch_size"] > 1
+    # Lockstep streams also decompress in one batch
+    assert protocol.decompress_many(compressed) == documents
+
+
+def test_service_rejects_int8():
+    with pytest.raises(ValueError):
+        CompressionService(LMProtocol(Int8StandInModel))
+
+
+def test_stop_resolves_the_running_batch():
+    lm = BlockingStandInModel(4, 8, ["a", "b", "c", "d"])
+    scheduler = BatchScheduler(lm, max_wait=0)
+
+    async def run():
+        scheduler.start()
+        with scheduler.job():
+            prediction = asyncio.ensure_future(scheduler.predict(["a", "b"]))
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, lm.started.wait)
+            stopping = asyncio.ensure_future(scheduler.stop())
+            await asyncio.sleep(0)
+            lm.release.set()
+            await asyncio.wait_for(stopping, 5)
+            return await asyncio.wait_for(prediction, 5)
+
+    token_ids, probabilities = asyncio.run(run())
+    assert len(token_ids) == len(probabilities) == 8
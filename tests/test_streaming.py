@@ -0,0 +1,32 @@
+import io
+import zlib
+
+import pytest
+
+from streaming import ByteReader, ZlibReader, iter_words
+
+
+def test_iter_words_across_buffers():
+    text = "Hello  world,\nthis is   a streamed text "
+    for buffer_size in [1, 2, 3, 7, 100]:
+        assert list(iter_words(io.StringIO(text), buffer_size)) == text.split()
+    assert list(iter_words(["Hel", "lo wo", "rld"])) == ["Hello", "world"]
+
+
+def test_byte_reader():
+    reader = ByteReader(io.BytesIO(b"abcdefgh"), buffer_size=3)
+    assert reader.read(2) == b"ab"
+    assert reader.read(4) == b"cdef"
+    assert b"".join(reader.read_rest()) == b"gh"
+    with pytest.raises(EOFError):
+        ByteReader([b"ab"]).read(3)
+
+
+def test_zlib_reader():
+    data = bytes(range(256)) * 64
+    compressed = zlib.compress(data)
+    buffers = [compressed[i : i + 10] for i in range(0, len(compressed), 10)]
+    reader = ZlibReader(buffers)
+    assert reader.read(100) + reader.read(len(data) - 100) == data
+    with pytest.raises(EOFError):
+        reader.read(1)